@@ -0,0 +1,18 @@
+# ----
+# Makes the app packages under src/ importable from the benchmark scripts and
+# provides placeholder settings so no .env is needed to run them
+# ----
+
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+REPO_DIR = BACKEND_DIR.parent
+SAMPLE_MENU_PATH = REPO_DIR / "training" / "menu.json"
+
+sys.path.insert(0, str(BACKEND_DIR / "src"))
+
+os.environ.setdefault("MENU_BACKEND_URL", "http://127.0.0.1:8765/menu")
+os.environ.setdefault("PORT", "7001")
+os.environ.setdefault("GOOGLE_API_KEY", "unused-by-benchmarks")
@@ -0,0 +1,129 @@
+# ----
+# Boots the FastAPI app (src/main.py) for load testing: the chat model is
+# replaced by the scripted fake, the menu comes from the local menu server, orders
+# go to the local order server and /bench/stats reports event-loop lag and RSS of
+# the server process.
+#
+#   cd backend && python -m benchmarks.bench_app --port 7101
+# ----
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import uvicorn
+
+from benchmarks.menu_server import MenuServer
+from benchmarks.order_server import OrderServer
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # not Linux, the peak RSS is the best we have
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoopLagMonitor:
+    """Samples how late a short sleep wakes up, i.e. how long the loop was blocked."""
+
+    def __init__(self, interval: float = 0.01, samples: int = 100_000):
+        self.interval = interval
+        self.samples = deque(maxlen=samples)
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - started - self.interval)
+
+    def stats(self) -> dict:
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+
+        def at(q):
+            return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+        return {"samples": len(samples), "p50_ms": at(0.5), "p99_ms": at(0.99), "max_ms": at(1.0)}
+
+
+def build_app(llm_latency: float, token_delay: float, slow_rate: float = 0.0, slow_latency: float = 0.0,
+              failure_rate: float = 0.0):
+    from benchmarks.fake_llm import install_fake_llm
+
+    fake = install_fake_llm(latency=llm_latency, token_delay=token_delay, slow_rate=slow_rate,
+                            slow_latency=slow_latency, failure_rate=failure_rate)
+    import main
+
+    monitor = LoopLagMonitor()
+    app_lifespan = main.app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with app_lifespan(app):
+            task = asyncio.create_task(monitor.run())
+            yield
+            task.cancel()
+
+    main.app.router.lifespan_context = lifespan
+
+    @main.app.get("/bench/stats")
+    def bench_stats():
+        return {"rss_bytes": rss_bytes(), "loop_lag": monitor.stats(), "llm_calls": fake.calls,
+                "llm_failures": fake.failures}
+
+    @main.app.post("/bench/reset")
+    def bench_reset():
+        monitor.samples.clear()
+        fake.calls = 0
+        fake.failures = 0
+        return {"status": "ok"}
+
+    return main.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend against the fake LLM")
+    parser.add_argument("--port", type=int, default=7101)
+    parser.add_argument("--menu-port", type=int, default=8765)
+    parser.add_argument("--menu-delay", type=float, default=0.0)
+    parser.add_argument("--order-port", type=int, default=8766)
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="seconds before the fake model's first token")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="seconds between the fake model's streamed words")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0,
+                        help="share of the fake model's calls that are slow")
+    parser.add_argument("--llm-slow-latency", type=float, default=0.0,
+                        help="seconds a slow call waits on top of --llm-latency")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0,
+                        help="share of the fake model's calls that fail")
+    args = parser.parse_args()
+
+    # read by the settings when the app is imported
+    os.environ["MENU_BACKEND_URL"] = f"http://127.0.0.1:{args.menu_port}/menu"
+    os.environ["ORDER_BACKEND_URL"] = f"http://127.0.0.1:{args.order_port}/orders"
+
+    MenuServer(args.menu_port, delay=args.menu_delay).start()
+    OrderServer(args.order_port).start()
+    app = build_app(args.llm_latency, args.token_delay, args.llm_slow_rate, args.llm_slow_latency,
+                    args.llm_failure_rate)
+
+    # per-turn INFO logs would measure the log handlers, not the backend
+    logging.getLogger().setLevel(logging.WARNING)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# ----
+# Checkpoint write amplification benchmark: bytes written and CPU per turn as a
+# conversation grows, for the stock MemorySaver and our checkpointers.
+#
+#   cd backend && python -m benchmarks.checkpoint_bench --turns 60 --output checkpoint_bench.json
+# ----
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from benchmarks._setup import SAMPLE_MENU_PATH
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.graph import StateGraph, START, END
+
+from agents.checkpointer import BoundedMemorySaver, SqliteCheckpointer
+from agents.state import Cart, OrderState
+from services.menu_index import MenuIndex
+
+
+class CountingSerializer(JsonPlusSerializer):
+    """Counts every byte the saver serializes, i.e. what it has to write."""
+
+    def __init__(self):
+        super().__init__()
+        self.bytes = 0
+
+    def dumps_typed(self, obj):
+        type_, data = super().dumps_typed(obj)
+        self.bytes += len(data)
+        return type_, data
+
+
+def build_graph(checkpointer, menu_json: str):
+    """Scripted stand-in for one chat turn: LLM -> tool -> LLM, no model involved."""
+
+    def chatbot(state: OrderState):
+        turn = len(state["messages"])
+        call_id = str(uuid.uuid4())
+        tool_name = "get_menu" if turn % 3 == 1 else "add_cart"
+        return {"messages": [AIMessage("", tool_calls=[
+            {"name": tool_name, "args": {}, "id": call_id}])]}
+
+    def tools(state: OrderState):
+        call = state["messages"][-1].tool_calls[0]
+        turn = len(state["messages"])
+        update = {}
+        if call["name"] == "get_menu":
+            content = menu_json
+        else:
+            # a handful of distinct items whose quantities keep growing, like a real cart
+            cart = (state.get("cart") or Cart()).copy_lines()
+            cart.add(f"item-{turn % 5}", "Paneer Butter Masala", 1, 320)
+            update["cart"] = cart
+            content = "Added Paneer Butter Masala to cart"
+        update["messages"] = [
+            ToolMessage(content, name=call["name"], tool_call_id=call["id"]),
+            AIMessage("Namaste! Anything else you would like to order today?"),
+        ]
+        return update
+
+    graph = StateGraph(OrderState)
+    graph.add_node("chatbot", chatbot)
+    graph.add_node("tools", tools)
+    graph.add_edge(START, "chatbot")
+    graph.add_edge("chatbot", "tools")
+    graph.add_edge("tools", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+async def run(name: str, checkpointer, bytes_written, turns: int, menu_json: str) -> list:
+    graph = build_graph(checkpointer, menu_json)
+    config = {"configurable": {"thread_id": f"bench-{name}"}}
+    rows = []
+    for turn in range(1, turns + 1):
+        before_bytes = bytes_written()
+        before_cpu = time.process_time()
+        await graph.ainvoke({
+            "messages": [HumanMessage(f"I would like one more item please ({turn})")],
+            "restaurant_name": "Benchmark Restaurant",
+            "subdomain": "bench",
+            "orderId": None,
+            "finished": False,
+        }, config)
+        rows.append({
+            "turn": turn,
+            "bytes_written": bytes_written() - before_bytes,
+            "cpu_ms": round((time.process_time() - before_cpu) * 1000, 3),
+        })
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--output", type=Path,
+                        help="write the per-turn results as JSON")
+    args = parser.parse_args()
+
+    menu_json = MenuIndex(json.loads(SAMPLE_MENU_PATH.read_text())).compact_json
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stock_serde = CountingSerializer()
+        bounded_serde = CountingSerializer()
+        sqlite = SqliteCheckpointer(
+            str(Path(tmp) / "bench.sqlite"), keep_latest=3)
+        savers = {
+            "stock_memory": (InMemorySaver(serde=stock_serde), lambda: stock_serde.bytes),
+            "bounded_memory": (BoundedMemorySaver(keep_latest=3, serde=bounded_serde), lambda: bounded_serde.bytes),
+            "sqlite": (sqlite, lambda: sqlite.bytes_written),
+        }
+        results = {}
+        for name, (saver, bytes_written) in savers.items():
+            results[name] = await run(name, saver, bytes_written, args.turns, menu_json)
+        sqlite.close()
+
+    print(f"{'turn':>5} " + " ".join(f"{name + ' B':>16} {'cpu ms':>8}" for name in results))
+    for index in range(args.turns):
+        turn = index + 1
+        if turn in (1, 2, 5) or turn % 10 == 0:
+            print(f"{turn:>5} " + " ".join(
+                f"{rows[index]['bytes_written']:>16} {rows[index]['cpu_ms']:>8}" for rows in results.values()))
+    print("total bytes " + " ".join(
+        f"{name}={sum(row['bytes_written'] for row in rows)}" for name, rows in results.items()))
+
+    if args.output:
+        args.output.write_text(json.dumps(
+            {"turns": args.turns, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
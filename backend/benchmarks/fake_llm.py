@@ -0,0 +1,171 @@
+# ----
+# Scripted stand-in for the chat model: answers with canned tool calls picked
+# from the customer's words and the sample menu, with a configurable latency
+# and injected slow or failed calls, so the backend can be load tested without
+# calling Gemini.
+# ----
+
+import asyncio
+import json
+import random
+import uuid
+from typing import Any, Dict, List, Optional
+
+from benchmarks._setup import SAMPLE_MENU_PATH
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from services.menu_index import MenuIndex, normalize
+
+
+def _estimate_tokens(messages: List[BaseMessage]) -> int:
+    return sum(len(str(message.content)) for message in messages) // 4
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Picks its reply from the last message:
+
+    - customer mentions the menu -> get_menu (a text reply when the conversation
+      already has it), "find"/"search" -> search_menu
+    - customer names menu items -> one update_cart call adding all of them
+    - "cart" -> get_cart, "confirm" -> confirm_order, "place" -> place_order
+    - anything else, or a tool result -> a short text reply streamed word by word
+    """
+
+    # seconds before the first token and between streamed words
+    latency: float = 0.0
+    token_delay: float = 0.0
+    # injected faults: this share of calls waits `slow_latency` more, this share fails
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+    failure_rate: float = 0.0
+    menu: Dict[str, Any] = {}
+    calls: int = 0
+    failures: int = 0
+
+    _orderable: List[dict] = PrivateAttr(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def model_post_init(self, __context):
+        super().model_post_init(__context)
+        if not self.menu:
+            self.menu = json.loads(SAMPLE_MENU_PATH.read_text())
+        index = MenuIndex(self.menu)
+        # plain priced items, longest titles first so "masala dosa" wins over "masala"
+        self._orderable = sorted(
+            (item for item in index.items.values() if "price" in item and item.get("available", True)),
+            key=lambda item: -len(item["title"]))
+
+    def _tool_call(self, name: str, args: Optional[dict] = None) -> AIMessage:
+        return AIMessage("", tool_calls=[{"name": name, "args": args or {}, "id": str(uuid.uuid4())}])
+
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            reply = AIMessage(f"Namaste! {str(last.content)[:80]} Anything else I can get you?")
+        elif isinstance(last, HumanMessage):
+            menu_known = any(isinstance(message, ToolMessage) and message.name == "get_menu"
+                             for message in messages)
+            reply = self._respond_to_customer(normalize(str(last.content)), menu_known)
+        else:
+            reply = AIMessage("Namaste! How may I serve you today?")
+
+        prompt_tokens = _estimate_tokens(messages)
+        completion_tokens = len(str(reply.content)) // 4 + 10 * len(reply.tool_calls)
+        reply.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                "total_tokens": prompt_tokens + completion_tokens}
+        return reply
+
+    def _respond_to_customer(self, text: str, menu_known: bool = False) -> AIMessage:
+        if "place" in text:
+            return self._tool_call("place_order")
+        if "confirm" in text:
+            return self._tool_call("confirm_order")
+
+        padded = f" {text} "
+        operations = []
+        for item in self._orderable:
+            title = normalize(item["title"])
+            if f" {title} " in padded:
+                padded = padded.replace(f" {title} ", " ")
+                operations.append({"op": "add", "item_id": item["id"], "title": item["title"],
+                                   "quantity": 1, "base_price": item["price"]})
+        if operations:
+            return self._tool_call("update_cart", {"operations": operations})
+
+        if "find" in text or "search" in text:
+            query = text.split("find" if "find" in text else "search", 1)[1].strip()
+            return self._tool_call("search_menu", {"query": query or "tea"})
+        if "menu" in text:
+            if menu_known:
+                return AIMessage("Namaste! Here is our menu, what would you like to order?")
+            return self._tool_call("get_menu")
+        if "cart" in text:
+            return self._tool_call("get_cart")
+        return AIMessage("Namaste! What would you like to order today?")
+
+    async def _first_token(self):
+        """Wait like the model would before answering, and fail when told to."""
+        self.calls += 1
+        latency = self.latency
+        if self.slow_rate and random.random() < self.slow_rate:
+            latency += self.slow_latency
+        await asyncio.sleep(latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.failures += 1
+            raise RuntimeError("injected model failure")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await self._first_token()
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await self._first_token()
+        reply = self._respond(messages)
+
+        if reply.tool_calls:
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content="", usage_metadata=reply.usage_metadata, tool_call_chunks=[
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+                    for index, call in enumerate(reply.tool_calls)]))
+            if run_manager:
+                await run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+            return
+
+        words = str(reply.content).split(" ")
+        for position, word in enumerate(words):
+            if position:
+                await asyncio.sleep(self.token_delay)
+            text = word if position == len(words) - 1 else word + " "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=text, usage_metadata=reply.usage_metadata if position == 0 else None))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+
+def install_fake_llm(latency: float = 0.0, token_delay: float = 0.0, slow_rate: float = 0.0,
+                     slow_latency: float = 0.0, failure_rate: float = 0.0) -> ScriptedChatModel:
+    """Make the model registry hand out the scripted model for every tenant (and every failover model)."""
+    from services.model_registry import model_registry
+
+    model = ScriptedChatModel(latency=latency, token_delay=token_delay, slow_rate=slow_rate,
+                              slow_latency=slow_latency, failure_rate=failure_rate)
+    model_registry.get_model = lambda *args, **kwargs: model
+    model_registry.get_bound_model = lambda *args, **kwargs: model
+    return model
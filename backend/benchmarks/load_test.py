@@ -0,0 +1,264 @@
+# ----
+# Offline load test: boots the app against the fake LLM and the local menu
+# server, drives concurrent conversations through /api/chats/orders (SSE) or
+# /api/chats/ws (--transport ws) and reports throughput, latency percentiles,
+# event-loop lag and memory per session.
+#
+#   cd backend && python -m benchmarks.load_test --sessions 50 --turns 7 --output load.json
+# ----
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+from urllib.parse import urlencode
+
+import httpx
+from websockets.asyncio.client import connect
+from websockets.exceptions import WebSocketException
+
+from benchmarks._setup import BACKEND_DIR
+
+# a typical conversation, a mix of turns the router answers and turns for the model
+CONVERSATION = [
+    "Hi",
+    "Show me the menu",
+    "Add 2 paneer butter masala",
+    "I would like a masala dosa and a masala chai",
+    "What's in my cart?",
+    "Please confirm my order",
+    "Yes",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def at(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+    return {"p50_ms": at(0.5), "p95_ms": at(0.95), "p99_ms": at(0.99), "max_ms": at(1.0)}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def wait_until_up(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("the benchmark server exited, see its log")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("the benchmark server did not start in time")
+
+
+async def run_session(client: httpx.AsyncClient, session: int, turns: int, stream_tokens: bool,
+                      samples: dict):
+    session_id = f"load-{session}-{time.time_ns()}"
+    answered = []
+    for turn in range(turns):
+        payload = {
+            "user_message": CONVERSATION[turn % len(CONVERSATION)],
+            "session_id": session_id,
+            "restaurant_name": "Benchmark Restaurant",
+            "subdomain": f"bench{session % 4}",
+            "stream_tokens": stream_tokens,
+        }
+        started = time.perf_counter()
+        first_byte = None
+        body = b""
+        try:
+            async with client.stream("POST", "/api/chats/orders", json=payload) as response:
+                async for chunk in response.aiter_raw():
+                    if first_byte is None and chunk:
+                        first_byte = time.perf_counter() - started
+                    body += chunk
+                if response.status_code in (429, 503):
+                    # turned away by admission control, the server is shedding load as intended
+                    samples["rejected"] += 1
+                    continue
+                if response.status_code != 200:
+                    samples["errors"] += 1
+                    continue
+        except httpx.HTTPError:
+            samples["errors"] += 1
+            continue
+        if b"event: error\n" in body:
+            # no model answered in time, the turn ended with the fallback reply
+            samples["model_errors"] += 1
+        samples["ttfb"].append(first_byte or 0.0)
+        answered.append(time.perf_counter() - started)
+    samples["total"].extend(answered)
+    if len(answered) == turns:
+        samples["conversation"].append(sum(answered))
+
+
+async def run_session_ws(client: httpx.AsyncClient, session: int, turns: int, stream_tokens: bool,
+                         samples: dict):
+    """The same conversation over one WebSocket session (always token streamed)."""
+    session_id = f"load-{session}-{time.time_ns()}"
+    query = urlencode({"session_id": session_id, "restaurant_name": "Benchmark Restaurant",
+                       "subdomain": f"bench{session % 4}"})
+    url = f"{str(client.base_url).replace('http', 'ws', 1).rstrip('/')}/api/chats/ws?{query}"
+    answered = []
+    try:
+        async with connect(url, max_queue=None) as websocket:
+            await websocket.recv()  # ready
+            for turn in range(turns):
+                message_id = str(turn)
+                started = time.perf_counter()
+                first_byte = None
+                await websocket.send(json.dumps({"type": "message", "id": message_id,
+                                                 "content": CONVERSATION[turn % len(CONVERSATION)]}))
+                while True:
+                    event = json.loads(await websocket.recv())
+                    if event["type"] in ("ping", "pong", "order_status", "turn_start"):
+                        continue
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - started
+                    if event["type"] == "turn_end":
+                        samples["ttfb"].append(first_byte)
+                        answered.append(time.perf_counter() - started)
+                        break
+                    if event["type"] == "error" and event.get("code", "").startswith("model_"):
+                        # answered with the fallback reply, the turn still ends normally
+                        samples["model_errors"] += 1
+                    elif event["type"] == "error":
+                        # turned away (rate limited, queue full, busy) or failed, no turn_end follows
+                        samples["rejected" if event.get("retryable") and event.get("code") != "internal_error"
+                                else "errors"] += 1
+                        break
+    except (OSError, WebSocketException) as e:
+        samples["errors"] += 1
+        print(f"session {session} failed: {e!r}", file=sys.stderr)
+    samples["total"].extend(answered)
+    if len(answered) == turns:
+        samples["conversation"].append(sum(answered))
+
+
+def new_samples() -> dict:
+    return {"ttfb": [], "total": [], "conversation": [], "errors": 0, "rejected": 0, "model_errors": 0}
+
+
+async def run(args) -> dict:
+    port = free_port()
+    menu_port = free_port()
+    order_port = free_port()
+    env = {**os.environ, "PYTHONPATH": str(BACKEND_DIR), "CHECKPOINTER_BACKEND": args.checkpointer,
+           "MENU_SEED_ENABLED": str(not args.no_menu_seed).lower()}
+
+    with tempfile.TemporaryDirectory() as workdir, open(args.server_log, "w") as server_log:
+        # its own process, so the load generator does not share the event loop it measures
+        process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_app", "--port", str(port),
+             "--menu-port", str(menu_port), "--order-port", str(order_port),
+             "--llm-latency", str(args.llm_latency),
+             "--token-delay", str(args.token_delay),
+             "--llm-slow-rate", str(args.llm_slow_rate),
+             "--llm-slow-latency", str(args.llm_slow_latency),
+             "--llm-failure-rate", str(args.llm_failure_rate)],
+            cwd=workdir, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+        try:
+            limits = httpx.Limits(max_connections=args.sessions + 10)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits,
+                                         timeout=args.request_timeout) as client:
+                await wait_until_up(client, process)
+
+                # one warm-up conversation builds the menu indexes and the model bindings
+                session_runner = run_session_ws if args.transport == "ws" else run_session
+                await session_runner(client, -1, len(CONVERSATION), args.stream_tokens, new_samples())
+                await client.post("/bench/reset")
+                before = (await client.get("/bench/stats")).json()
+
+                samples = new_samples()
+                started = time.perf_counter()
+                await asyncio.gather(*(session_runner(client, session, args.turns, args.stream_tokens, samples)
+                                       for session in range(args.sessions)))
+                elapsed = time.perf_counter() - started
+
+                after = (await client.get("/bench/stats")).json()
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    turns = len(samples["total"])
+    return {
+        "revision": git_revision(),
+        "config": {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        "turns": turns,
+        "errors": samples["errors"],
+        "rejected": samples["rejected"],
+        "model_errors": samples["model_errors"],
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(turns / elapsed, 2) if elapsed else 0,
+        "ttfb": percentiles(samples["ttfb"]),
+        "latency": percentiles(samples["total"]),
+        # wall time of a whole conversation, where a saved model round trip on its first turns shows
+        "conversation": percentiles(samples["conversation"]),
+        "llm_calls_per_conversation": round(after["llm_calls"] / args.sessions, 2),
+        "loop_lag": after["loop_lag"],
+        "llm_calls": after["llm_calls"],
+        "llm_failures": after["llm_failures"],
+        "rss_before_bytes": before["rss_bytes"],
+        "rss_after_bytes": after["rss_bytes"],
+        "rss_per_session_bytes": round((after["rss_bytes"] - before["rss_bytes"]) / args.sessions),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat backend with a fake LLM")
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent conversations")
+    parser.add_argument("--turns", type=int, default=len(CONVERSATION), help="turns per conversation")
+    parser.add_argument("--stream-tokens", action="store_true", help="use the token SSE stream")
+    parser.add_argument("--transport", default="sse", choices=["sse", "ws"],
+                        help="a POST per turn (SSE) or one WebSocket session per conversation")
+    parser.add_argument("--llm-latency", type=float, default=0.5,
+                        help="seconds before the fake model's first token")
+    parser.add_argument("--token-delay", type=float, default=0.01,
+                        help="seconds between the fake model's streamed words")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0,
+                        help="share of the fake model's calls that are slow (tail latency)")
+    parser.add_argument("--llm-slow-latency", type=float, default=5.0,
+                        help="seconds a slow call waits on top of --llm-latency")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0,
+                        help="share of the fake model's calls that fail")
+    parser.add_argument("--checkpointer", default="memory", choices=["memory", "sqlite"])
+    parser.add_argument("--no-menu-seed", action="store_true",
+                        help="do not give new conversations the menu up front (MENU_SEED_ENABLED)")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--server-log", type=Path, default=Path(tempfile.gettempdir()) / "bench_app.log")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
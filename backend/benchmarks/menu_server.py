@@ -0,0 +1,77 @@
+# ----
+# Local stand-in for the menu backend: serves training/menu.json to every
+# subdomain, with ETag revalidation and an optional artificial delay.
+#
+#   cd backend && python -m benchmarks.menu_server --port 8765
+# ----
+
+import argparse
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from benchmarks._setup import SAMPLE_MENU_PATH
+
+
+class MenuServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, menu_path: Path = SAMPLE_MENU_PATH, delay: float = 0.0):
+        super().__init__(("127.0.0.1", port), MenuRequestHandler)
+        self.body = menu_path.read_bytes()
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        self.delay = delay
+        self.requests = {200: 0, 304: 0}
+
+    def start(self) -> threading.Thread:
+        """Serve from a daemon thread, for use inside a benchmark process."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class MenuRequestHandler(BaseHTTPRequestHandler):
+    server: MenuServer
+
+    def do_GET(self):
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        if self.headers.get("If-None-Match") == self.server.etag:
+            self.server.requests[304] += 1
+            self.send_response(304)
+            self.send_header("ETag", self.server.etag)
+            self.end_headers()
+            return
+
+        self.server.requests[200] += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.send_header("ETag", self.server.etag)
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the sample menu to the backend")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds to wait before answering each request")
+    args = parser.parse_args()
+
+    server = MenuServer(args.port, delay=args.delay)
+    print(f"Serving {SAMPLE_MENU_PATH} on http://127.0.0.1:{args.port}/menu")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
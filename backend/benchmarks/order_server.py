@@ -0,0 +1,98 @@
+# ----
+# Local stand-in for the order backend: accepts batches of orders on POST
+# /orders, deduplicated by idempotency key, with an optional artificial delay
+# and share of failed requests to exercise the dispatcher's retries.
+#
+#   cd backend && python -m benchmarks.order_server --port 8766 --failure-rate 0.3
+#   ORDER_BACKEND_URL=http://127.0.0.1:8766/orders
+# ----
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class OrderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, delay: float = 0.0, failure_rate: float = 0.0):
+        super().__init__(("127.0.0.1", port), OrderRequestHandler)
+        self.delay = delay
+        self.failure_rate = failure_rate
+        # idempotency key -> backend order id
+        self.orders: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.requests = {"batches": 0, "orders": 0, "duplicates": 0, "failed": 0}
+
+    def start(self) -> threading.Thread:
+        """Serve from a daemon thread, for use inside a benchmark process."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def accept(self, order: dict) -> dict:
+        if not order.get("lines"):
+            return {"idempotency_key": order.get("idempotency_key"), "status": "rejected", "error": "empty order"}
+        with self.lock:
+            key = order["idempotency_key"]
+            if key in self.orders:
+                self.requests["duplicates"] += 1
+            else:
+                self.orders[key] = f"R{len(self.orders) + 1:06d}"
+                self.requests["orders"] += 1
+            return {"idempotency_key": key, "status": "accepted", "order_id": self.orders[key]}
+
+
+class OrderRequestHandler(BaseHTTPRequestHandler):
+    server: OrderServer
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.server.requests["batches"] += 1
+        if random.random() < self.server.failure_rate:
+            self.server.requests["failed"] += 1
+            self._send(503, {"error": "order backend unavailable"})
+            return
+        orders = json.loads(body).get("orders", [])
+        self._send(200, {"results": [self.server.accept(order) for order in orders]})
+
+    def do_GET(self):
+        self._send(200, self.server.requests)
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accept orders from the backend's dispatcher")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds to wait before answering each request")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="share of requests answered with 503")
+    args = parser.parse_args()
+
+    server = OrderServer(args.port, delay=args.delay, failure_rate=args.failure_rate)
+    print(f"Accepting orders on http://127.0.0.1:{args.port}/orders")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# ----
+# Replays recorded conversation traces (see TRACE_FILE) through the agent graph:
+# the model answers from the recording, in order, and the menus are served from
+# the trace. Reports per session the model round trips, tool calls, prompt
+# tokens and wall time, compared with the recording or with a baseline report,
+# so prompt or graph changes that add round trips are caught before deploy.
+#
+#   cd backend && python -m benchmarks.replay traces.jsonl --output replay.json
+#   python -m benchmarks.replay traces.jsonl --baseline replay.json --fail-on-regression
+# ----
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks._setup import BACKEND_DIR  # noqa: F401 (puts src/ on the path)
+from benchmarks.load_test import free_port, git_revision
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+# answered when the graph asks the model more often than it did in the recording
+REPLAY_EXHAUSTED = "[replay: no recorded response left]"
+# counts compared with the reference, an increase is a regression
+COUNTED = ("llm_calls", "tool_calls", "missing_responses")
+
+
+def load_traces(path: Path) -> Tuple[Dict[Tuple[str, str], dict], "OrderedDict[str, List[dict]]"]:
+    """Menus by (subdomain, version) and the turns of every session, in recorded order."""
+    menus, sessions = {}, OrderedDict()
+    with open(path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["type"] == "menu":
+                menus[(record["subdomain"], record["version"])] = record["menu"]
+            elif record["type"] == "turn":
+                sessions.setdefault(record["session_id"], []).append(record)
+    return menus, sessions
+
+
+class RecordedMenuServer(ThreadingHTTPServer):
+    """Serves the recorded menu of each subdomain, with its recorded version as the ETag."""
+    daemon_threads = True
+
+    def __init__(self, port: int):
+        super().__init__(("127.0.0.1", port), RecordedMenuHandler)
+        # subdomain -> (version, body)
+        self.menus: Dict[str, Tuple[str, bytes]] = {}
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class RecordedMenuHandler(BaseHTTPRequestHandler):
+    server: RecordedMenuServer
+
+    def do_GET(self):
+        subdomain = parse_qs(urlparse(self.path).query).get("subdomain", [""])[0]
+        if subdomain not in self.server.menus:
+            self.send_response(404)
+            self.end_headers()
+            return
+        version, body = self.server.menus[subdomain]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", version)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayChatModel(BaseChatModel):
+    """Answers every call with the next recorded response, whatever the prompt."""
+
+    missing: int = 0
+    _responses: Deque[BaseMessage] = PrivateAttr(default_factory=deque)
+
+    @property
+    def _llm_type(self) -> str:
+        return "trace-replay"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def load(self, responses: List[dict]):
+        self._responses = deque(messages_from_dict(responses))
+        self.missing = 0
+
+    @property
+    def unused(self) -> int:
+        return len(self._responses)
+
+    def _next(self) -> BaseMessage:
+        if self._responses:
+            return self._responses.popleft()
+        self.missing += 1
+        return AIMessage(REPLAY_EXHAUSTED)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._next())])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._next())])
+
+
+def summarize(turns: List[dict]) -> dict:
+    return {
+        "turns": len(turns),
+        "llm_calls": sum(len(turn["llm"]) for turn in turns),
+        "summary_calls": sum(1 for turn in turns for call in turn["llm"] if call["kind"] == "summary"),
+        "tool_calls": sum(len(turn["tools"]) for turn in turns),
+        "prompt_tokens": sum(call["prompt_tokens"] for turn in turns for call in turn["llm"]),
+        "wall_s": round(sum(turn["wall_s"] for turn in turns), 4),
+        "tools": [tool["name"] for turn in turns for tool in turn["tools"]],
+    }
+
+
+def compare(replayed: dict, reference: dict, token_tolerance: float,
+            wall_tolerance: Optional[float]) -> Tuple[dict, List[str]]:
+    diff, regressions = {}, []
+    for metric in COUNTED + ("prompt_tokens", "wall_s"):
+        before, after = reference.get(metric, 0), replayed.get(metric, 0)
+        diff[metric] = round(after - before, 4)
+        if metric in COUNTED and after > before:
+            regressions.append(f"{metric} {before} -> {after}")
+    tokens_before = reference.get("prompt_tokens", 0)
+    if tokens_before and replayed["prompt_tokens"] > tokens_before * (1 + token_tolerance):
+        regressions.append(f"prompt_tokens {tokens_before} -> {replayed['prompt_tokens']}")
+    wall_before = reference.get("wall_s", 0)
+    if wall_tolerance is not None and wall_before and replayed["wall_s"] > wall_before * (1 + wall_tolerance):
+        regressions.append(f"wall_s {wall_before} -> {replayed['wall_s']}")
+    if replayed["tools"] != reference.get("tools", replayed["tools"]):
+        diff["tools"] = {"before": reference["tools"], "after": replayed["tools"]}
+    return diff, regressions
+
+
+async def replay_session(agent, models: Dict[str, ReplayChatModel], turns: List[dict]) -> dict:
+    from services.metrics import start_turn
+    from services.traces import trace_recorder
+
+    for kind, model in models.items():
+        model.load([call["response"] for turn in turns for call in turn["llm"] if call["kind"] == kind])
+
+    session_id = turns[0]["session_id"]
+    config = {"configurable": {"thread_id": session_id}}
+    replayed = []
+    for recorded in turns:
+        graph_input = {"messages": [{"role": "user", "content": recorded["input"]}],
+                       "restaurant_name": recorded["restaurant_name"], "subdomain": recorded["subdomain"]}
+        turn = start_turn(recorded["subdomain"])
+        trace = trace_recorder.begin(session_id, graph_input)
+        await agent.ainvoke(graph_input, config)
+        replayed.append(trace.record(turn.elapsed, turn.nodes))
+
+    summary = summarize(replayed)
+    summary["missing_responses"] = sum(model.missing for model in models.values())
+    summary["unused_responses"] = sum(model.unused for model in models.values())
+    return summary
+
+
+async def run(args) -> dict:
+    menus, sessions = load_traces(args.traces)
+    menu_server = RecordedMenuServer(free_port())
+    menu_server.start()
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    # read by the settings when the app modules are imported below
+    os.environ.update({
+        "MENU_BACKEND_URL": f"http://127.0.0.1:{menu_server.server_port}/menu",
+        "CHECKPOINTER_BACKEND": "memory",
+        "ORDER_QUEUE_DB_PATH": os.path.join(workdir, "orders.sqlite"),
+        "TRACE_FILE": "",
+    })
+    from agents.graph import chatbot_agent_builder
+    from services.menu_cache import menu_cache
+    from services.model_registry import model_registry
+
+    models = {"chat": ReplayChatModel(), "summary": ReplayChatModel()}
+    # the chatbot uses the tool-bound model, the context manager the plain one for summaries
+    model_registry.get_bound_model = lambda *_, **__: models["chat"]
+    model_registry.get_model = lambda *_, **__: models["summary"]
+    agent = chatbot_agent_builder()
+
+    baseline = json.loads(args.baseline.read_text())["sessions"] if args.baseline else {}
+    report = {}
+    for session_id, turns in sessions.items():
+        # the menus the session was served with
+        for turn in turns:
+            for subdomain, version in turn["menus"].items():
+                if (subdomain, version) in menus and subdomain not in menu_server.menus:
+                    menu_server.menus[subdomain] = (version, json.dumps(menus[(subdomain, version)]).encode())
+        for subdomain in {turn["subdomain"] for turn in turns}:
+            menu_cache.invalidate(subdomain)
+
+        replayed = await replay_session(agent, models, turns)
+        recorded = {**summarize(turns), "missing_responses": 0}
+        reference = baseline.get(session_id, {}).get("replayed") if args.baseline else recorded
+        entry = {"recorded": recorded, "replayed": replayed}
+        if reference is not None:
+            # wall time is only comparable between two replays, the recording includes the model's latency
+            entry["diff"], entry["regressions"] = compare(
+                replayed, reference, args.token_tolerance, args.wall_tolerance if args.baseline else None)
+        report[session_id] = entry
+        menu_server.menus.clear()
+
+    totals = {metric: sum(entry["replayed"][metric] for entry in report.values())
+              for metric in ("turns", "llm_calls", "tool_calls", "prompt_tokens", "missing_responses")}
+    return {
+        "revision": git_revision(),
+        "traces": str(args.traces),
+        "reference": str(args.baseline) if args.baseline else "recording",
+        "totals": totals,
+        "regressions": sum(len(entry.get("regressions", [])) for entry in report.values()),
+        "sessions": report,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded conversation traces through the agent")
+    parser.add_argument("traces", type=Path, help="trace file written by the server (TRACE_FILE)")
+    parser.add_argument("--baseline", type=Path, help="earlier replay report to compare with, "
+                                                      "instead of the recording itself")
+    parser.add_argument("--token-tolerance", type=float, default=0.05,
+                        help="prompt token increase tolerated before it counts as a regression")
+    parser.add_argument("--wall-tolerance", type=float, default=0.5,
+                        help="wall time increase tolerated against a baseline")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with 1 on any regression")
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps({key: result[key] for key in ("revision", "reference", "totals", "regressions")}, indent=2))
+    for session_id, entry in result["sessions"].items():
+        for regression in entry.get("regressions", []):
+            print(f"REGRESSION {session_id}: {regression}", file=sys.stderr)
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+    if args.fail_on_regression and result["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
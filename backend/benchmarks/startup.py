@@ -0,0 +1,129 @@
+# ----
+# Cold start benchmark: the import-time profile of the app and, over several
+# fresh server processes, the time from process start to accepting connections,
+# to /ready and to the first served turn (answered by the intent router, so no
+# model is called).
+#
+#   cd backend && python -m benchmarks.startup --runs 5 --output startup.json
+# ----
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import httpx
+
+from benchmarks._setup import BACKEND_DIR
+from benchmarks.load_test import free_port, git_revision
+from benchmarks.menu_server import MenuServer
+
+SRC_DIR = BACKEND_DIR / "src"
+FIRST_TURN = {
+    "user_message": "What's in my cart?",
+    "restaurant_name": "Benchmark Restaurant",
+    "subdomain": "bench",
+}
+
+
+def import_profile(env: dict, top: int) -> Tuple[float, List[dict]]:
+    """Total `import main` time and the slowest modules (cumulative), from -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=SRC_DIR, env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules.append({"module": name.strip(), "cumulative_ms": int(cumulative) / 1000})
+    total = next((module["cumulative_ms"] for module in modules if module["module"] == "main"), 0.0)
+    modules.sort(key=lambda module: -module["cumulative_ms"])
+    return total, modules[:top]
+
+
+def wait_for(client: httpx.Client, path: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("the server exited, see its log")
+        try:
+            if client.get(path).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{path} did not answer 200 in time")
+
+
+def cold_start(env: dict, workdir: str, server_log) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", "import main, uvicorn; "
+         f"uvicorn.run(main.app, host='127.0.0.1', port={port}, log_config=None)"],
+        cwd=workdir, env={**env, "PYTHONPATH": str(SRC_DIR)}, stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            wait_for(client, "/", process)
+            listening = time.perf_counter() - started
+            wait_for(client, "/ready", process)
+            ready = time.perf_counter() - started
+            response = client.post("/api/chats/orders", json={**FIRST_TURN, "session_id": f"cold-{port}"})
+            response.raise_for_status()
+            first_turn = time.perf_counter() - started
+            warm_up = client.get("/ready").json()
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return {"listening_s": listening, "ready_s": ready, "first_turn_s": first_turn, "warm_up": warm_up}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the backend's cold start")
+    parser.add_argument("--runs", type=int, default=5, help="fresh server processes to start")
+    parser.add_argument("--top", type=int, default=25, help="slowest imports to report")
+    parser.add_argument("--server-log", type=Path, default=Path(tempfile.gettempdir()) / "startup_bench.log")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    menu_port = free_port()
+    MenuServer(menu_port).start()
+    env = {**os.environ,
+           "MENU_BACKEND_URL": f"http://127.0.0.1:{menu_port}/menu",
+           "WARMUP_TENANTS": json.dumps([FIRST_TURN["subdomain"]]),
+           "CHECKPOINTER_BACKEND": "memory",
+           "LOG_LEVEL": "WARNING"}
+
+    import_total, slowest = import_profile(env, args.top)
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir, open(args.server_log, "w") as server_log:
+        for _ in range(args.runs):
+            runs.append(cold_start(env, workdir, server_log))
+
+    def median(key):
+        return round(statistics.median(run[key] for run in runs), 3)
+
+    result = {
+        "revision": git_revision(),
+        "runs": args.runs,
+        "import_main_ms": import_total,
+        "listening_s": median("listening_s"),
+        "ready_s": median("ready_s"),
+        "first_turn_s": median("first_turn_s"),
+        "warm_up_steps": runs[-1]["warm_up"].get("steps"),
+        "slowest_imports": slowest,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
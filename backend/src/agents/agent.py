@@ -0,0 +1,35 @@
+# ----
+# This file contains the process-wide compiled agent. It is built on first use
+# (normally by the start-up warm-up), so importing the API does not pay for
+# LangGraph, the tools and the model integrations.
+# ----
+
+import asyncio
+import threading
+from typing import Optional
+
+_lock = threading.Lock()
+_chatbot_agent = None
+
+
+def build_chatbot_agent():
+    """Compile the agent graph once; concurrent callers wait for the first build."""
+    global _chatbot_agent
+    if _chatbot_agent is None:
+        with _lock:
+            if _chatbot_agent is None:
+                from agents.graph import chatbot_agent_builder
+                _chatbot_agent = chatbot_agent_builder()
+    return _chatbot_agent
+
+
+async def get_chatbot_agent():
+    if _chatbot_agent is not None:
+        return _chatbot_agent
+    # a request that arrives before the warm-up is done builds (or waits for) it off the event loop
+    return await asyncio.to_thread(build_chatbot_agent)
+
+
+def built_chatbot_agent() -> Optional[object]:
+    """The agent if it was built already, without building it."""
+    return _chatbot_agent
@@ -0,0 +1,818 @@
+# ------
+# This file contains the checkpointer backends used to persist conversation state
+# ------
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator, Sequence
+from typing import Any, Dict, Optional, Tuple
+
+import ormsgpack
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    copy_checkpoint,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+
+from configs.config import config
+
+logger = logging.getLogger(__name__)
+
+# message contents at least this long (menu payloads) are stored once in the shared items table
+SHARED_STRING_MIN_SIZE = 512
+MESSAGE_REF_CACHE_SIZE = 10_000
+
+
+def content_digest(data: bytes) -> bytes:
+    # 128-bit digest, stored raw so a message reference costs ~34 bytes in a message list
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def next_channel_version(current: Optional[str]) -> str:
+    # same version format as the LangGraph savers: monotonic counter + random tie breaker
+    if current is None:
+        current_v = 0
+    elif isinstance(current, int):
+        current_v = current
+    else:
+        current_v = int(current.split(".")[0])
+    return f"{current_v + 1:032}.{random.random():016}"
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    In-process checkpointer that keeps only the latest checkpoints of every thread
+    and can evict idle or finished sessions. Nothing survives a restart.
+    """
+
+    def __init__(self, keep_latest: int, **kwargs):
+        super().__init__(**kwargs)
+        self.keep_latest = keep_latest
+        # (thread_id, checkpoint_ns, checkpoint_id) -> channel versions the checkpoint refers to
+        self._versions: Dict[Tuple[str, str, str], ChannelVersions] = {}
+        # thread_id -> (last update wall time, finished flag)
+        self._threads: Dict[str, Tuple[float, bool]] = {}
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        self._versions[(thread_id, checkpoint_ns, checkpoint["id"])] = dict(
+            checkpoint["channel_versions"])
+        self._threads[thread_id] = (
+            time.time(), bool(checkpoint["channel_values"].get("finished")))
+        self._prune(thread_id, checkpoint_ns)
+        return next_config
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_latest:
+            return
+
+        for checkpoint_id in sorted(checkpoints)[:-self.keep_latest]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        # channel values are shared between checkpoints, drop the ones nobody refers to
+        referenced = set()
+        for checkpoint_id in checkpoints:
+            versions = self._versions.get(
+                (thread_id, checkpoint_ns, checkpoint_id), {})
+            referenced.update(versions.items())
+        for key in [k for k in self.blobs if k[0] == thread_id and k[1] == checkpoint_ns]:
+            if (key[2], key[3]) not in referenced:
+                del self.blobs[key]
+
+    def latest_checkpoint_id(self, thread_id: str, checkpoint_ns: str = "") -> Optional[str]:
+        # .get, the storage defaultdicts would otherwise grow an entry for every unknown thread
+        checkpoints = self.storage.get(thread_id, {}).get(checkpoint_ns)
+        return max(checkpoints) if checkpoints else None
+
+    def read_channels(self, thread_id: str, channels: Sequence[str], last_messages: Optional[int] = None,
+                      checkpoint_ns: str = "") -> Optional[Tuple[str, dict]]:
+        """Id of the latest checkpoint and the values of `channels` only, see SqliteCheckpointer."""
+        checkpoint_id = self.latest_checkpoint_id(thread_id, checkpoint_ns)
+        if checkpoint_id is None:
+            return None
+        versions = self._versions.get((thread_id, checkpoint_ns, checkpoint_id))
+        if versions is None:
+            checkpoint = self.serde.loads_typed(self.storage[thread_id][checkpoint_ns][checkpoint_id][0])
+            versions = checkpoint["channel_versions"]
+        values = self._load_blobs(thread_id, checkpoint_ns, {
+            channel: version for channel, version in versions.items() if channel in channels})
+        if last_messages is not None and "messages" in values:
+            values["messages"] = values["messages"][-last_messages:] if last_messages else []
+        return checkpoint_id, values
+
+    async def aread_channels(self, thread_id: str, channels: Sequence[str], last_messages: Optional[int] = None,
+                             checkpoint_ns: str = "") -> Optional[Tuple[str, dict]]:
+        return self.read_channels(thread_id, channels, last_messages, checkpoint_ns)
+
+    async def alatest_checkpoint_id(self, thread_id: str, checkpoint_ns: str = "") -> Optional[str]:
+        return self.latest_checkpoint_id(thread_id, checkpoint_ns)
+
+    def pin(self, thread_id: str):
+        # every checkpoint is resident already
+        pass
+
+    def unpin(self, thread_id: str):
+        pass
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        self._threads.pop(thread_id, None)
+        for key in [k for k in self._versions if k[0] == thread_id]:
+            del self._versions[key]
+
+    def sweep(self, idle_ttl: float, finished_ttl: float) -> int:
+        """Delete sessions idle for longer than `idle_ttl` or finished for longer than `finished_ttl`."""
+        now = time.time()
+        expired = [
+            thread_id for thread_id, (updated_at, finished) in list(self._threads.items())
+            if now - updated_at > (finished_ttl if finished else idle_ttl)
+        ]
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        return len(expired)
+
+    async def asweep(self, idle_ttl: float, finished_ttl: float) -> int:
+        # the storage dicts are only touched from the event loop, so no thread hop here
+        return self.sweep(idle_ttl, finished_ttl)
+
+    async def astats(self) -> dict:
+        return self.stats()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "threads": len(self._threads),
+            "checkpoints": sum(len(namespaces[ns]) for namespaces in self.storage.values() for ns in namespaces),
+            "memory_bytes": sum(len(blob[1]) for blob in self.blobs.values())
+            + sum(len(saved[0][1]) + len(saved[1][1])
+                  for namespaces in self.storage.values()
+                  for checkpoints in namespaces.values()
+                  for saved in checkpoints.values())
+            + sum(len(write[2][1])
+                  for writes in self.writes.values()
+                  for write in writes.values()),
+        }
+
+
+class SqliteCheckpointer(BaseCheckpointSaver[str]):
+    """
+    Checkpointer backed by a local SQLite database in WAL mode.
+
+    WAL lets several uvicorn workers read and write the same file concurrently;
+    writers wait on each other through the busy timeout. Only the latest
+    `keep_latest` checkpoints of every thread are kept.
+
+    Writes are delta-only: a checkpoint row holds no channel values, a channel
+    value is stored once per version, and message lists are stored as lists of
+    content hashes. Each message is serialized once into the shared `items`
+    table, and large message contents (menu payloads) are stored there once,
+    compressed, no matter how many sessions carry them.
+
+    Threads can be pinned while a client is connected: their latest checkpoint
+    stays in memory, and a turn reads it back after one index lookup confirms
+    no other worker has written a newer one.
+    """
+
+    def __init__(self, path: str, keep_latest: int, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.keep_latest = keep_latest
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # id(message) -> (message, stored reference), so unchanged messages are not re-serialized;
+        # reads fill it from worker threads, so it has its own lock
+        self._refs_lock = threading.Lock()
+        self._message_refs: "OrderedDict[int, Tuple[BaseMessage, list]]" = OrderedDict()
+        # thread_id -> connections pinning it; pinned thread_id -> (checkpoint_id, parent id, checkpoint, metadata)
+        self._pins: Dict[str, int] = {}
+        self._resident: Dict[str, Tuple[str, Optional[str], Checkpoint, CheckpointMetadata]] = {}
+        self.bytes_written = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # opened lazily so each worker process gets its own connection
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL DEFAULT '',
+                    checkpoint_id TEXT NOT NULL,
+                    parent_checkpoint_id TEXT,
+                    type TEXT,
+                    checkpoint BLOB,
+                    metadata BLOB,
+                    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+                );
+                CREATE TABLE IF NOT EXISTS blobs (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL DEFAULT '',
+                    channel TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    blob BLOB,
+                    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+                );
+                CREATE TABLE IF NOT EXISTS items (
+                    hash BLOB PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    data BLOB
+                );
+                CREATE TABLE IF NOT EXISTS refs (
+                    thread_id TEXT NOT NULL,
+                    hash BLOB NOT NULL,
+                    PRIMARY KEY (thread_id, hash)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS refs_hash ON refs (hash);
+                CREATE TABLE IF NOT EXISTS writes (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL DEFAULT '',
+                    checkpoint_id TEXT NOT NULL,
+                    task_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    channel TEXT NOT NULL,
+                    type TEXT,
+                    value BLOB,
+                    task_path TEXT NOT NULL DEFAULT '',
+                    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+                );
+                CREATE TABLE IF NOT EXISTS threads (
+                    thread_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL,
+                    finished INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at);
+            """)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _execute(self, sql: str, params: Sequence = ()) -> list:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # message lists <-> content-addressed items
+
+    def _dump_message(self, message: BaseMessage, items: dict, reused: dict) -> list:
+        """
+        Reference to a message as [message hash, content hash or None]. New items go
+        to `items`; a message stored before goes to `reused` by its hashes, its rows
+        are only written again if they are gone by the time the checkpoint is.
+        """
+        with self._refs_lock:
+            cached = self._message_refs.get(id(message))
+            if cached is not None and cached[0] is message:
+                self._message_refs.move_to_end(id(message))
+                for h in cached[1]:
+                    if h:
+                        reused[h] = message
+                return cached[1]
+
+        ref, rows = self._serialize_message(message)
+        items.update(rows)
+        self._remember(message, ref)
+        return ref
+
+    def _serialize_message(self, message: BaseMessage) -> Tuple[list, dict]:
+        """The message's reference and its item rows, the large content stored apart."""
+        rows = {}
+        stripped = message
+        content_hash = None
+        if isinstance(message.content, str) and len(message.content) >= SHARED_STRING_MIN_SIZE:
+            data = message.content.encode()
+            content_hash = content_digest(data)
+            rows[content_hash] = ("zlib", zlib.compress(data, 1))
+            stripped = message.model_copy(update={"content": ""})
+
+        type_, data = self.serde.dumps_typed(stripped)
+        message_hash = content_digest(type_.encode() + data)
+        rows[message_hash] = (type_, data)
+        return [message_hash, content_hash], rows
+
+    def _restore_items(self, conn: sqlite3.Connection, items: dict, reused: dict):
+        """Add back to `items` the rows of reused messages the sweeper deleted meanwhile."""
+        hashes = [h for h in reused if h not in items]
+        present = set()
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            present.update(row[0] for row in conn.execute(
+                f"SELECT hash FROM items WHERE hash IN ({','.join('?' * len(chunk))})", chunk))
+        for h in hashes:
+            if h not in present and h not in items:
+                items.update(self._serialize_message(reused[h])[1])
+
+    def _remember(self, message: BaseMessage, ref: list):
+        # the message is kept alive by the cache entry, so its id cannot be reused meanwhile
+        with self._refs_lock:
+            self._message_refs[id(message)] = (message, ref)
+            self._message_refs.move_to_end(id(message))
+            if len(self._message_refs) > MESSAGE_REF_CACHE_SIZE:
+                self._message_refs.popitem(last=False)
+
+    def _load_messages(self, refs: list) -> list:
+        hashes = {h for ref in refs for h in ref if h}
+        items = {}
+        hash_list = list(hashes)
+        # stay under SQLite's bound parameter limit
+        for start in range(0, len(hash_list), 500):
+            chunk = hash_list[start:start + 500]
+            rows = self._execute(
+                f"SELECT hash, type, data FROM items WHERE hash IN ({','.join('?' * len(chunk))})", chunk)
+            items.update((h, (type_, data)) for h, type_, data in rows)
+
+        messages = []
+        for ref in refs:
+            message_hash, content_hash = ref
+            message = self.serde.loads_typed(items[message_hash])
+            if content_hash:
+                message = message.model_copy(update={
+                    "content": zlib.decompress(items[content_hash][1]).decode()})
+            messages.append(message)
+            # the next put of this thread will find the loaded messages already stored
+            self._remember(message, ref)
+        return messages
+
+    def _dump_channel(self, value: Any, items: dict, reused: dict) -> Tuple[str, bytes]:
+        if isinstance(value, list) and value and all(isinstance(v, BaseMessage) for v in value):
+            refs = [self._dump_message(message, items, reused) for message in value]
+            return "refs", ormsgpack.packb(refs)
+        return self.serde.dumps_typed(value)
+
+    def _load_channel(self, type_: str, blob: bytes) -> Any:
+        if type_ == "refs":
+            return self._load_messages(ormsgpack.unpackb(blob))
+        return self.serde.loads_typed((type_, blob))
+
+    # reads
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list:
+        rows = self._execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id))
+        return [(task_id, channel, self.serde.loads_typed((type_, value)))
+                for task_id, channel, type_, value in rows]
+
+    def _load_channel_values(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> dict:
+        if not versions:
+            return {}
+        conditions = " OR ".join(["(channel = ? AND version = ?)"] * len(versions))
+        rows = self._execute(
+            f"SELECT channel, type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND ({conditions})",
+            (thread_id, checkpoint_ns, *(part for item in versions.items() for part in item)))
+        return {channel: self._load_channel(type_, blob)
+                for channel, type_, blob in rows if type_ != "empty"}
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata = row
+        checkpoint = self.serde.loads_typed((type_, checkpoint))
+        # checkpoints written before blobs were split out still carry their values inline
+        if not checkpoint.get("channel_values"):
+            checkpoint["channel_values"] = self._load_channel_values(
+                thread_id, checkpoint_ns, checkpoint["channel_versions"])
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed((type_, metadata)),
+            parent_config=(
+                {"configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": parent_checkpoint_id,
+                }}
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=self._load_writes(
+                thread_id, checkpoint_ns, checkpoint_id),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata"
+
+        if checkpoint_id := get_checkpoint_id(config):
+            rows = self._execute(
+                f"SELECT {columns} FROM checkpoints "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, checkpoint_id))
+        else:
+            if checkpoint_tuple := self._resident_tuple(thread_id, checkpoint_ns):
+                return checkpoint_tuple
+            rows = self._execute(
+                f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1",
+                (thread_id, checkpoint_ns))
+
+        if not rows:
+            return None
+        checkpoint_tuple = self._to_tuple(thread_id, checkpoint_ns, rows[0])
+        if not checkpoint_id:
+            # a pinned thread's next turn starts from memory
+            self._keep_resident(thread_id, checkpoint_ns, checkpoint_tuple.checkpoint,
+                                checkpoint_tuple.metadata, rows[0][1])
+        return checkpoint_tuple
+
+    # threads pinned by open connections
+
+    def pin(self, thread_id: str):
+        with self._lock:
+            self._pins[thread_id] = self._pins.get(thread_id, 0) + 1
+
+    def unpin(self, thread_id: str):
+        with self._lock:
+            pins = self._pins.get(thread_id, 0) - 1
+            if pins > 0:
+                self._pins[thread_id] = pins
+            else:
+                self._pins.pop(thread_id, None)
+                self._resident.pop(thread_id, None)
+
+    def _keep_resident(self, thread_id: str, checkpoint_ns: str, checkpoint: Checkpoint,
+                       metadata: CheckpointMetadata, parent_checkpoint_id: Optional[str]):
+        if checkpoint_ns or thread_id not in self._pins:
+            return
+        # a copy, the graph updates the versions of the checkpoint it runs from in place
+        entry = (checkpoint["id"], parent_checkpoint_id, copy_checkpoint(checkpoint), dict(metadata))
+        with self._lock:
+            if thread_id in self._pins:
+                self._resident[thread_id] = entry
+
+    def _resident_tuple(self, thread_id: str, checkpoint_ns: str) -> Optional[CheckpointTuple]:
+        """The pinned thread's latest checkpoint from memory, unless another worker has written since."""
+        entry = None if checkpoint_ns else self._resident.get(thread_id)
+        if entry is None:
+            return None
+        checkpoint_id, parent_checkpoint_id, checkpoint, metadata = entry
+        if self.latest_checkpoint_id(thread_id) != checkpoint_id:
+            return None
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": "",
+                "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint=copy_checkpoint(checkpoint),
+            metadata=dict(metadata),
+            parent_config=(
+                {"configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": "",
+                    "checkpoint_id": parent_checkpoint_id,
+                }}
+                if parent_checkpoint_id
+                else None
+            ),
+            # pending writes are few and may come from any worker, they are always read
+            pending_writes=self._load_writes(thread_id, "", checkpoint_id),
+        )
+
+    def latest_checkpoint_id(self, thread_id: str, checkpoint_ns: str = "") -> Optional[str]:
+        """Id of the latest checkpoint of a thread, a version of its state that costs one index lookup."""
+        rows = self._execute(
+            "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, checkpoint_ns))
+        return rows[0][0] if rows else None
+
+    def read_channels(self, thread_id: str, channels: Sequence[str], last_messages: Optional[int] = None,
+                      checkpoint_ns: str = "") -> Optional[Tuple[str, dict]]:
+        """
+        Id of the latest checkpoint and the values of `channels` only. Other
+        channels are not read, and with `last_messages` only that many messages
+        are loaded from their references.
+        """
+        rows = self._execute(
+            "SELECT checkpoint_id, type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT 1",
+            (thread_id, checkpoint_ns))
+        if not rows:
+            return None
+        checkpoint_id, type_, checkpoint = rows[0]
+        checkpoint = self.serde.loads_typed((type_, checkpoint))
+
+        if checkpoint.get("channel_values"):
+            # written before blobs were split out, the values are inline
+            values = {channel: value for channel, value in checkpoint["channel_values"].items()
+                      if channel in channels}
+            if last_messages is not None and "messages" in values:
+                values["messages"] = values["messages"][-last_messages:] if last_messages else []
+            return checkpoint_id, values
+
+        versions = {channel: version for channel, version in checkpoint["channel_versions"].items()
+                    if channel in channels}
+        if not versions:
+            return checkpoint_id, {}
+        conditions = " OR ".join(["(channel = ? AND version = ?)"] * len(versions))
+        rows = self._execute(
+            f"SELECT channel, type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND ({conditions})",
+            (thread_id, checkpoint_ns, *(part for item in versions.items() for part in item)))
+        values = {}
+        for channel, type_, blob in rows:
+            if type_ == "empty":
+                continue
+            if type_ == "refs" and last_messages is not None:
+                refs = ormsgpack.unpackb(blob)
+                values[channel] = self._load_messages(refs[-last_messages:] if last_messages else [])
+            else:
+                values[channel] = self._load_channel(type_, blob)
+        return checkpoint_id, values
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+
+        rows = self._execute(
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata "
+            f"FROM checkpoints {'WHERE ' + ' AND '.join(where) if where else ''} "
+            "ORDER BY checkpoint_id DESC", params)
+
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            checkpoint_tuple = self._to_tuple(thread_id, checkpoint_ns, row)
+            # filter by metadata
+            if filter and not all(
+                value == checkpoint_tuple.metadata.get(key) for key, value in filter.items()
+            ):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    # writes
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        parent_checkpoint_id = config["configurable"].get("checkpoint_id")
+
+        c = checkpoint.copy()
+        values: dict = c.pop("channel_values")
+        c["channel_values"] = {}
+        type_, serialized_checkpoint = self.serde.dumps_typed(c)
+        checkpoint_metadata = get_checkpoint_metadata(config, metadata)
+        _, serialized_metadata = self.serde.dumps_typed(checkpoint_metadata)
+        finished = bool(values.get("finished"))
+
+        with self._lock:
+            # only channels that changed since the parent checkpoint are written
+            items: Dict[bytes, Tuple[str, bytes]] = {}
+            reused: Dict[bytes, BaseMessage] = {}
+            blobs = [
+                (thread_id, checkpoint_ns, channel, version,
+                 *(self._dump_channel(values[channel], items, reused) if channel in values else ("empty", b"")))
+                for channel, version in new_versions.items()
+            ]
+
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # checked inside the transaction, so the sweeper cannot delete them before the commit
+                self._restore_items(conn, items, reused)
+                conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints "
+                    "(thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint["id"], parent_checkpoint_id,
+                     type_, serialized_checkpoint, serialized_metadata))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, type, blob) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", blobs)
+                conn.executemany(
+                    "INSERT OR IGNORE INTO items (hash, type, data) VALUES (?, ?, ?)",
+                    [(h, item_type, data) for h, (item_type, data) in items.items()])
+                # reused messages too: the thread's refs are gone if it was swept while idle
+                conn.executemany(
+                    "INSERT OR IGNORE INTO refs (thread_id, hash) VALUES (?, ?)",
+                    [(thread_id, h) for h in {**items, **reused}])
+                conn.execute(
+                    "INSERT OR REPLACE INTO threads (thread_id, updated_at, finished) VALUES (?, ?, ?)",
+                    (thread_id, time.time(), int(finished)))
+                self._prune(conn, thread_id, checkpoint_ns)
+                conn.execute("COMMIT")
+                self.bytes_written += (
+                    len(serialized_checkpoint) + len(serialized_metadata)
+                    + sum(len(blob[-1]) for blob in blobs)
+                    + sum(len(data) for _, data in items.values()))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        self._keep_resident(thread_id, checkpoint_ns, checkpoint, checkpoint_metadata, parent_checkpoint_id)
+        return {"configurable": {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint["id"],
+        }}
+
+    def _prune(self, conn: sqlite3.Connection, thread_id: str, checkpoint_ns: str):
+        """Keep only the latest checkpoints of the thread, with their pending writes."""
+        stale = [row[0] for row in conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.keep_latest))]
+        if not stale:
+            return
+        for checkpoint_id in stale:
+            params = (thread_id, checkpoint_ns, checkpoint_id)
+            conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params)
+            conn.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params)
+
+        # channel values are shared between checkpoints, drop the versions nobody refers to
+        referenced = set()
+        for type_, checkpoint in conn.execute(
+                "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns)):
+            referenced.update(self.serde.loads_typed(
+                (type_, checkpoint))["channel_versions"].items())
+        for channel, version in conn.execute(
+                "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns)).fetchall():
+            if (channel, version) not in referenced:
+                conn.execute(
+                    "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                    (thread_id, checkpoint_ns, channel, version))
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        # special writes (errors, interrupts, ...) replace earlier ones, regular writes are kept once
+        query = (
+            "INSERT OR REPLACE INTO writes "
+            if all(channel in WRITES_IDX_MAP for channel, _ in writes)
+            else "INSERT OR IGNORE INTO writes "
+        ) + ("(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+        rows = [
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx),
+             channel, *self.serde.dumps_typed(value), task_path)
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        with self._lock:
+            self.conn.executemany(query, rows)
+            self.bytes_written += sum(len(row[-2]) for row in rows)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._resident.pop(thread_id, None)
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("checkpoints", "blobs", "refs", "writes", "threads"):
+                    conn.execute(
+                        f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def sweep(self, idle_ttl: float, finished_ttl: float) -> int:
+        """Delete sessions idle for longer than `idle_ttl` or finished for longer than `finished_ttl`."""
+        now = time.time()
+        expired = [row[0] for row in self._execute(
+            "SELECT thread_id FROM threads WHERE updated_at < ? OR (finished = 1 AND updated_at < ?)",
+            (now - idle_ttl, now - finished_ttl))]
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        if expired:
+            # shared items are kept as long as any remaining thread refers to them
+            self._execute(
+                "DELETE FROM items WHERE NOT EXISTS (SELECT 1 FROM refs WHERE refs.hash = items.hash)")
+        return len(expired)
+
+    async def asweep(self, idle_ttl: float, finished_ttl: float) -> int:
+        return await asyncio.to_thread(self.sweep, idle_ttl, finished_ttl)
+
+    async def astats(self) -> dict:
+        return await asyncio.to_thread(self.stats)
+
+    def stats(self) -> dict:
+        (threads,), = self._execute("SELECT COUNT(*) FROM threads")
+        (checkpoints,), = self._execute("SELECT COUNT(*) FROM checkpoints")
+        (writes,), = self._execute("SELECT COUNT(*) FROM writes")
+        (items,), = self._execute("SELECT COUNT(*) FROM items")
+        (page_count,), = self._execute("PRAGMA page_count")
+        (page_size,), = self._execute("PRAGMA page_size")
+        (freelist,), = self._execute("PRAGMA freelist_count")
+        wal_path = f"{self.path}-wal"
+        return {
+            "backend": "sqlite",
+            "threads": threads,
+            "checkpoints": checkpoints,
+            "writes": writes,
+            "shared_items": items,
+            "bytes_written": self.bytes_written,
+            "db_bytes": page_count * page_size,
+            "free_bytes": freelist * page_size,
+            "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        }
+
+    # async API, the blocking sqlite calls run in worker threads
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alatest_checkpoint_id(self, thread_id: str, checkpoint_ns: str = "") -> Optional[str]:
+        return await asyncio.to_thread(self.latest_checkpoint_id, thread_id, checkpoint_ns)
+
+    async def aread_channels(self, thread_id: str, channels: Sequence[str], last_messages: Optional[int] = None,
+                             checkpoint_ns: str = "") -> Optional[Tuple[str, dict]]:
+        return await asyncio.to_thread(self.read_channels, thread_id, channels, last_messages, checkpoint_ns)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return next_channel_version(current)
+
+
+def build_checkpointer():
+    """Checkpointer selected by CHECKPOINTER_BACKEND ("sqlite" or "memory")."""
+    if config.CHECKPOINTER_BACKEND == "memory":
+        return BoundedMemorySaver(keep_latest=config.CHECKPOINT_KEEP_LATEST)
+    if config.CHECKPOINTER_BACKEND == "sqlite":
+        return SqliteCheckpointer(config.CHECKPOINT_DB_PATH, keep_latest=config.CHECKPOINT_KEEP_LATEST)
+    raise ValueError(
+        f"Unknown CHECKPOINTER_BACKEND {config.CHECKPOINTER_BACKEND!r}")
+
+
+async def run_session_sweeper(checkpointer, interval: float, idle_ttl: float, finished_ttl: float):
+    """Periodically evict idle and finished sessions from the checkpointer."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            evicted = await checkpointer.asweep(idle_ttl, finished_ttl)
+            if evicted:
+                logger.info("Evicted %s expired sessions", evicted)
+        except Exception:
+            logger.exception("Session sweep failed")
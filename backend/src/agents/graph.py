@@ -2,30 +2,52 @@
 # This file contains the agent workflow graph created using LangGraph
 # ------
 
-from langgraph.graph import StateGraph, START
+from langgraph.graph import StateGraph, START, END
 from agents.state import OrderState
 from agents.nodes.chatbot import chatbot
 from agents.nodes.tool_node import tool_node
+from agents.nodes.context_manager import context_manager
+from agents.nodes.router import router, route_after_router
+from agents.nodes.menu_seed import seed_menu
 from langgraph.prebuilt import tools_condition
-from langgraph.checkpoint.memory import MemorySaver
+from agents.checkpointer import build_checkpointer
+from services.metrics import instrument_node
 
 
-def chatbot_agent_builder():
+def chatbot_agent_builder(checkpointer=None):
     NODE_CHATBOT = "chatbot"
     NODE_TOOLS = "tools"
+    NODE_CONTEXT = "context_manager"
+    NODE_ROUTER = "router"
+    NODE_SEED = "seed_menu"
 
     graph = StateGraph(OrderState)
 
-    graph.add_node(NODE_CHATBOT, chatbot)
-    graph.add_node(NODE_TOOLS, tool_node)
+    # every node's wall time is recorded per tenant, see /metrics
+    graph.add_node(NODE_CHATBOT, instrument_node(NODE_CHATBOT, chatbot))
+    graph.add_node(NODE_TOOLS, instrument_node(NODE_TOOLS, tool_node))
+    graph.add_node(NODE_CONTEXT, instrument_node(NODE_CONTEXT, context_manager))
+    graph.add_node(NODE_ROUTER, instrument_node(NODE_ROUTER, router))
+    graph.add_node(NODE_SEED, instrument_node(NODE_SEED, seed_menu))
 
-    graph.add_edge(START, NODE_CHATBOT)
+    # common cart / menu intents are answered by the router, the rest goes to the LLM
+    graph.add_edge(START, NODE_ROUTER)
+    graph.add_conditional_edges(
+        NODE_ROUTER, route_after_router, [NODE_SEED, END])
+
+    # a new conversation gets the menu before its first LLM call, so the model need not ask for it
+    graph.add_edge(NODE_SEED, NODE_CONTEXT)
+
+    # every LLM call goes through the context manager to stay within the token budget
+    graph.add_edge(NODE_CONTEXT, NODE_CHATBOT)
 
     # tools will always return back to chatbot
-    graph.add_edge(NODE_TOOLS, NODE_CHATBOT)
+    graph.add_edge(NODE_TOOLS, NODE_CONTEXT)
     graph.add_conditional_edges(NODE_CHATBOT, tools_condition)
 
-    memory = MemorySaver()
-    chatbot_graph = graph.compile(checkpointer=memory)
+    # bounded, pluggable checkpointer (sqlite by default, see CHECKPOINTER_BACKEND)
+    if checkpointer is None:
+        checkpointer = build_checkpointer()
+    chatbot_graph = graph.compile(checkpointer=checkpointer)
 
     return chatbot_graph
@@ -1,19 +1,22 @@
+import logging
 from langchain_core.messages.ai import AIMessage
 from agents.state import OrderState, Cart
-from agents.prompts.system_prompt import SYSTEM_INSTRUCTION, WELCOME_MSG
-from langchain.chat_models import init_chat_model
-from agents.tools.cart import get_menu, get_cart, add_cart, remove_from_cart, place_order, confirm_order
+from agents.prompts.system_prompt import BUSY_MSG, MODEL_FAILED_MSG, SYSTEM_INSTRUCTION, WELCOME_MSG
+from agents.tools import tools
+from agents.nodes.context_manager import context_preamble
+from services.model_registry import model_registry
+from services.admission import AdmissionRejected, admission
+from services.model_calls import ModelCallFailed, model_caller
 
+logger = logging.getLogger(__name__)
 
-def chatbot(state: OrderState) -> OrderState:
-    """The chatbot itself. A wrapper around the model's own chat interface."""
 
-    model = init_chat_model("gemini-2.5-flash", model_provider="google_genai")
-    tools = [get_menu, get_cart, add_cart,
-             remove_from_cart, place_order, confirm_order]
+async def chatbot(state: OrderState) -> OrderState:
+    """The chatbot itself. A wrapper around the model's own chat interface."""
 
-    # bind these tools to the LLM
-    model_with_tools = model.bind_tools(tools)
+    # the tool-bound models are built once per process and shared across sessions:
+    # the tenant's model first, then the failover chain
+    models = model_registry.chain_for_tenant(state["subdomain"], tools)
 
     # format system instruction
     formatted_system_instruction = (
@@ -23,20 +26,32 @@ def chatbot(state: OrderState) -> OrderState:
 
     if state["messages"]:
         # If there are messages, continue the conversation with the model.
-        new_output = model_with_tools.invoke(
-            [formatted_system_instruction] + state["messages"])
+        # summary of dropped turns and the live cart go right after the static instruction
+        context = ("system", context_preamble(state))
+        try:
+            # model calls share a bounded pool, a burst from one tenant queues behind the others
+            async with admission.llm_slot(state["subdomain"]):
+                prompt = [formatted_system_instruction, context] + state["messages"]
+                new_output = await model_caller.ainvoke(models, prompt, state["subdomain"], kind="chat")
+        except AdmissionRejected as e:
+            logger.warning("Model call for %s not admitted: %s", state["subdomain"], e)
+            new_output = AIMessage(content=BUSY_MSG)
+        except ModelCallFailed as e:
+            logger.warning("No model answered for %s: %s", state["subdomain"], e)
+            # the reply keeps the conversation well formed, the error tells the client to retry
+            new_output = AIMessage(content=MODEL_FAILED_MSG, response_metadata={"error": e.to_dict()})
     else:
         # If there are no messages, start with the welcome message.
         new_output = AIMessage(content=formatted_welcome_msg)
 
+    # only the new message is returned, the add_messages reducer appends it
+    update = {"messages": [new_output]}
+
     # Initialize cart as Cart model if not present or if it's an empty list
     current_cart = state.get("cart")
     if current_cart is None or current_cart == []:
-        current_cart = Cart(items=[])
-
-    return {
-        "messages": state.get("messages", []) + [new_output],
-        "cart": current_cart,
-        "orderId": state.get("orderId"),
-        "finished": state.get("finished", False)
-    }
+        update["cart"] = Cart()
+        update["orderId"] = state.get("orderId")
+        update["finished"] = state.get("finished", False)
+
+    return update
@@ -0,0 +1,168 @@
+# ------
+# This file contains the context manager node which keeps the prompt within the
+# tenant's token budget before every LLM call
+# ------
+
+import json
+import logging
+from typing import List, Optional
+
+from langchain_core.messages import (
+    AIMessage,
+    AnyMessage,
+    HumanMessage,
+    RemoveMessage,
+    ToolMessage,
+)
+
+from agents.prompts.system_prompt import SUMMARY_INSTRUCTION
+from agents.state import Cart, OrderState
+from configs.config import config
+from services.admission import admission
+from services.cart_summary import render_cart
+from services.model_calls import model_caller
+from services.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+# tools whose result is fully replaced by the next call of the same tool
+SUPERSEDED_TOOLS = {"get_menu", "get_cart", "confirm_order"}
+SUPERSEDED_PLACEHOLDER = "[superseded by a newer {name} result]"
+
+
+def estimate_tokens(messages: List[AnyMessage]) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    chars = 0
+    for message in messages:
+        chars += len(message.content) if isinstance(message.content, str) else len(
+            json.dumps(message.content))
+        if isinstance(message, AIMessage) and message.tool_calls:
+            chars += len(json.dumps([call["args"]
+                         for call in message.tool_calls]))
+    return chars // 4
+
+
+def token_budget(subdomain: Optional[str]) -> int:
+    return config.TENANT_CONTEXT_BUDGETS.get(subdomain or "", config.CONTEXT_TOKEN_BUDGET)
+
+
+def collapse_superseded(messages: List[AnyMessage]) -> List[ToolMessage]:
+    """Replacements for tool results that a later call of the same tool made stale."""
+    latest = {}
+    for message in messages:
+        if isinstance(message, ToolMessage) and message.name in SUPERSEDED_TOOLS:
+            latest[message.name] = message.id
+
+    replacements = []
+    for message in messages:
+        if (isinstance(message, ToolMessage) and message.name in SUPERSEDED_TOOLS
+                and message.id != latest[message.name]):
+            placeholder = SUPERSEDED_PLACEHOLDER.format(name=message.name)
+            if message.content != placeholder:
+                # same id, so the add_messages reducer replaces it in place
+                replacements.append(ToolMessage(
+                    placeholder, id=message.id, name=message.name, tool_call_id=message.tool_call_id))
+    return replacements
+
+
+def find_cut(messages: List[AnyMessage], keep_tokens: int) -> int:
+    """
+    Index of the first message to keep: as many recent turns as fit in `keep_tokens`,
+    always starting at a human message so tool calls stay paired with their results.
+    """
+    cut = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            if estimate_tokens(messages[index:]) > keep_tokens and cut < len(messages):
+                break
+            cut = index
+    return cut
+
+
+def render_transcript(messages: List[AnyMessage]) -> str:
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"Customer: {message.content}")
+        elif isinstance(message, AIMessage):
+            if message.content:
+                lines.append(f"Assistant: {message.content}")
+            for call in message.tool_calls:
+                lines.append(
+                    f"Assistant called {call['name']}({json.dumps(call['args'])})")
+        elif isinstance(message, ToolMessage) and message.name not in SUPERSEDED_TOOLS:
+            lines.append(f"Tool result: {message.content}")
+    return "\n".join(lines)
+
+
+async def summarize(subdomain: Optional[str], summary: Optional[str], messages: List[AnyMessage]) -> str:
+    """Fold the dropped turns into the running summary."""
+    transcript = render_transcript(messages)
+    try:
+        model_name, model_provider = model_registry.model_spec_for_tenant(
+            subdomain)
+        model = model_registry.get_model(model_name, model_provider)
+        async with admission.llm_slot(subdomain):
+            prompt = [
+                ("system", SUMMARY_INSTRUCTION),
+                ("human", f"Summary so far:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"),
+            ]
+            # bounded by the turn's deadline, a slow summary falls back like a failed one
+            response = await model_caller.ainvoke([(model_name, model)], prompt, subdomain,
+                                                  kind="summary", hedge=False)
+        if isinstance(response.content, str) and response.content.strip():
+            return response.content
+    except Exception:
+        logger.exception("Summarization failed, falling back to the transcript")
+
+    # never fail the turn because of the summary, keep the customer's own words instead
+    customer_lines = [line for line in transcript.splitlines()
+                      if line.startswith("Customer:")]
+    return "\n".join(filter(None, [summary, *customer_lines]))[-2000:]
+
+
+def format_cart_context(cart: Optional[Cart], subdomain: Optional[str] = None) -> str:
+    """The live cart with its totals, so the model never has to look back through the history or add up prices."""
+    return render_cart(cart, subdomain, heading="Current cart")
+
+
+def context_preamble(state: OrderState) -> str:
+    """Dynamic context appended after the system instruction on every LLM call."""
+    parts = []
+    if state.get("summary"):
+        parts.append(f"Summary of the earlier conversation:\n{state['summary']}")
+    parts.append(format_cart_context(state.get("cart"), state.get("subdomain")))
+    return "\n\n".join(parts)
+
+
+async def context_manager(state: OrderState) -> dict:
+    """Collapses stale tool results and summarizes old turns once the token budget is exceeded."""
+    messages = state.get("messages", [])
+    if not messages:
+        return {}
+
+    updates: List[AnyMessage] = collapse_superseded(messages)
+    if updates:
+        replaced = {message.id: message for message in updates}
+        messages = [replaced.get(message.id, message) for message in messages]
+
+    budget = token_budget(state.get("subdomain"))
+    if estimate_tokens(messages) <= budget:
+        return {"messages": updates} if updates else {}
+
+    cut = find_cut(messages, int(budget * config.CONTEXT_KEEP_RATIO))
+    if cut == 0:
+        # a single turn is over budget, nothing older to fold away
+        return {"messages": updates} if updates else {}
+
+    dropped = messages[:cut]
+    summary = await summarize(state.get("subdomain"), state.get("summary"), dropped)
+    logger.info("Summarized %s messages (%s tokens) for thread context",
+                len(dropped), estimate_tokens(dropped))
+
+    dropped_ids = {message.id for message in dropped}
+    updates = [message for message in updates if message.id not in dropped_ids]
+    return {
+        "messages": updates + [RemoveMessage(id=message.id) for message in dropped],
+        "summary": summary,
+    }
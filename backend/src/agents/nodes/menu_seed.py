@@ -0,0 +1,63 @@
+# ------
+# This file contains the menu seed node: the first model call of a new
+# conversation gets the tenant's menu up front, as the result of a get_menu call
+# the model did not have to make, saving it a round trip on the first real turn
+# ------
+
+import asyncio
+import logging
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from agents.state import OrderState
+from configs.config import config
+from services.menu_cache import MenuFetchError, menu_cache
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+menu_seeds = metrics.counter(
+    "menu_seeds_total", "New conversations by whether their first model call got the menu up front "
+    "(seeded, late, unavailable)", ["tenant", "outcome"])
+
+
+def is_new_conversation(state: OrderState) -> bool:
+    """The thread's first customer message, with no menu fetched yet."""
+    messages = state.get("messages", [])
+    if state.get("summary") or sum(isinstance(message, HumanMessage) for message in messages) != 1:
+        return False
+    return not any(isinstance(message, ToolMessage) and message.name == "get_menu" for message in messages)
+
+
+def start_menu_prefetch(state: OrderState):
+    """Called as a turn enters the graph, so the menu loads while the turn is routed."""
+    if config.MENU_SEED_ENABLED and is_new_conversation(state):
+        menu_cache.prefetch(state["subdomain"])
+
+
+async def seed_menu(state: OrderState) -> dict:
+    """Adds the menu to a new conversation before its first model call, if it is loaded in time."""
+    if not config.MENU_SEED_ENABLED or not is_new_conversation(state):
+        return {}
+
+    subdomain = state["subdomain"]
+    try:
+        # a slow fetch goes on in the background, the model's get_menu call joins it
+        menu_index = await asyncio.wait_for(menu_cache.get_index(subdomain), config.MENU_SEED_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        menu_seeds.inc(tenant=subdomain, outcome="late")
+        logger.info("Menu of %s not loaded in %.2fs, not seeded", subdomain, config.MENU_SEED_WAIT_SECONDS)
+        return {}
+    except MenuFetchError as e:
+        menu_seeds.inc(tenant=subdomain, outcome="unavailable")
+        logger.warning("Menu of %s not seeded: %s", subdomain, e)
+        return {}
+
+    menu_seeds.inc(tenant=subdomain, outcome="seeded")
+    # the same pair a get_menu call leaves in the history, so the context manager treats it alike
+    call_id = f"menu_seed_{uuid.uuid4().hex}"
+    return {"messages": [
+        AIMessage("", tool_calls=[{"name": "get_menu", "args": {}, "id": call_id}]),
+        ToolMessage(menu_index.compact_json, name="get_menu", tool_call_id=call_id),
+    ]}
@@ -0,0 +1,224 @@
+# ------
+# This file contains the intent router node which answers common, unambiguous
+# cart and menu turns from the state and the cached menu without calling the LLM
+# ------
+
+import difflib
+import logging
+import re
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
+from langgraph.config import get_config
+from langgraph.graph import END
+
+from agents.nodes.menu_seed import start_menu_prefetch
+from agents.state import Cart, CartLine, OrderState
+from agents.tools.cart import CartOperation, CartOperationError, apply_operation, complete_order
+from services.cart_summary import cart_hash, render_cart
+from services.menu_cache import MenuFetchError, menu_cache
+from services.menu_index import MenuIndex, normalize
+from services.metrics import router_turns
+
+logger = logging.getLogger(__name__)
+
+# where the graph goes when the router did not answer the turn
+ROUTE_LLM = "seed_menu"
+
+# routed turns per intent ("llm" for the ones left to the model), to measure the hit rate
+route_counts: Counter = Counter()
+
+_NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+            "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+_QUANTITY = r"(?:(?P<quantity>\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten) )?"
+_CART = r"(?:cart|basket|order)"
+
+# patterns match the normalized message (lowercase, no punctuation) in full
+SHOW_CART = re.compile(
+    rf"(?:please )?(?:(?:show|view|see|check|display)(?: me)?(?: my| the)? {_CART}"
+    rf"|what s in my {_CART}|what is in my {_CART}|(?:my )?(?:cart|basket))(?: please)?")
+ADD_ITEM = re.compile(
+    rf"(?:please )?add {_QUANTITY}(?:more )?(?P<item>.+?)(?: to (?:my |the )?{_CART})?(?: please)?")
+REMOVE_ITEM = re.compile(
+    rf"(?:please )?(?:remove|delete|drop|take out) {_QUANTITY}(?:the |my )?(?P<item>.+?)"
+    rf"(?: from (?:my |the )?{_CART})?(?: please)?")
+CONFIRM = re.compile(
+    r"(?:yes|yeah|yep|sure|ok|okay|confirm|confirmed|go ahead|place (?:the |my )?order)"
+    r"(?: (?:please|confirm|go ahead|place (?:the |my )?order|confirm (?:the |my )?order))*")
+_WHAT = r"(?:(?:what|which) (?:is|are|s) )?(?:the |your )?"
+TAG_QUERIES = [
+    (re.compile(rf"{_WHAT}(?:today s|todays) specials?(?: today)?|{_WHAT}specials?(?: today| of the day)"),
+     "todays_special", "Today's specials"),
+    (re.compile(rf"{_WHAT}(?:best ?sellers?|most popular (?:dishes|items))"),
+     "bestseller", "Our bestsellers"),
+    (re.compile(rf"what do you recommend|any recommendations|{_WHAT}recommended(?: dishes| items)?"),
+     "recommended", "We recommend"),
+]
+
+
+def _quantity(match: re.Match) -> int:
+    quantity = match.group("quantity")
+    if quantity is None:
+        return 1
+    return int(quantity) if quantity.isdigit() else _NUMBERS[quantity]
+
+
+def _format_price(item: dict) -> str:
+    if "variations" in item:
+        return " / ".join(f"{v['name']} ₹{v['price']}" for v in item["variations"])
+    return f"₹{item['price']}"
+
+
+def _match_cart_line(cart: Cart, phrase: str) -> Optional[CartLine]:
+    """The cart line the phrase names: exact title, contained tokens or a close spelling."""
+    phrase_tokens = set(phrase.split())
+    item_ids = {line.item_id for line in cart.lines.values()
+                if normalize(line.title) == phrase}
+    if not item_ids:
+        item_ids = {line.item_id for line in cart.lines.values()
+                    if phrase_tokens <= set(normalize(line.title).split())}
+    if not item_ids:
+        item_ids = {line.item_id for line in cart.lines.values()
+                    if difflib.SequenceMatcher(None, phrase, normalize(line.title)).ratio() >= 0.8}
+    if len(item_ids) != 1:
+        return None
+    lines = cart.lines_for_item(item_ids.pop())
+    # several variants of the item in the cart, the model has to ask which one
+    return lines[0] if len(lines) == 1 else None
+
+
+def _awaiting_confirmation(messages: List[AnyMessage], cart: Cart) -> bool:
+    """
+    Whether the assistant's last reply asked the customer to confirm this very
+    cart: a text reply right after a confirm_order result, with the cart unchanged
+    since confirm_order rendered it.
+    """
+    previous = messages[:-1]
+    if not previous or not isinstance(previous[-1], AIMessage) or previous[-1].tool_calls:
+        return False
+    # the results of the model's last tool calls, the confirmation prompt answers them
+    for message in reversed(previous[:-1]):
+        if not isinstance(message, ToolMessage):
+            return False
+        if message.name == "confirm_order":
+            return (message.status != "error" and isinstance(message.artifact, dict)
+                    and message.artifact.get("cart_hash") == cart_hash(cart))
+    return False
+
+
+def _render_cart(cart: Cart, subdomain: Optional[str]) -> str:
+    # the customer reads it as is, so no item ids
+    return render_cart(cart, subdomain, heading="Here is your cart", item_ids=False,
+                       empty="Your cart is empty. What would you like to order today?")
+
+
+async def _menu_index(subdomain: str) -> Optional[MenuIndex]:
+    try:
+        return await menu_cache.get_index(subdomain)
+    except MenuFetchError as e:
+        logger.warning("Router has no menu, leaving the turn to the LLM: %s", e)
+        return None
+
+
+async def route_intent(state: OrderState, text: str,
+                       session_id: Optional[str] = None) -> Optional[Tuple[str, str, dict]]:
+    """(intent, reply, state update) for a high-confidence intent, None for anything else."""
+    cart = state.get("cart") or Cart()
+
+    if SHOW_CART.fullmatch(text):
+        return "show_cart", _render_cart(cart, state["subdomain"]), {}
+
+    if CONFIRM.fullmatch(text) and cart.lines and _awaiting_confirmation(state["messages"], cart):
+        # the customer's message is checkpointed with its id, a resumed turn orders under the same key
+        confirmation, update = await complete_order(cart, state["subdomain"], session_id, state["messages"][-1].id)
+        return "place_order", confirmation, update
+
+    if match := REMOVE_ITEM.fullmatch(text):
+        line = _match_cart_line(cart, match.group("item"))
+        if line is None:
+            return None
+        updated_cart = cart.copy_lines()
+        try:
+            result = apply_operation(updated_cart, CartOperation(
+                op="remove", item_id=line.item_id, title=line.title,
+                quantity=_quantity(match) if match.group("quantity") else line.quantity,
+                variation=line.variation))
+        except CartOperationError:
+            return None
+        return "remove_item", f"{result}.\n\n{_render_cart(updated_cart, state['subdomain'])}", {"cart": updated_cart}
+
+    if match := ADD_ITEM.fullmatch(text):
+        # several items or a customization are the LLM's job
+        if " and " in f" {match.group('item')} " or " with " in f" {match.group('item')} ":
+            return None
+        index = await _menu_index(state["subdomain"])
+        item_id = index.match_title(match.group("item")) if index else None
+        if item_id is None:
+            return None
+        item = index.items[item_id]
+        if "variations" in item or item.get("price") is None or item.get("available") is False:
+            return None
+        updated_cart = cart.copy_lines()
+        try:
+            result = apply_operation(updated_cart, CartOperation(
+                op="add", item_id=item_id, title=item["title"], quantity=_quantity(match),
+                base_price=item["price"]))
+        except CartOperationError:
+            # e.g. "add 0 ...", the model explains it to the customer
+            return None
+        return "add_item", f"{result}.\n\n{_render_cart(updated_cart, state['subdomain'])}", {"cart": updated_cart}
+
+    for pattern, tag, heading in TAG_QUERIES:
+        if pattern.fullmatch(text):
+            index = await _menu_index(state["subdomain"])
+            items = index.tagged(tag) if index else []
+            if not items:
+                return None
+            listing = "\n".join(
+                f"- {item['title']} ({_format_price(item)})" for item in items)
+            return tag, f"{heading}:\n{listing}\n\nWould you like to add any of these to your cart?", {}
+
+    return None
+
+
+async def router(state: OrderState) -> dict:
+    """Answers high-confidence cart and menu intents directly, everything else goes to the LLM."""
+    messages = state.get("messages", [])
+    if not messages or not isinstance(messages[-1], HumanMessage) or state.get("finished"):
+        return {}
+
+    # a new conversation's menu loads while the turn is routed, see seed_menu
+    start_menu_prefetch(state)
+    text = normalize(messages[-1].content if isinstance(messages[-1].content, str) else "")
+    session_id = get_config()["configurable"].get("thread_id")
+    routed = await route_intent(state, text, session_id) if text else None
+    if routed is None:
+        route_counts["llm"] += 1
+        router_turns.inc(tenant=state.get("subdomain") or "", intent="llm")
+        logger.info("Router miss, hit rate %.2f", router_hit_rate())
+        return {}
+
+    intent, reply, update = routed
+    route_counts[intent] += 1
+    router_turns.inc(tenant=state.get("subdomain") or "", intent=intent)
+    logger.info("Router hit intent=%s, hit rate %.2f", intent, router_hit_rate())
+
+    if state.get("cart") is None:
+        # same defaults the chatbot sets on the first turn
+        update = {"cart": Cart(), "orderId": state.get("orderId"),
+                  "finished": state.get("finished", False), **update}
+    return {**update, "messages": [AIMessage(reply)]}
+
+
+def router_hit_rate() -> float:
+    total = sum(route_counts.values())
+    return (total - route_counts["llm"]) / total if total else 0.0
+
+
+def route_after_router(state: OrderState) -> str:
+    """End the turn when the router answered it, otherwise continue to the LLM."""
+    messages = state.get("messages", [])
+    if messages and isinstance(messages[-1], AIMessage):
+        return END
+    return ROUTE_LLM
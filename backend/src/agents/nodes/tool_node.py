@@ -1,10 +1,134 @@
-from agents.tools.cart import get_menu, get_cart, add_cart, remove_from_cart, place_order, confirm_order
-from langgraph.prebuilt import ToolNode
+# ------
+# This file contains the tools node which executes the tool calls of the last AI message
+# ------
 
+import asyncio
+import logging
+import time
+from typing import Dict, List
 
-tools = [get_menu, get_cart, add_cart,
-         remove_from_cart, place_order, confirm_order]
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import BaseTool
+from langgraph.types import Command
 
-# we use prebuilt ToolNode from LangGraph
-# we use prebuilt ToolNode from LangGraph
-tool_node = ToolNode(tools)
+from agents.state import OrderState
+from agents.tools import tools
+from configs.config import config
+from services.metrics import record_tool_call
+from services.traces import trace_tool_call
+
+logger = logging.getLogger(__name__)
+
+# tools that only read the state, their calls run concurrently
+READ_ONLY_TOOLS = {"get_menu", "search_menu", "get_cart", "confirm_order", "order_status"}
+
+# what the LLM is told when a tool does not answer in time
+TIMEOUT_FALLBACKS = {
+    "get_menu": "The menu is taking too long to load, please try again in a moment.",
+    "search_menu": "The menu is taking too long to load, please try again in a moment.",
+    # place_order only waits for the local queue, but a retry is a new call and so a new order
+    "place_order": "Placing the order timed out and it may still go through, "
+                   "check its status with order_status before placing it again.",
+}
+DEFAULT_TIMEOUT_FALLBACK = "{name} timed out and made no changes, please try again."
+
+# same wording as the prebuilt ToolNode, the prompt and the model are used to it
+TOOL_CALL_ERROR_TEMPLATE = "Error: {error}\n Please fix your mistakes."
+INVALID_TOOL_NAME_ERROR_TEMPLATE = "Error: {requested_tool} is not a valid tool, try one of [{available_tools}]."
+
+
+class ToolExecutor:
+    """
+    Executes the tool calls of the last AI message.
+
+    - read-only tool calls run concurrently, so a multi-tool turn takes as long as its slowest tool
+    - state-mutating tool calls run one after another in the order the model emitted them,
+      each one seeing the state updated by the previous ones
+    - every call has a timeout, a call that times out or fails gets a fallback result
+    - every call's latency and outcome is recorded per tool and tenant (see /metrics)
+    """
+
+    def __init__(self, tools: List[BaseTool], default_timeout: float, timeouts: Dict[str, float]):
+        self.tools = {tool.name: tool for tool in tools}
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts
+
+    async def __call__(self, state: OrderState) -> dict:
+        message = state["messages"][-1]
+        if not isinstance(message, AIMessage) or not message.tool_calls:
+            return {}
+        calls = message.tool_calls
+
+        reads = [call for call in calls if call["name"] in READ_ONLY_TOOLS]
+        writes = [call for call in calls if call["name"] not in READ_ONLY_TOOLS]
+
+        results: Dict[str, ToolMessage] = {}
+        update: dict = {}
+
+        async def run_writes():
+            current = dict(state)
+            for call in writes:
+                output = await self._run(call, current)
+                if isinstance(output, Command):
+                    changes = dict(output.update or {})
+                    messages = changes.pop("messages", [])
+                    # every call needs a result paired with its id, even from a Command that only changed the state
+                    result = messages[-1] if messages else ToolMessage(
+                        f"{call['name']} done.", tool_call_id=call["id"])
+                    result.name = result.name or call["name"]
+                    results[call["id"]] = result
+                    # the next mutating call sees this one's changes
+                    current.update(changes)
+                    update.update(changes)
+                else:
+                    results[call["id"]] = output
+
+        async def run_read(call):
+            results[call["id"]] = await self._run(call, state)
+
+        await asyncio.gather(run_writes(), *(run_read(call) for call in reads))
+
+        # results are reported in the order the model emitted the calls
+        return {**update, "messages": [results[call["id"]] for call in calls]}
+
+    async def _run(self, call: dict, state: dict):
+        """ToolMessage (or Command) for one tool call, never raises."""
+        name = call["name"]
+        tool = self.tools.get(name)
+        if tool is None:
+            return ToolMessage(INVALID_TOOL_NAME_ERROR_TEMPLATE.format(
+                requested_tool=name, available_tools=", ".join(self.tools)),
+                name=name, tool_call_id=call["id"], status="error")
+
+        args = dict(call["args"])
+        if "state" in tool.args_schema.model_fields:
+            args["state"] = state
+        timeout = self.timeouts.get(name, self.default_timeout)
+
+        started = time.perf_counter()
+        status = "success"
+        try:
+            output = await asyncio.wait_for(tool.ainvoke(
+                {"type": "tool_call", "name": name, "args": args, "id": call["id"]}), timeout)
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logger.warning("Tool %s timed out after %ss", name, timeout)
+            output = ToolMessage(TIMEOUT_FALLBACKS.get(name, DEFAULT_TIMEOUT_FALLBACK).format(name=name),
+                                 name=name, tool_call_id=call["id"], status="error")
+        except Exception as e:
+            status = "error"
+            logger.warning("Tool %s failed: %r", name, e)
+            output = ToolMessage(TOOL_CALL_ERROR_TEMPLATE.format(error=repr(e)),
+                                 name=name, tool_call_id=call["id"], status="error")
+        elapsed = time.perf_counter() - started
+
+        if isinstance(output, ToolMessage) and output.status == "error" and status == "success":
+            status = "error"
+        record_tool_call(name, state.get("subdomain"), status, elapsed)
+        trace_tool_call(name, call["args"], status, elapsed, output)
+        logger.debug("Tool %s took %.1f ms", name, elapsed * 1000)
+        return output
+
+
+tool_node = ToolExecutor(
+    tools, default_timeout=config.TOOL_TIMEOUT_SECONDS, timeouts=config.TOOL_TIMEOUTS)
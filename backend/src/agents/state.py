@@ -2,8 +2,8 @@
 # This file contains the State of the agent
 # ----
 
-from typing import Optional, TypedDict
-from pydantic import BaseModel, Field
+from typing import Any, Dict, NotRequired, Optional, TypedDict
+from pydantic import BaseModel, Field, PrivateAttr, computed_field, model_validator
 from typing import List, Annotated
 from langgraph.graph.message import add_messages
 
@@ -34,8 +34,116 @@ class CartItem(BaseModel):
     units: List[CartItemUnit]
 
 
+class CartLine(CartItemUnit):
+    item_id: str = Field(description="unique UUID for this item")
+    title: str = Field(description="Name of the item")
+
+    @property
+    def amount_cents(self) -> int:
+        return to_cents(self.base_price) * self.quantity
+
+
+def to_cents(amount: float) -> int:
+    """Prices are summed in cents (paise) so totals never drift."""
+    return round(amount * 100)
+
+
+NO_VARIANT = "no_variant"
+
+
+def cart_key(item_id: str, variation_id: Optional[str] = None) -> str:
+    """Key of a cart line, one line per item and variation."""
+    return f"{item_id}|{variation_id or NO_VARIANT}"
+
+
 class Cart(BaseModel):
-    items: List[CartItem] = Field(default_factory=List)
+    # cart line key (item_id|variation_id) -> line, in the order the lines were added
+    lines: Dict[str, CartLine] = Field(default_factory=dict)
+    # running totals, kept up to date by add / set_quantity instead of summing the lines on every read
+    _quantity: int = PrivateAttr(default=0)
+    _subtotal_cents: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any):
+        self._quantity = sum(line.quantity for line in self.lines.values())
+        self._subtotal_cents = sum(line.amount_cents for line in self.lines.values())
+
+    @model_validator(mode="before")
+    @classmethod
+    def _from_items(cls, data: Any) -> Any:
+        """Accept the nested `items` layout used by older checkpoints and callers."""
+        if not isinstance(data, dict) or "lines" in data or "items" not in data:
+            return data
+        lines = {}
+        for item in data["items"] or []:
+            item = item.model_dump() if isinstance(item, BaseModel) else item
+            for unit in item["units"]:
+                unit = unit.model_dump() if isinstance(unit, BaseModel) else unit
+                lines[unit["key"]] = {
+                    **unit, "item_id": item["item_id"], "title": item["title"]}
+        return {"lines": lines}
+
+    @computed_field
+    @property
+    def items(self) -> List[CartItem]:
+        """The lines grouped by item, the shape the tools and API always exposed."""
+        grouped: Dict[str, CartItem] = {}
+        for line in self.lines.values():
+            item = grouped.get(line.item_id)
+            if item is None:
+                item = grouped[line.item_id] = CartItem(
+                    item_id=line.item_id, title=line.title, units=[])
+            item.units.append(CartItemUnit(
+                key=line.key, quantity=line.quantity, base_price=line.base_price, variation=line.variation))
+        return list(grouped.values())
+
+    def copy_lines(self) -> "Cart":
+        """A cart that can be changed without touching this one (lines are replaced, never mutated)."""
+        copy = Cart.model_construct(lines=dict(self.lines))
+        copy._quantity, copy._subtotal_cents = self._quantity, self._subtotal_cents
+        return copy
+
+    def _replace(self, key: str, line: Optional[CartLine]):
+        old = self.lines.pop(key, None) if line is None else self.lines.get(key)
+        if old is not None:
+            self._quantity -= old.quantity
+            self._subtotal_cents -= old.amount_cents
+        if line is not None:
+            self.lines[key] = line
+            self._quantity += line.quantity
+            self._subtotal_cents += line.amount_cents
+
+    def add(self, item_id: str, title: str, quantity: int, base_price: float,
+            variation: Optional[ItemVariation] = None) -> CartLine:
+        key = cart_key(item_id, variation.id if variation else None)
+        line = self.lines.get(key)
+        if line is None:
+            line = CartLine(key=key, item_id=item_id, title=title, quantity=quantity,
+                            base_price=base_price, variation=variation)
+        else:
+            line = line.model_copy(
+                update={"quantity": line.quantity + quantity})
+        self._replace(key, line)
+        return line
+
+    def set_quantity(self, key: str, quantity: int) -> Optional[CartLine]:
+        """Set the quantity of an existing line, a quantity of 0 removes it."""
+        if quantity <= 0:
+            self._replace(key, None)
+            return None
+        line = self.lines[key].model_copy(update={"quantity": quantity})
+        self._replace(key, line)
+        return line
+
+    def lines_for_item(self, item_id: str) -> List[CartLine]:
+        return [line for line in self.lines.values() if line.item_id == item_id]
+
+    @property
+    def total_quantity(self) -> int:
+        return self._quantity
+
+    @property
+    def subtotal_cents(self) -> int:
+        return self._subtotal_cents
 
 
 class OrderState(TypedDict):
@@ -53,6 +161,9 @@ class OrderState(TypedDict):
 
     orderId: Optional[str]
 
+    # running summary of the turns that were dropped from `messages` to stay within the token budget
+    summary: NotRequired[Optional[str]]
+
     # tenant specific
     restaurant_name: str
     subdomain: str
@@ -0,0 +1,6 @@
+from agents.tools.cart import get_cart, add_cart, update_cart, remove_from_cart, place_order, confirm_order, order_status
+from agents.tools.menu import get_menu, search_menu
+
+# the tool set that is bound to the LLM and executed by the tools node
+tools = [get_menu, search_menu, get_cart, update_cart, add_cart,
+         remove_from_cart, place_order, confirm_order, order_status]
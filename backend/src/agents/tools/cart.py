@@ -1,160 +1,325 @@
-from langchain_core.tools import tool
-import requests
-from configs.config import config
 from langchain_core.tools import tool, InjectedToolCallId
 from langgraph.types import Command
 from langchain_core.messages import ToolMessage
-from pprint import pprint
-from typing import List, Annotated
-from agents.state import CartItemUnit, Cart, CartItem, OrderState
+from langchain_core.runnables import RunnableConfig
+import difflib
+import json
+import logging
+from typing import List, Annotated, Literal, Optional, Tuple
+from pydantic import BaseModel, Field
+from agents.state import CartItemUnit, CartLine, Cart, ItemVariation, OrderState, cart_key
 from langgraph.prebuilt import InjectedState
+from services.menu_cache import MenuFetchError, menu_cache
+from services.cart_summary import cart_hash, cart_payload, cart_totals, money, render_cart
+from services.menu_index import MenuIndex, normalize
+from services.orders import FAILED, QUEUED, SUBMITTED, order_dispatcher
 
+logger = logging.getLogger(__name__)
+
+
+async def complete_order(current_cart: Cart, subdomain: str, session_id: Optional[str],
+                         request_id: str) -> Tuple[str, dict]:
+    """
+    Place the order for a non-empty cart: the confirmation text and the state update.
+    `request_id` identifies the request to order, a replay of it returns the same order.
+    """
+
+    # the order is queued locally and sent to the order backend in the background, so the
+    # turn never waits for it; the id is provisional until the backend accepted the order
+    order = await order_dispatcher.enqueue(subdomain, session_id, cart_payload(current_cart, subdomain), request_id)
+    totals = cart_totals(current_cart, subdomain)
+
+    # Update state: clear cart, set orderId, and mark as finished
+    confirmation = (f"Order placed successfully! Your order ID is {order.order_id}. "
+                    f"Total items: {totals.quantity}, amount: {money(totals.total)}. Thank you for your order!")
+    return confirmation, {
+        "cart": Cart(),
+        "orderId": order.order_id,
+        "finished": True,
+    }
 
-@tool
-def get_menu(state: Annotated[OrderState, InjectedState]):
-    """Provide the latest up-to-date menu."""
 
-    # once you fetch the menu from backend service
-    # try to convert it into LLM readable format (if possible - check this case)
+class CartOperation(BaseModel):
+    op: Literal["add", "remove", "set_quantity"] = Field(
+        description="add: increase the quantity, remove: decrease it, set_quantity: set it (0 removes the item)")
+    item_id: Optional[str] = Field(
+        default=None, description="Unique UUID for the item, leave it out if unknown and the title is matched")
+    title: str = Field(description="Title of the item")
+    quantity: int = Field(description="Quantity to add, remove or set")
+    base_price: Optional[float] = Field(
+        default=None, description="Not needed, the price is taken from the menu")
+    variation: Optional[ItemVariation] = Field(
+        default=None, description="Variation of the item, only if the item has variants like Full/Half")
 
-    MENU_URL = f"{config.MENU_BACKEND_URL}?subdomain={state["subdomain"]}"
 
-    response = requests.get(MENU_URL)
+# nearest matches returned with an error, so the model can fix the call without fetching the menu
+SUGGESTION_LIMIT = 3
 
-    if response.status_code == 200:
-        menu = response.json()
-        items = menu['items']
-        return items
-    else:
-        print("Error fetching the menu")
+
+class CartOperationError(Exception):
+    """An operation that cannot be applied to the cart, reported to the LLM with a code and nearest matches."""
+
+    def __init__(self, message: str, code: str = "invalid_operation", suggestions: Optional[List[dict]] = None):
+        super().__init__(message)
+        self.code = code
+        self.suggestions = suggestions or []
+
+    def to_dict(self) -> dict:
+        error = {"code": self.code, "message": str(self)}
+        if self.suggestions:
+            error["suggestions"] = self.suggestions
+        return error
+
+
+def _valid_variation(variation: Optional[ItemVariation]) -> Optional[ItemVariation]:
+    # the LLM sometimes sends an empty variation for items without variants
+    if variation and variation.id and variation.id.strip():
+        return variation
+    return None
+
+
+def _line_suggestion(line: CartLine) -> dict:
+    suggestion = {"item_id": line.item_id, "title": line.title, "quantity": line.quantity}
+    if line.variation:
+        suggestion["variation"] = line.variation.model_dump()
+    return suggestion
+
+
+def _resolve_menu_item(index: MenuIndex, operation: CartOperation) -> CartOperation:
+    """
+    The add operation with the item, variation and price taken from the menu.
+    A missing or unknown item id falls back to matching the title.
+    """
+    item = index.items.get(operation.item_id or "")
+    if item is None:
+        item_id = index.match_title(operation.title)
+        if item_id is None:
+            suggestions = [index.items[match["id"]]
+                           for match in index.search(operation.title, limit=SUGGESTION_LIMIT)]
+            raise CartOperationError(
+                f"{operation.title} is not on the menu, see the closest items.", "unknown_item", suggestions)
+        item = index.items[item_id]
+    title = item["title"]
+    if item.get("available") is False:
+        raise CartOperationError(f"{title} is not available right now.", "unavailable")
+
+    variations = item.get("variations") or []
+    if not variations:
+        if item.get("price") is None:
+            raise CartOperationError(f"{title} has no price on the menu.", "no_price")
+        return operation.model_copy(update={
+            "item_id": item["id"], "title": title, "base_price": float(item["price"]), "variation": None})
+
+    requested = operation.variation
+    if requested is None or not (requested.id or requested.name or "").strip():
+        raise CartOperationError(f"{title} comes in several variants, pick one.", "variation_required", variations)
+    # by id, or by name ("Half") when the model only got the name right
+    choice = next((v for v in variations if v["id"] == requested.id), None) or next(
+        (v for v in variations if normalize(v["name"]) == normalize(requested.name)), None)
+    if choice is None:
+        raise CartOperationError(
+            f"{title} has no variant {requested.name or requested.id}.", "unknown_variation", variations)
+    return operation.model_copy(update={
+        "item_id": item["id"], "title": title, "base_price": float(choice["price"]),
+        "variation": ItemVariation(id=choice["id"], name=choice["name"], price=str(choice["price"]))})
+
+
+def _resolve_cart_line(cart: Cart, operation: CartOperation) -> CartOperation:
+    """The remove / set_quantity operation pointed at the cart line it means."""
+    variation = _valid_variation(operation.variation)
+    if operation.item_id and cart_key(operation.item_id, variation.id if variation else None) in cart.lines:
+        return operation
+
+    candidates = cart.lines_for_item(operation.item_id) if operation.item_id else []
+    if not candidates:
+        # unknown id, match the title against what is in the cart
+        title = normalize(operation.title)
+        candidates = [line for line in cart.lines.values() if normalize(line.title) == title] or [
+            line for line in cart.lines.values()
+            if difflib.SequenceMatcher(None, title, normalize(line.title)).ratio() >= 0.8]
+    requested = operation.variation
+    if requested and ((requested.id or "").strip() or (requested.name or "").strip()):
+        # by id or by name, but never another variant: "remove the Full one" must not touch the Half line
+        of_item = candidates
+        candidates = [line for line in candidates if line.variation and (
+            (requested.id and line.variation.id == requested.id)
+            or (requested.name and normalize(line.variation.name) == normalize(requested.name)))]
+        if not candidates and of_item:
+            raise CartOperationError(
+                f"Variant {requested.name or requested.id} of {operation.title} is not in the cart.",
+                "not_in_cart", [_line_suggestion(line) for line in of_item])
+
+    if len(candidates) == 1:
+        line = candidates[0]
+        return operation.model_copy(update={
+            "item_id": line.item_id, "title": line.title, "variation": line.variation})
+    if candidates:
+        raise CartOperationError(f"Several variants of {operation.title} are in the cart, pick one.",
+                                 "ambiguous_cart_line", [_line_suggestion(line) for line in candidates])
+    raise CartOperationError(f"{operation.title} is not in the cart.", "not_in_cart",
+                             [_line_suggestion(line) for line in cart.lines.values()])
+
+
+def resolve_operation(index: Optional[MenuIndex], cart: Cart, operation: CartOperation) -> CartOperation:
+    """Check an operation from the model against the menu (adds) or the cart (removals)."""
+    if operation.op != "add":
+        return _resolve_cart_line(cart, operation)
+    if index is None:
+        # menu backend down and nothing cached: prices only ever come from the menu, never from the model
+        raise CartOperationError("The menu cannot be loaded right now, items cannot be added. Try again shortly.",
+                                 "menu_unavailable")
+    return _resolve_menu_item(index, operation)
+
+
+async def menu_index_for(subdomain: str) -> Optional[MenuIndex]:
+    try:
+        return await menu_cache.get_index(subdomain)
+    except MenuFetchError as e:
+        logger.warning("Menu unavailable, items cannot be added to carts: %s", e)
+        return None
+
+
+def apply_operation(cart: Cart, operation: CartOperation) -> str:
+    """Apply one operation to the cart in place and describe the result."""
+    variation = _valid_variation(operation.variation)
+    title = operation.title
+    if not operation.item_id:
+        raise CartOperationError(f"Cannot find {title} without its item_id.", "unknown_item")
+    key = cart_key(operation.item_id, variation.id if variation else None)
+    line = cart.lines.get(key)
+
+    if operation.op == "add":
+        if operation.quantity <= 0:
+            raise CartOperationError(
+                f"Cannot add {operation.quantity} {title}, the quantity must be positive.", "invalid_quantity")
+        if operation.base_price is None:
+            raise CartOperationError(f"Cannot add {title} without its price.", "no_price")
+        line = cart.add(operation.item_id, title, operation.quantity,
+                        operation.base_price, variation)
+        return f"Added {operation.quantity} x {title} to cart (now {line.quantity})"
+
+    if line is None:
+        if cart.lines_for_item(operation.item_id):
+            raise CartOperationError(f"Variant of {title} not found in cart.", "not_in_cart")
+        raise CartOperationError(f"Item {title} not found in cart.", "not_in_cart")
+
+    if operation.op == "remove":
+        if operation.quantity <= 0:
+            raise CartOperationError(
+                f"Cannot remove {operation.quantity} {title}, the quantity must be positive.", "invalid_quantity")
+        if operation.quantity > line.quantity:
+            raise CartOperationError(
+                f"Cannot remove {operation.quantity} {title}. Only {line.quantity} available.", "invalid_quantity")
+        if cart.set_quantity(key, line.quantity - operation.quantity) is None:
+            return f"Removed {title} from cart"
+        return f"Reduced {title} quantity by {operation.quantity}"
+
+    if operation.quantity < 0:
+        raise CartOperationError(
+            f"Cannot set the quantity of {title} to {operation.quantity}.", "invalid_quantity")
+    if cart.set_quantity(key, operation.quantity) is None:
+        return f"Removed {title} from cart"
+    return f"Set {title} quantity to {operation.quantity}"
 
 
 @tool
-def add_cart(item_id: str, title: str, new_item: CartItemUnit, tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[OrderState, InjectedState]):
+async def update_cart(operations: List[CartOperation], tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[OrderState, InjectedState]):
     """
-    Adds an item to the cart
+    Applies several cart changes at once: use this whenever the customer adds, removes or
+    changes more than one item. Either every operation is applied or none is.
 
     Args:
-    item_id : Unique UUID for the item
-    title: Title of the item
-    new_item: Cart item details with base_price, quantity, and variation (only if the item has variants like Full/Half)
+    operations: List of operations, each with op (add/remove/set_quantity), item_id, title,
+        quantity and variation (only if the item has variants like Full/Half). Prices come from the menu.
     """
+    current_cart = state["cart"] or Cart()
+    updated_cart = current_cart.copy_lines()
+    # removals are checked against the cart, only adds need the menu
+    index = await menu_index_for(state["subdomain"]) if any(op.op == "add" for op in operations) else None
+
+    results = []
+    failed = False
+    for number, operation in enumerate(operations, start=1):
+        try:
+            result = apply_operation(updated_cart, resolve_operation(index, updated_cart, operation))
+            results.append({"operation": number, "status": "ok", "result": result})
+        except CartOperationError as e:
+            failed = True
+            results.append({"operation": number, "status": "failed", **e.to_dict()})
+
+    if failed:
+        # all or nothing, so a partly applied order never reaches the customer
+        return Command(update={
+            "messages": [
+                ToolMessage(json.dumps({
+                    "error": "No changes were made to the cart, fix the failed operations and retry",
+                    "results": results,
+                }, ensure_ascii=False), tool_call_id=tool_call_id, status="error")
+            ]
+        })
 
-    # Handle variation ID safely
-    variation_id = "no_variant"
-    valid_variation = None
+    logger.debug("Cart after update: %s", updated_cart.lines)
 
-    # Only process variation if it exists and has valid data
-    if (new_item.variation and
-        hasattr(new_item.variation, 'id') and
-        new_item.variation.id and
-            new_item.variation.id.strip()):
-        variation_id = new_item.variation.id
-        valid_variation = new_item.variation
+    return Command(update={
+        "cart": updated_cart,
+        "messages": [
+            ToolMessage("\n".join(f"{result['operation']}. ok: {result['result']}" for result in results),
+                        tool_call_id=tool_call_id)
+        ]
+    })
 
-    item_key = f"{item_id}|{variation_id}"
 
-    # Create a proper CartItemUnit with the key
-    updated_unit = CartItemUnit(
-        key=item_key,
-        quantity=new_item.quantity,
-        base_price=new_item.base_price,
-        variation=valid_variation
-    )
+@tool
+async def add_cart(item_id: str, title: str, new_item: CartItemUnit, tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[OrderState, InjectedState]):
+    """
+    Adds an item to the cart
 
-    print(updated_unit)
+    Args:
+    item_id : Unique UUID for the item
+    title: Title of the item
+    new_item: Cart item details with quantity and variation (only if the item has variants like Full/Half),
+        the price is taken from the menu
+    """
 
-    # Get current cart
-    current_cart = state["cart"]
-    if current_cart is None:
-        # If cart is None, create new cart with this item
-        new_cart_item = CartItem(
-            item_id=item_id,
-            title=title,
-            units=[updated_unit]
-        )
-        updated_cart = Cart(items=[new_cart_item])
-    else:
-        # Check if item already exists in cart
-        item_found = False
-        updated_items = []
-
-        for existing_item in current_cart.items:
-            if existing_item.item_id == item_id:
-                # Item exists, check if this specific variant exists
-                unit_found = False
-                updated_units = []
-
-                for existing_unit in existing_item.units:
-                    if existing_unit.key == item_key:
-                        # Same variant exists, increment quantity
-                        updated_units.append(CartItemUnit(
-                            key=existing_unit.key,
-                            quantity=existing_unit.quantity + new_item.quantity,
-                            base_price=existing_unit.base_price,
-                            variation=existing_unit.variation
-                        ))
-                        unit_found = True
-                    else:
-                        updated_units.append(existing_unit)
-
-                if not unit_found:
-                    # New variant of existing item
-                    updated_units.append(updated_unit)
-
-                updated_items.append(CartItem(
-                    item_id=existing_item.item_id,
-                    title=existing_item.title,
-                    units=updated_units
-                ))
-                item_found = True
-            else:
-                updated_items.append(existing_item)
-
-        if not item_found:
-            # Completely new item
-            new_cart_item = CartItem(
-                item_id=item_id,
-                title=title,
-                units=[updated_unit]
-            )
-            updated_items.append(new_cart_item)
-
-        updated_cart = Cart(items=updated_items)
-
-    print("Printing cart")
-    pprint(updated_cart.model_dump())
+    updated_cart = (state["cart"] or Cart()).copy_lines()
+    index = await menu_index_for(state["subdomain"])
+    try:
+        operation = resolve_operation(index, updated_cart, CartOperation(
+            op="add", item_id=item_id, title=title, quantity=new_item.quantity,
+            base_price=new_item.base_price, variation=new_item.variation))
+        apply_operation(updated_cart, operation)
+    except CartOperationError as e:
+        return Command(update={
+            "messages": [ToolMessage(json.dumps(e.to_dict(), ensure_ascii=False),
+                                     tool_call_id=tool_call_id, status="error")]
+        })
+
+    logger.debug("Cart after update: %s", updated_cart.lines)
 
     return Command(update={
         "cart": updated_cart,
         "messages": [
             ToolMessage(
-                f"Added {title} to cart", tool_call_id=tool_call_id)
+                f"Added {operation.title} to cart", tool_call_id=tool_call_id)
         ]
     })
 
 
 @tool
-def remove_from_cart(item_id: str, title: str, new_item: CartItemUnit, tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[OrderState, InjectedState]):
+async def remove_from_cart(item_id: str, title: str, new_item: CartItemUnit, tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[OrderState, InjectedState]):
     """
     Removes an item from the cart
 
     Args:
     item_id : Unique UUID for the item
     title: Title of the item
-    new_item: A dict containing base_price and quantity of the item to remove
+    new_item: Cart item details with the quantity to remove and the variation (only if the item has variants
+        like Full/Half), the line and its price are looked up in the cart
     """
 
-    # Handle variation ID safely
-    variation_id = "no_variant"
-    if new_item.variation and hasattr(new_item.variation, 'id'):
-        variation_id = new_item.variation.id
-
-    item_key = f"{item_id}|{variation_id}"
-
     # Get current cart
     current_cart = state["cart"]
-    if current_cart is None or not current_cart.items:
+    if current_cart is None or not current_cart.lines:
         return Command(update={
             "messages": [
                 ToolMessage(
@@ -162,68 +327,18 @@ def remove_from_cart(item_id: str, title: str, new_item: CartItemUnit, tool_call
             ]
         })
 
-    # Find and remove the item
-    updated_items = []
-    item_found = False
-    removal_message = f"Item {title} not found in cart."
-
-    for existing_item in current_cart.items:
-        if existing_item.item_id == item_id:
-            # Item exists, check if this specific variant exists
-            unit_found = False
-            updated_units = []
-
-            for existing_unit in existing_item.units:
-                if existing_unit.key == item_key:
-                    # Found the variant to remove
-                    unit_found = True
-                    if existing_unit.quantity > new_item.quantity:
-                        # Reduce quantity
-                        updated_units.append(CartItemUnit(
-                            key=existing_unit.key,
-                            quantity=existing_unit.quantity - new_item.quantity,
-                            base_price=existing_unit.base_price,
-                            variation=existing_unit.variation
-                        ))
-                        removal_message = f"Reduced {title} quantity by {new_item.quantity}"
-                    elif existing_unit.quantity == new_item.quantity:
-                        # Remove this variant completely (don't add to updated_units)
-                        removal_message = f"Removed {title} from cart"
-                    else:
-                        # Trying to remove more than available
-                        updated_units.append(existing_unit)
-                        removal_message = f"Cannot remove {new_item.quantity} {title}. Only {existing_unit.quantity} available."
-                else:
-                    # Keep other variants
-                    updated_units.append(existing_unit)
-
-            if unit_found:
-                item_found = True
-                if updated_units:
-                    # Still has other variants, keep the item
-                    updated_items.append(CartItem(
-                        item_id=existing_item.item_id,
-                        title=existing_item.title,
-                        units=updated_units
-                    ))
-                # If no units left, item is completely removed (don't add to updated_items)
-            else:
-                # Variant not found, keep original item
-                updated_items.append(existing_item)
-                removal_message = f"Variant of {title} not found in cart."
-        else:
-            # Different item, keep it
-            updated_items.append(existing_item)
-
-    if not item_found:
-        # Item ID not found at all
-        updated_cart = current_cart
-    else:
-        # Update cart with remaining items
-        updated_cart = Cart(items=updated_items)
-
-    print("Cart after removal:")
-    pprint(updated_cart.model_dump())
+    updated_cart = current_cart.copy_lines()
+    try:
+        removal_message = apply_operation(updated_cart, resolve_operation(None, updated_cart, CartOperation(
+            op="remove", item_id=item_id, title=title, quantity=new_item.quantity,
+            variation=new_item.variation)))
+    except CartOperationError as e:
+        return Command(update={
+            "messages": [ToolMessage(json.dumps(e.to_dict(), ensure_ascii=False),
+                                     tool_call_id=tool_call_id, status="error")]
+        })
+
+    logger.debug("Cart after removal: %s", updated_cart.lines)
 
     return Command(update={
         "cart": updated_cart,
@@ -233,33 +348,30 @@ def remove_from_cart(item_id: str, title: str, new_item: CartItemUnit, tool_call
     })
 
 
-@tool
-def clear_cart(state: Annotated[OrderState, InjectedState]):
-    """Clears the entire cart and removes all the present items in the cart"""
-    return
-
-
-@tool
-def confirm_order(state: Annotated[OrderState, InjectedState]):
-    """Provide the lastest items in the cart for user to confirm"""
-    return state['cart']
+@tool(response_format="content_and_artifact")
+async def confirm_order(state: Annotated[OrderState, InjectedState]):
+    """Provide the lastest items in the cart, with the amounts and totals, for user to confirm"""
+    # the model reads the compact text, the structured cart is kept for the UI, and its hash
+    # for the router, which places the order on a bare "yes" only if the cart is still the same
+    return (render_cart(state['cart'], state['subdomain'], heading="Order to confirm"),
+            {**cart_payload(state['cart'], state['subdomain']), "cart_hash": cart_hash(state['cart'])})
 
 
-@tool
-def get_cart(state: Annotated[OrderState, InjectedState]):
-    """Provide the lastest items in the cart"""
-    # print("Input State", state)
-    return state['cart']
+@tool(response_format="content_and_artifact")
+async def get_cart(state: Annotated[OrderState, InjectedState]):
+    """Provide the lastest items in the cart, with the amounts and totals"""
+    return render_cart(state['cart'], state['subdomain']), cart_payload(state['cart'], state['subdomain'])
 
 
 @tool
-def place_order(tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[OrderState, InjectedState]):
+async def place_order(tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[OrderState, InjectedState],
+                      config: RunnableConfig):
     """Place the order and complete the ordering process"""
 
     current_cart = state['cart']
 
     # Check if cart is empty
-    if current_cart is None or not current_cart.items:
+    if current_cart is None or not current_cart.lines:
         return Command(update={
             "messages": [
                 ToolMessage(
@@ -269,29 +381,38 @@ def place_order(tool_call_id: Annotated[str, InjectedToolCallId], state: Annotat
             ]
         })
 
-    # TODO: Call the backend API to place the order which returns an orderId for the customer
-    # For now, we'll simulate with a mock order ID
-    import uuid
-    # Generate a short mock order ID
-    mock_order_id = "ZKS" + str(uuid.uuid4())[:8]
-
-    # Calculate total items for confirmation message
-    total_items = sum(sum(unit.quantity for unit in item.units)
-                      for item in current_cart.items)
-
-    # Clear the cart after placing order
-    empty_cart = Cart(items=[])
-
-    # Update state: clear cart, set orderId, and mark as finished
+    confirmation, update = await complete_order(
+        current_cart, state['subdomain'], config["configurable"].get("thread_id"), tool_call_id)
     return Command(update={
-        "cart": empty_cart,
-        "orderId": mock_order_id,
-        "finished": True,
+        **update,
         "messages": [
-            ToolMessage(
-                f"Order placed successfully! Your order ID is {mock_order_id}. "
-                f"Total items: {total_items}. Thank you for your order!",
-                tool_call_id=tool_call_id
-            )
+            ToolMessage(confirmation, tool_call_id=tool_call_id)
         ]
     })
+
+
+ORDER_STATUS_MESSAGES = {
+    QUEUED: "Order {order_id} is being sent to the restaurant.",
+    SUBMITTED: "Order {order_id} has been received by the restaurant (reference {backend_order_id}).",
+    FAILED: "Order {order_id} could not be placed: {error}. Placing it again sends it as a new order.",
+}
+
+
+@tool
+async def order_status(state: Annotated[OrderState, InjectedState], config: RunnableConfig,
+                       order_id: Optional[str] = None):
+    """
+    Whether a placed order has reached the restaurant
+
+    Args:
+    order_id: Id of the order, the order placed in this conversation when left out
+    """
+    order_id = order_id or state.get('orderId')
+    if not order_id:
+        return "No order has been placed in this conversation."
+    # only orders of this conversation, another customer's order reads as unknown
+    order = await order_dispatcher.status(order_id, state['subdomain'], config["configurable"].get("thread_id"))
+    if order is None:
+        return f"There is no order {order_id}."
+    return ORDER_STATUS_MESSAGES[order.status].format(
+        order_id=order.order_id, backend_order_id=order.backend_order_id, error=order.error)
@@ -0,0 +1,47 @@
+from langchain_core.tools import tool
+from typing import Annotated, Optional
+from agents.state import OrderState
+from langgraph.prebuilt import InjectedState
+from services.menu_cache import menu_cache, MenuFetchError
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@tool
+async def get_menu(state: Annotated[OrderState, InjectedState]):
+    """Provide the latest up-to-date menu."""
+
+    try:
+        # served from the per-tenant cache, the backend is only hit on a miss
+        menu_index = await menu_cache.get_index(state["subdomain"])
+    except MenuFetchError as e:
+        logger.warning("Menu unavailable: %s", e)
+        return "Error fetching the menu, please try again."
+
+    # compact projection (id, title, price, variations) precomputed per menu version
+    return menu_index.compact_json
+
+
+@tool
+async def search_menu(query: str, state: Annotated[OrderState, InjectedState], category: Optional[str] = None):
+    """
+    Search the menu for items matching the customer's words
+
+    Args:
+    query: Item name or words from it (spelling mistakes are fine), can be empty when browsing a category
+    category: Optional category to search in, e.g. Breakfast or Today's Special
+    """
+
+    try:
+        menu_index = await menu_cache.get_index(state["subdomain"])
+    except MenuFetchError as e:
+        logger.warning("Menu unavailable: %s", e)
+        return "Error fetching the menu, please try again."
+
+    matches = menu_index.search(query, category)
+    if not matches:
+        return f"No menu items found for '{query}'" + (f" in {category}" if category else "")
+
+    return json.dumps(matches, separators=(",", ":"), ensure_ascii=False)
@@ -0,0 +1,279 @@
+# ----
+# WebSocket chat transport: one connection carries every turn of a session.
+# The tenant, the thread config and the cart view are set up once when the
+# client connects and the session's checkpoint stays in memory between turns,
+# turns stream the same events as the SSE token stream, and order status
+# changes are pushed as the dispatcher reports them.
+# ----
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional, Set
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from agents.agent import get_chatbot_agent
+from api.routes.chats import token_events
+from configs.config import config as app_config
+from services.admission import AdmissionRejected, admission
+from services.cart_summary import cart_totals
+from services.log import bind_session
+from services.menu_cache import MenuFetchError, menu_cache
+from services.metrics import current_turn, metrics
+from services.orders import QueuedOrder, order_dispatcher
+from services.state_view import DEFAULT_FIELDS, channels_for, project_state
+from services.turns import SessionBusy, session_locks
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+ws_sessions = metrics.gauge("ws_sessions", "Open WebSocket chat sessions")
+ws_messages = metrics.counter(
+    "ws_messages_total", "Client messages on WebSocket sessions, by outcome (turn, busy, rejected, error)",
+    ["tenant", "outcome"])
+ws_closes = metrics.counter("ws_closes_total", "WebSocket sessions ended, by reason", ["reason"])
+
+# reason a session ended -> close code sent to the client
+CLOSE_CODES = {"idle": 1001, "slow_consumer": 1013, "error": 1011}
+
+
+class SlowConsumer(Exception):
+    """The client does not read its events as fast as the turns produce them."""
+
+
+class ChatSession:
+    """
+    One live connection. Its tasks: the reader parses client frames, the writer
+    drains the bounded outbox into the socket, the heartbeat pings and drops
+    silent clients, and the turn loop runs the queued messages one at a time.
+
+    Client frames: {"type": "message", "content": ..., "id": ...}, "get_cart",
+    "ping" and "pong". Server events: "ready", "turn_start", the events of
+    `token_events`, "turn_end", "cart", "order_status", "ping", "pong" and "error".
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: str, restaurant_name: str, subdomain: str):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.restaurant_name = restaurant_name
+        self.subdomain = subdomain
+        self.config = {"configurable": {"thread_id": session_id}}
+        self.outbox: asyncio.Queue = asyncio.Queue(app_config.WS_SEND_QUEUE_SIZE)
+        self.inbox: asyncio.Queue = asyncio.Queue(app_config.WS_MAX_PENDING_MESSAGES)
+        # cart, totals, orderId and finished as of the latest turn
+        self.view: dict = {}
+        self.last_seen = time.monotonic()
+        self._overflowed = asyncio.Event()
+
+    async def send(self, event_type: str, data: dict):
+        """Queue an event; a running turn waits while the outbox is full, so it goes at the client's pace."""
+        try:
+            await asyncio.wait_for(self.outbox.put({"type": event_type, **data}), app_config.WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise SlowConsumer(f"outbox full for {app_config.WS_SEND_TIMEOUT_SECONDS}s")
+
+    def push(self, event_type: str, data: dict, droppable: bool = False):
+        """Queue an event without waiting: a droppable one is skipped when the outbox is full, else the client is dropped."""
+        try:
+            self.outbox.put_nowait({"type": event_type, **data})
+        except asyncio.QueueFull:
+            if not droppable:
+                self._overflowed.set()
+
+    async def serve(self) -> str:
+        """Run the session until it ends, returns why it ended."""
+        bind_session(self.session_id, self.subdomain)
+        checkpointer = (await get_chatbot_agent()).checkpointer
+        # while connected the session's latest checkpoint stays in memory, turns do not load it again
+        checkpointer.pin(self.session_id)
+        try:
+            return await self._serve(checkpointer)
+        finally:
+            checkpointer.unpin(self.session_id)
+
+    async def _serve(self, checkpointer) -> str:
+        found = await checkpointer.aread_channels(self.session_id, channels_for(DEFAULT_FIELDS))
+        if found is not None:
+            self.view = project_state(*found, DEFAULT_FIELDS)
+            del self.view["version"]
+        else:
+            self.view = {"cart": None, "totals": cart_totals(None).to_dict(), "orderId": None, "finished": False}
+        try:
+            # the turns' menu lookups are cache hits from here on, the heartbeat keeps the tenant hot
+            await menu_cache.get_index(self.subdomain)
+        except MenuFetchError as e:
+            logger.warning("Menu of %s not prefetched: %s", self.subdomain, e)
+        self.push("ready", {"session_id": self.session_id, **self.view})
+
+        tasks = {
+            asyncio.create_task(self._read(), name="read"),
+            asyncio.create_task(self._write(), name="write"),
+            asyncio.create_task(self._heartbeat(), name="heartbeat"),
+            asyncio.create_task(self._run_turns(), name="turns"),
+            asyncio.create_task(self._overflowed.wait(), name="overflow"),
+        }
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        task = done.pop()
+        if task.get_name() == "overflow":
+            return "slow_consumer"
+        error = task.exception()
+        if error is None:
+            return task.result()
+        if isinstance(error, SlowConsumer):
+            return "slow_consumer"
+        if isinstance(error, WebSocketDisconnect):
+            return "client_closed"
+        logger.error("WebSocket session %s failed", self.session_id, exc_info=error)
+        return "error"
+
+    async def _read(self) -> str:
+        while True:
+            try:
+                frame = json.loads(await self.websocket.receive_text())
+            except WebSocketDisconnect:
+                return "client_closed"
+            except ValueError:
+                self.push("error", {"code": "bad_request", "message": "Frames must be JSON objects"})
+                continue
+            self.last_seen = time.monotonic()
+            kind = frame.get("type") if isinstance(frame, dict) else None
+
+            if kind == "message":
+                content = str(frame.get("content") or "").strip()
+                if not content:
+                    self.push("error", {"code": "bad_request", "message": "content cannot be empty",
+                                        "id": frame.get("id")})
+                    continue
+                try:
+                    self.inbox.put_nowait({"content": content, "id": frame.get("id")})
+                except asyncio.QueueFull:
+                    ws_messages.inc(tenant=self.subdomain, outcome="busy")
+                    self.push("error", {"code": "busy", "message": "Too many messages waiting for an answer",
+                                        "id": frame.get("id"), "retryable": True})
+            elif kind == "get_cart":
+                # answered from the view kept by the session, no checkpoint read
+                self.push("cart", self.view)
+            elif kind == "ping":
+                self.push("pong", {}, droppable=True)
+            elif kind != "pong":
+                self.push("error", {"code": "bad_request", "message": f"Unknown frame type {kind!r}"})
+
+    async def _write(self):
+        while True:
+            event = await self.outbox.get()
+            await self.websocket.send_text(json.dumps(event))
+
+    async def _heartbeat(self) -> str:
+        while True:
+            await asyncio.sleep(app_config.WS_HEARTBEAT_SECONDS)
+            if time.monotonic() - self.last_seen > app_config.WS_IDLE_TIMEOUT_SECONDS:
+                return "idle"
+            menu_cache.touch(self.subdomain)
+            # a client busy reading a turn's events has no use for a ping
+            self.push("ping", {}, droppable=True)
+
+    async def _run_turns(self):
+        while True:
+            message = await self.inbox.get()
+            await self._turn(message["content"], message["id"])
+
+    async def _turn(self, content: str, message_id: Optional[str]):
+        try:
+            admission.admit(self.subdomain)
+            release = await session_locks.acquire(self.session_id, app_config.SESSION_LOCK_WAIT_SECONDS)
+        except AdmissionRejected as e:
+            ws_messages.inc(tenant=self.subdomain, outcome="rejected")
+            await self.send("error", {"code": e.reason, "message": str(e), "id": message_id,
+                                      "retryable": True, "retry_after": round(e.retry_after, 1)})
+            return
+        except SessionBusy as e:
+            # a turn of the same session is running on another connection or over HTTP
+            admission.refund(self.subdomain)
+            ws_messages.inc(tenant=self.subdomain, outcome="rejected")
+            await self.send("error", {"code": "session_busy", "message": str(e), "id": message_id,
+                                      "retryable": True})
+            return
+
+        graph_input = {
+            "messages": [{"role": "user", "content": content}],
+            "restaurant_name": self.restaurant_name,
+            "subdomain": self.subdomain,
+        }
+        try:
+            await self.send("turn_start", {"id": message_id})
+            async for event_type, data in token_events(graph_input, self.config):
+                if event_type == "cart_update":
+                    # the event leaves out the order fields it did not change
+                    self.view = {**self.view, **data}
+                await self.send(event_type, data)
+        except SlowConsumer:
+            raise
+        except Exception:
+            logger.exception("Turn of %s failed", self.session_id)
+            ws_messages.inc(tenant=self.subdomain, outcome="error")
+            await self.send("error", {"code": "internal_error", "message": "The message could not be answered",
+                                      "id": message_id, "retryable": True})
+            return
+        finally:
+            release()
+        ws_messages.inc(tenant=self.subdomain, outcome="turn")
+        turn = current_turn()
+        await self.send("turn_end", {"id": message_id, "seconds": round(turn.elapsed, 3) if turn else None})
+
+
+# session id -> its open connections (the same conversation may be open in several tabs)
+_open_sessions: Dict[str, Set[ChatSession]] = {}
+
+
+def push_order_status(order: QueuedOrder):
+    """Tell the connections of the order's session that it was submitted, failed or will be retried."""
+    for session in _open_sessions.get(order.session_id or "", ()):
+        session.push("order_status", {
+            "order_id": order.order_id,
+            "status": order.status,
+            "backend_order_id": order.backend_order_id,
+            "error": order.error,
+            "attempts": order.attempts,
+        })
+
+
+order_dispatcher.add_listener(push_order_status)
+metrics.add_collector(lambda: ws_sessions.set(sum(len(sessions) for sessions in _open_sessions.values())))
+
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket, session_id: str, restaurant_name: str, subdomain: str):
+    """A chat session over one WebSocket, identified once by its query parameters."""
+    if not (session_id.strip() and restaurant_name.strip() and subdomain.strip()):
+        await websocket.close(code=1008, reason="session_id, restaurant_name and subdomain are required")
+        return
+    await websocket.accept()
+
+    session = ChatSession(websocket, session_id, restaurant_name, subdomain)
+    _open_sessions.setdefault(session_id, set()).add(session)
+    reason = "error"
+    try:
+        reason = await session.serve()
+    finally:
+        sessions = _open_sessions.get(session_id)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del _open_sessions[session_id]
+        ws_closes.inc(reason=reason)
+
+    if reason != "client_closed":
+        try:
+            await websocket.close(code=CLOSE_CODES.get(reason, 1000), reason=reason)
+        except RuntimeError:
+            # the client closed first
+            pass
@@ -1,37 +1,258 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+import asyncio
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 import json
+import logging
 from pydantic import BaseModel
-from typing import Optional
-from agents.graph import chatbot_agent_builder
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from langchain_core.messages import AIMessage, AIMessageChunk, RemoveMessage, ToolMessage
+from agents.agent import get_chatbot_agent
+from configs.config import config as app_config
+from services.admission import AdmissionRejected, admission
+from services.cart_summary import cart_totals
+from services.log import bind_session
+from services.state_view import channels_for, parse_fields, project_state, view_etag
+from services.metrics import TurnTimings, current_turn, finish_turn, start_turn
+from services.model_calls import start_deadline
+from services.traces import trace_recorder
+from services.turns import IdempotencyMismatch, SessionBusy, replay_cache, request_fingerprint, session_locks
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 # Define request body model
 
-chatbot_agent = chatbot_agent_builder()
-
 
 class ChatRequest(BaseModel):
     user_message: str
     session_id: Optional[str]
     restaurant_name: str
     subdomain: str
+    # forward model output token by token instead of whole AI messages
+    stream_tokens: bool = False
+    # same as the Idempotency-Key header, a retry with the same key replays the first answer
+    idempotency_key: Optional[str] = None
+
+
+class StateBatchRequest(BaseModel):
+    session_ids: List[str]
+    fields: Optional[List[str]] = None
+    last_messages: int = 0
+    # session id -> version the caller already has, unchanged sessions are listed without their fields
+    versions: Dict[str, str] = {}
+
+
+def new_messages(event: dict) -> list:
+    """Messages added by the nodes in an "updates" stream event."""
+    messages = []
+    for update in event.values():
+        # a node returning several commands reports a list of updates
+        for node_update in update if isinstance(update, list) else [update]:
+            if node_update:
+                messages.extend(message for message in node_update.get("messages", [])
+                                if not isinstance(message, RemoveMessage))
+    return messages
+
+
+def sse_timing_comment(turn: TurnTimings) -> str:
+    """Where the turn spent its time, as an SSE comment (ignored by EventSource clients)."""
+    return f": server-timing {turn.server_timing()}\n\n"
+
+
+def sse_response(stream) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "*"
+        }
+    )
+
+
+def sse_event(event_type: str, data: dict) -> str:
+    """Format a named SSE event, the type is repeated in the payload for `onmessage` clients."""
+    return f"event: {event_type}\ndata: {json.dumps({'type': event_type, **data})}\n\n"
+
+
+async def token_events(graph_input: dict, config: dict) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    One turn with the model output forwarded as it arrives, as (event type,
+    payload) pairs: `text_delta`, `tool_call_start`, `tool_call_end`,
+    `cart_update` (orderId and finished only when they changed) and `error`
+    (no model answered in time). Shared by the SSE token stream and the
+    WebSocket sessions.
+    """
+    started_tool_calls = {}
+    bind_session(config["configurable"]["thread_id"], graph_input["subdomain"])
+    turn = start_turn(graph_input["subdomain"])
+    start_deadline()
+    trace = trace_recorder.start(config["configurable"]["thread_id"], graph_input)
+
+    chatbot_agent = await get_chatbot_agent()
+    events = chatbot_agent.astream(
+        graph_input, config, stream_mode=["messages", "updates"])
+
+    async for mode, chunk in events:
+        if mode == "messages":
+            message, metadata = chunk
+            if metadata.get("langgraph_node") != "chatbot" or not isinstance(message, AIMessage):
+                continue
+
+            if message.content:
+                yield "text_delta", {"content": message.content}
+
+            if isinstance(message, AIMessageChunk):
+                for tool_call_chunk in message.tool_call_chunks:
+                    # only the first chunk of a tool call carries its name
+                    if tool_call_chunk.get("name"):
+                        started_tool_calls[tool_call_chunk["id"]] = tool_call_chunk["name"]
+                        yield "tool_call_start", {"id": tool_call_chunk["id"], "name": tool_call_chunk["name"]}
+            else:
+                # a whole reply that was not streamed: a hedged call's answer, or one written by the node
+                for tool_call in message.tool_calls:
+                    started_tool_calls[tool_call["id"]] = tool_call["name"]
+                    yield "tool_call_start", {"id": tool_call["id"], "name": tool_call["name"]}
+                if message.response_metadata.get("error"):
+                    yield "error", message.response_metadata["error"]
+
+        elif mode == "updates":
+            for node, update in chunk.items():
+                if node not in ("tools", "router") or not update:
+                    continue
+                # a tool node returning several commands reports a list of updates
+                for node_update in update if isinstance(update, list) else [update]:
+                    for message in node_update.get("messages", []):
+                        if isinstance(message, AIMessage):
+                            # answered by the router without the model, the whole reply is one delta
+                            yield "text_delta", {"content": message.content}
+                        elif isinstance(message, ToolMessage):
+                            tool_call_end = {
+                                "id": message.tool_call_id,
+                                "name": message.name or started_tool_calls.get(message.tool_call_id),
+                                "status": message.status,
+                            }
+                            if message.artifact is not None:
+                                # structured result for the UI (get_cart / confirm_order), the model saw the text
+                                tool_call_end["result"] = message.artifact
+                            yield "tool_call_end", tool_call_end
+                    if node_update.get("cart") is not None:
+                        cart_update = {
+                            "cart": node_update["cart"].model_dump(),
+                            "totals": cart_totals(node_update["cart"], graph_input["subdomain"]).to_dict(),
+                        }
+                        # only what the node changed: most cart edits leave the order fields as they are
+                        for key in ("orderId", "finished"):
+                            if key in node_update:
+                                cart_update[key] = node_update[key]
+                        yield "cart_update", cart_update
+
+    finish_turn(turn)
+    await trace_recorder.finish(trace, turn.nodes)
+
+
+async def generate_token_sse(graph_input: dict, config: dict):
+    """
+    Token streaming: model chunks are forwarded as they arrive, as the named
+    events of `token_events`, followed by the usual `[DONE]` terminator.
+    """
+    async for event_type, data in token_events(graph_input, config):
+        yield sse_event(event_type, data)
+
+    if app_config.TIMING_HEADERS:
+        yield sse_timing_comment(current_turn())
+    # Send end signal
+    yield "data: [DONE]\n\n"
 
 
 @router.get("/state")
-def get_current_state(session_id: str):
+async def get_current_state(session_id: str):
     try:
         config = {"configurable": {"thread_id": session_id}}
-        state = chatbot_agent.get_state(config)
+        state = await (await get_chatbot_agent()).aget_state(config)
         return state
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.get("/sessions/{session_id}")
+async def get_session_view(session_id: str, fields: Optional[str] = None,
+                           last_messages: int = Query(default=0, ge=0, le=100),
+                           if_none_match: Optional[str] = Header(default=None)):
+    """
+    Only the requested `fields` (comma separated: cart, totals, orderId, finished,
+    messages) of a session, with the last `last_messages` messages. The ETag
+    follows the latest checkpoint, an unchanged session answers 304.
+    """
+    try:
+        selected = parse_fields(fields.split(",") if fields else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    checkpointer = (await get_chatbot_agent()).checkpointer
+
+    if if_none_match:
+        # one index lookup, nothing is deserialized when the client is up to date
+        checkpoint_id = await checkpointer.alatest_checkpoint_id(session_id)
+        if checkpoint_id and view_etag(checkpoint_id, selected, last_messages) == if_none_match:
+            return Response(status_code=304, headers={"ETag": if_none_match})
+
+    found = await checkpointer.aread_channels(
+        session_id, channels_for(selected), last_messages if "messages" in selected else None)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Unknown session {session_id}")
+    checkpoint_id, values = found
+    return JSONResponse(project_state(checkpoint_id, values, selected), headers={
+        "ETag": view_etag(checkpoint_id, selected, last_messages),
+        "Cache-Control": "no-cache",
+    })
+
+
+@router.post("/sessions/batch")
+async def get_session_views(request: StateBatchRequest):
+    """The same projection for many sessions at once, for dashboards."""
+    if len(request.session_ids) > app_config.STATE_BATCH_MAX_SESSIONS:
+        raise HTTPException(status_code=400, detail=(
+            f"At most {app_config.STATE_BATCH_MAX_SESSIONS} sessions per request"))
+    if not 0 <= request.last_messages <= 100:
+        raise HTTPException(status_code=400, detail="last_messages must be between 0 and 100")
+    try:
+        selected = parse_fields(request.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    checkpointer = (await get_chatbot_agent()).checkpointer
+    channels = channels_for(selected)
+    last_messages = request.last_messages if "messages" in selected else None
+
+    async def read(session_id: str):
+        known = request.versions.get(session_id)
+        if known and known == await checkpointer.alatest_checkpoint_id(session_id):
+            return "unchanged", None
+        found = await checkpointer.aread_channels(session_id, channels, last_messages)
+        return ("missing", None) if found is None else ("changed", project_state(*found, selected))
+
+    session_ids = list(dict.fromkeys(request.session_ids))
+    result = {"sessions": {}, "unchanged": [], "missing": []}
+    for session_id, (status, view) in zip(session_ids, await asyncio.gather(*map(read, session_ids))):
+        if status == "changed":
+            result["sessions"][session_id] = view
+        else:
+            result[status].append(session_id)
+    return result
+
+
+@router.get("/checkpointer/stats")
+async def get_checkpointer_stats():
+    """Memory / disk usage of the conversation state store."""
+    return await (await get_chatbot_agent()).checkpointer.astats()
+
+
 @router.post("/orders")
-async def chat_order(request: ChatRequest):
+async def chat_order(request: ChatRequest, stream_tokens: bool = False,
+                     idempotency_key: Optional[str] = Header(default=None)):
     try:
         if not request.session_id:
             raise ValueError("session_id is missing.")
@@ -45,60 +266,106 @@ async def chat_order(request: ChatRequest):
         if not request.subdomain:
             raise ValueError("subdomain is required")
 
+        # token streaming is opt-in, via the request body or the query string
+        token_stream = request.stream_tokens or stream_tokens
+        idempotency_key = idempotency_key or request.idempotency_key
+        fingerprint = request_fingerprint(
+            request.user_message.strip(), request.restaurant_name, request.subdomain, token_stream)
+
+        if idempotency_key:
+            # a retry of a finished turn is answered from its recording, the graph does not run again
+            recorded = await replay_cache.get(request.session_id, idempotency_key, fingerprint)
+            if recorded is not None:
+                return sse_response(replay_cache.replay(recorded))
+
+        # turned away before streaming starts, so the client gets a status and Retry-After
+        admission.admit(request.subdomain)
+
         config = {"configurable": {"thread_id": request.session_id}}
 
-        def generate_sse():
-            events = chatbot_agent.stream(
-                {"messages": [
-                    {"role": "user", "content": request.user_message.strip()}],
-                 "restaurant_name": request.restaurant_name,
-                 "subdomain": request.subdomain,
-                 },
+        graph_input = {"messages": [
+            {"role": "user", "content": request.user_message.strip()}],
+            "restaurant_name": request.restaurant_name,
+            "subdomain": request.subdomain,
+        }
+
+        async def generate_sse():
+            bind_session(request.session_id, request.subdomain)
+            turn = start_turn(request.subdomain)
+            start_deadline()
+            trace = trace_recorder.start(request.session_id, graph_input)
+            chatbot_agent = await get_chatbot_agent()
+            # "updates" carries only what each node returned, not a copy of the whole state
+            events = chatbot_agent.astream(
+                graph_input,
                 config,
-                stream_mode="values",
+                stream_mode="updates",
             )
 
-            for event in events:
-                last_message = event['messages'][-1]
+            async for event in events:
+                for last_message in new_messages(event):
 
-                # Log everything for debugging
-                if type(last_message).__name__ == 'ToolMessage':
-                    if last_message.status == "error":
-                        print(last_message.content)
+                    # Log everything for debugging
+                    if type(last_message).__name__ == 'ToolMessage':
+                        if last_message.status == "error":
+                            logger.warning("Tool %s failed: %s", last_message.name, last_message.content)
+                        else:
+                            logger.debug("%s: %.30s...", type(last_message).__name__, last_message.content)
                     else:
-                        print(
-                            f"{type(last_message).__name__}: {last_message.content[:30]}...")
-                else:
-                    print(f"{type(last_message).__name__}: {last_message.content}")
-
-                if last_message.type == "ai":
-                    print(f"Tools called: ", last_message.tool_calls)
-
-                # Only yield AIMessage content to the client
-                if type(last_message).__name__ == 'AIMessage':
-                    response_data = {
-                        "type": "AIMessage",
-                        "content": last_message.content if hasattr(last_message, 'content') else "",
-                        "tool_calls": getattr(last_message, 'tool_calls', [])
-                    }
-
-                    # Only yield if there's actual content
-                    if response_data["content"].strip():
-                        yield f"data: {json.dumps(response_data)}\n\n"
+                        logger.debug("%s: %s", type(last_message).__name__, last_message.content)
+
+                    if last_message.type == "ai":
+                        logger.debug("Tools called: %s", last_message.tool_calls)
+
+                    # Only yield AIMessage content to the client
+                    if type(last_message).__name__ == 'AIMessage':
+                        response_data = {
+                            "type": "AIMessage",
+                            "content": last_message.content if hasattr(last_message, 'content') else "",
+                            "tool_calls": getattr(last_message, 'tool_calls', [])
+                        }
 
+                        # Only yield if there's actual content
+                        if response_data["content"].strip():
+                            yield f"data: {json.dumps(response_data)}\n\n"
+                        if last_message.response_metadata.get("error"):
+                            # no model answered, the reply above is the fallback
+                            yield sse_event("error", last_message.response_metadata["error"])
+
+            finish_turn(turn)
+            await trace_recorder.finish(trace, turn.nodes)
+            if app_config.TIMING_HEADERS:
+                yield sse_timing_comment(turn)
             # Send end signal
             yield "data: [DONE]\n\n"
 
-        return StreamingResponse(
-            generate_sse(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*"
-            }
-        )
+        # one turn per session at a time, concurrent turns would race on the same checkpoint
+        release = await session_locks.acquire(
+            request.session_id, app_config.SESSION_LOCK_WAIT_SECONDS)
+        try:
+            # the retry may have been waiting for its first attempt to finish
+            recorded = idempotency_key and await replay_cache.get(
+                request.session_id, idempotency_key, fingerprint)
+        except IdempotencyMismatch:
+            release()
+            raise
+        if recorded:
+            release()
+            return sse_response(replay_cache.replay(recorded))
+
+        stream = generate_token_sse(graph_input, config) if token_stream else generate_sse()
+        if idempotency_key:
+            stream = replay_cache.record(request.session_id, idempotency_key, fingerprint, stream)
+        # the session is released when the stream ends, however it ends
+        return sse_response(session_locks.hold(stream, release))
 
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status, detail=str(e), headers=e.headers)
+    except SessionBusy as e:
+        # the turn never ran, it does not count against the tenant's rate
+        admission.refund(request.subdomain)
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
+    except IdempotencyMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
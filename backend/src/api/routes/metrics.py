@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from agents.agent import built_chatbot_agent
+from services.menu_cache import menu_cache
+from services.metrics import checkpoint_store, menu_cache_tenants, metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of the chat, tool, model and cache metrics."""
+    # sizes owned by other components are read at scrape time
+    chatbot_agent = built_chatbot_agent()
+    if chatbot_agent is not None:
+        # still warming up otherwise, a scrape must not build the agent
+        stats = await chatbot_agent.checkpointer.astats()
+        backend = stats.pop("backend", "")
+        for field, value in stats.items():
+            if isinstance(value, (int, float)):
+                checkpoint_store.set(value, backend=backend, field=field)
+    menu_cache_tenants.set(menu_cache.stats()["tenants"])
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,3 +1,4 @@
+from typing import Dict, List, Optional
 from pydantic_settings import SettingsConfigDict, BaseSettings
 
 
@@ -5,6 +6,151 @@ class Config(BaseSettings):
     MENU_BACKEND_URL: str
     PORT: int
     GOOGLE_API_KEY: str
+
+    # chat model used when a tenant has no model of its own
+    DEFAULT_MODEL: str = "gemini-2.5-flash"
+    DEFAULT_MODEL_PROVIDER: str = "google_genai"
+    # per-tenant model override, subdomain -> "model" or "provider:model"
+    TENANT_MODELS: Dict[str, str] = {}
+
+    # pooled HTTP client used for calls to backend services
+    HTTP_TIMEOUT_SECONDS: float = 10
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 3
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30
+
+    # menu cache, all durations in seconds
+    MENU_CACHE_TTL_SECONDS: float = 60
+    # how long an expired menu may still be served while it is revalidated
+    MENU_CACHE_STALE_SECONDS: float = 600
+    MENU_FETCH_TIMEOUT_SECONDS: float = 5
+    MENU_REFRESH_INTERVAL_SECONDS: float = 30
+    # tenants read within this window are kept warm by the background refresher
+    MENU_HOT_TENANT_SECONDS: float = 900
+    # a new conversation's first model call gets the menu up front, as a get_menu result,
+    # if it is loaded within MENU_SEED_WAIT_SECONDS (the load starts when the turn arrives)
+    MENU_SEED_ENABLED: bool = True
+    MENU_SEED_WAIT_SECONDS: float = 0.5
+
+    # conversation state persistence: "sqlite" (shared by all workers) or "memory"
+    CHECKPOINTER_BACKEND: str = "sqlite"
+    CHECKPOINT_DB_PATH: str = "checkpoints.sqlite"
+    # checkpoints kept per conversation thread, older ones are deleted on write
+    CHECKPOINT_KEEP_LATEST: int = 3
+    # sessions are evicted after this much inactivity, finished ones sooner
+    SESSION_IDLE_TTL_SECONDS: float = 24 * 60 * 60
+    SESSION_FINISHED_TTL_SECONDS: float = 60 * 60
+    SESSION_SWEEP_INTERVAL_SECONDS: float = 5 * 60
+
+    # prompt token budget per LLM call, older turns are summarized once it is exceeded
+    CONTEXT_TOKEN_BUDGET: int = 6000
+    # per-tenant override, subdomain -> token budget
+    TENANT_CONTEXT_BUDGETS: Dict[str, int] = {}
+    # share of the budget kept as verbatim recent turns after summarizing
+    CONTEXT_KEEP_RATIO: float = 0.5
+
+    # tool calls that take longer get a fallback result instead of hanging the turn
+    TOOL_TIMEOUT_SECONDS: float = 10
+    # per-tool override, tool name -> timeout in seconds
+    TOOL_TIMEOUTS: Dict[str, float] = {}
+
+    # model calls: each attempt is cut off after MODEL_CALL_TIMEOUT_SECONDS and all of a turn's
+    # calls after MODEL_TURN_DEADLINE_SECONDS, the client then gets an SSE error event
+    MODEL_CALL_TIMEOUT_SECONDS: float = 30
+    MODEL_TURN_DEADLINE_SECONDS: float = 60
+    # models tried in order when the tenant's model fails or times out, "model" or "provider:model"
+    MODEL_FAILOVER: List[str] = []
+    # a second request is sent when a call is slower than the model's MODEL_HEDGE_QUANTILE latency
+    # (at least MODEL_HEDGE_MIN_DELAY_SECONDS, once MODEL_HEDGE_MIN_SAMPLES calls were seen)
+    MODEL_HEDGE_ENABLED: bool = False
+    MODEL_HEDGE_QUANTILE: float = 0.95
+    MODEL_HEDGE_MIN_DELAY_SECONDS: float = 1
+    MODEL_HEDGE_MIN_SAMPLES: int = 20
+    # share of the calls that may be hedged
+    MODEL_HEDGE_MAX_RATIO: float = 0.1
+    # consecutive failures that open a model's circuit, it is skipped until the reset time has passed
+    MODEL_CIRCUIT_FAILURES: int = 5
+    MODEL_CIRCUIT_RESET_SECONDS: float = 30
+
+    # admission control: model calls in flight across all tenants, the rest wait in a fair queue
+    LLM_MAX_CONCURRENCY: int = 32
+    LLM_QUEUE_MAX_SIZE: int = 256
+    LLM_QUEUE_MAX_PER_TENANT: int = 64
+    # a model call waiting longer than this is answered with a "busy" reply
+    LLM_QUEUE_MAX_WAIT_SECONDS: float = 15
+    # chat turns per tenant (token bucket), 0 disables the limit
+    TENANT_TURNS_PER_MINUTE: float = 600
+    TENANT_TURN_BURST: float = 60
+    # per-tenant override, subdomain -> turns per minute
+    TENANT_TURN_LIMITS: Dict[str, float] = {}
+
+    # a second turn of a session waits this long for the running one, then gets 409 (0: reject at once)
+    SESSION_LOCK_WAIT_SECONDS: float = 30
+    # with the sqlite checkpointer a running turn holds a lease shared by the workers, renewed
+    # every third of this; one left by a worker that died mid-turn expires after this long
+    SESSION_LEASE_SECONDS: float = 30
+    # finished turns kept for replay to retried requests carrying the same Idempotency-Key
+    IDEMPOTENCY_CACHE_SIZE: int = 2048
+    IDEMPOTENCY_TTL_SECONDS: float = 10 * 60
+    # larger turns are not recorded, their retries run again
+    IDEMPOTENCY_MAX_TURN_BYTES: int = 256 * 1024
+
+    # WebSocket chat sessions (/api/chats/ws): the server pings every WS_HEARTBEAT_SECONDS and closes
+    # connections it has heard nothing from (not even a pong) for WS_IDLE_TIMEOUT_SECONDS
+    WS_HEARTBEAT_SECONDS: float = 20
+    WS_IDLE_TIMEOUT_SECONDS: float = 60
+    # events buffered per connection, a turn waits while the buffer is full and the client
+    # is disconnected when it does not drain it within WS_SEND_TIMEOUT_SECONDS
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT_SECONDS: float = 10
+    # messages queued behind the running turn, further ones are answered with a busy error
+    WS_MAX_PENDING_MESSAGES: int = 4
+
+    # subdomains whose menus are fetched at start-up, before /ready reports the server ready
+    WARMUP_TENANTS: List[str] = []
+
+    # sessions per request of the batch state endpoint
+    STATE_BATCH_MAX_SESSIONS: int = 200
+
+    # cart totals: tax as a share of the subtotal (0.05 for 5%), per tenant overrides by subdomain
+    TAX_RATE: float = 0
+    TENANT_TAX_RATES: Dict[str, float] = {}
+    CURRENCY_SYMBOL: str = "₹"
+
+    # order submission: place_order queues the order locally, a background dispatcher sends it
+    # to the order backend in batches (without a URL orders are accepted locally)
+    ORDER_BACKEND_URL: Optional[str] = None
+    ORDER_QUEUE_DB_PATH: str = "orders.sqlite"
+    ORDER_BATCH_SIZE: int = 20
+    # how long the dispatcher waits for more orders before sending a batch
+    ORDER_BATCH_WAIT_SECONDS: float = 0.2
+    ORDER_SUBMIT_TIMEOUT_SECONDS: float = 10
+    ORDER_MAX_ATTEMPTS: int = 8
+    # retry delay doubles per attempt, up to the maximum
+    ORDER_RETRY_BACKOFF_SECONDS: float = 1
+    ORDER_RETRY_MAX_BACKOFF_SECONDS: float = 60
+    # orders being sent are hidden from the other workers' dispatchers this long
+    ORDER_LEASE_SECONDS: float = 60
+
+    # logging: records are queued and written by a background thread
+    LOG_LEVEL: str = "INFO"
+    # "text" or "json" (one object per line)
+    LOG_FORMAT: str = "text"
+    LOG_FILE: str = "app.log"
+    LOG_MAX_BYTES: int = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT: int = 5
+    # share of sessions whose DEBUG records are kept
+    LOG_DEBUG_SAMPLE_RATE: float = 0.1
+
+    # conversation traces for benchmarks/replay.py: completed turns are appended to TRACE_FILE
+    # (off when empty), for this share of sessions
+    TRACE_FILE: Optional[str] = None
+    TRACE_SAMPLE_RATE: float = 1.0
+
+    # add Server-Timing headers to responses, and a timing comment at the end of chat streams
+    TIMING_HEADERS: bool = False
+
     model_config = SettingsConfigDict(env_file=".env", case_sensitive=True)
 
 
@@ -1,32 +1,107 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes.chats import router as chat_router
+from api.routes.chat_ws import router as chat_ws_router
+from api.routes.metrics import router as metrics_router
 import logging
 from dotenv import load_dotenv
 import os
 from configs.config import config
+from agents.agent import build_chatbot_agent, built_chatbot_agent
+from services.menu_cache import menu_cache
+from services.http import close_http_client
+from services.log import setup_logging
+from services.metrics import ServerTimingMiddleware
+from services.orders import order_dispatcher
+from services.turns import turn_store
+from services.warmup import warm_up
 
 load_dotenv()
 
-app = FastAPI()
 
-print("MENU_BACKEND_URL", config.MENU_BACKEND_URL)
+def build_models():
+    # imported here, the model integrations are the slowest imports of the app
+    from agents.tools import tools
+    from services.model_registry import model_registry
+
+    # build the chat models and their tool bindings before serving the first turn
+    model_registry.warm_up(tools)
+
+
+async def warm_up_agent():
+    await warm_up.step("agent", lambda: asyncio.to_thread(build_chatbot_agent))
+    await warm_up.step("models", lambda: asyncio.to_thread(build_models))
+
+
+async def prefetch_menus():
+    async def fetch_all():
+        results = await asyncio.gather(
+            *(menu_cache.get_index(subdomain) for subdomain in config.WARMUP_TENANTS),
+            return_exceptions=True)
+        for subdomain, result in zip(config.WARMUP_TENANTS, results):
+            if isinstance(result, Exception):
+                logger.warning("Menu of %s not prefetched: %s", subdomain, result)
+
+    await warm_up.step("menus", fetch_all)
+
+
+async def sweep_sessions():
+    from agents.checkpointer import run_session_sweeper
+
+    await warm_up.wait()
+    # evicts idle and finished sessions from the checkpointer
+    await run_session_sweeper(
+        build_chatbot_agent().checkpointer,
+        interval=config.SESSION_SWEEP_INTERVAL_SECONDS,
+        idle_ttl=config.SESSION_IDLE_TTL_SECONDS,
+        finished_ttl=config.SESSION_FINISHED_TTL_SECONDS,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # keeps the menus of active tenants warm in the background
+    menu_cache.start()
+    # sends queued orders to the order backend, including ones left over from the last run
+    order_dispatcher.start()
+    # the server accepts connections right away, /ready answers 200 once the
+    # agent, the model clients and the configured tenants' menus are prepared
+    warm_up_task = asyncio.create_task(warm_up.run(warm_up_agent(), prefetch_menus()))
+    sweeper = asyncio.create_task(sweep_sessions())
+    yield
+    warm_up_task.cancel()
+    sweeper.cancel()
+    await menu_cache.stop()
+    await order_dispatcher.stop()
+    turn_store.close()
+    await close_http_client()
+    chatbot_agent = built_chatbot_agent()
+    if chatbot_agent is not None and hasattr(chatbot_agent.checkpointer, "close"):
+        chatbot_agent.checkpointer.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "*",
     "http://localhost:3000",
 ]
 
-# Basic logging configuration
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
+# Logging goes through a queue, console and file writes happen off the request path
+setup_logging(
+    level=config.LOG_LEVEL,
+    path=config.LOG_FILE,
+    max_bytes=config.LOG_MAX_BYTES,
+    backup_count=config.LOG_BACKUP_COUNT,
+    debug_sample_rate=config.LOG_DEBUG_SAMPLE_RATE,
+    fmt=config.LOG_FORMAT,
 )
+logger = logging.getLogger(__name__)
+logger.info("MENU_BACKEND_URL %s", config.MENU_BACKEND_URL)
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,8 +111,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if config.TIMING_HEADERS:
+    # only installed when asked for, it would otherwise sit in front of every stream for nothing
+    app.add_middleware(ServerTimingMiddleware)
+
 app.include_router(chat_router, prefix='/api/chats',
                    tags=['workflows'])
+app.include_router(chat_ws_router, prefix='/api/chats',
+                   tags=['workflows'])
+app.include_router(metrics_router, tags=['monitoring'])
 
 
 @app.get("/")
@@ -45,9 +127,16 @@ def read_root():
     return {"status": "Okay", "message": "Server is Running."}
 
 
+@app.get("/ready")
+def read_ready():
+    """Readiness, 503 until the start-up warm-up is done."""
+    return JSONResponse(warm_up.status(), status_code=200 if warm_up.ready else 503)
+
+
 def main():
-    print("Hello from chatbot server!")
-    uvicorn.run(app, host="0.0.0.0", port=config.PORT)
+    logger.info("Hello from chatbot server!")
+    # keep uvicorn's own loggers on the queued pipeline
+    uvicorn.run(app, host="0.0.0.0", port=config.PORT, log_config=None)
 
 
 if __name__ == "__main__":
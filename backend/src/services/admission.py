@@ -0,0 +1,240 @@
+# ----
+# This file contains the admission control shared by all tenants: per-tenant
+# token buckets for chat turns and a bounded pool of in-flight LLM calls, with
+# a queue that is served round-robin across tenants
+# ----
+
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from configs.config import config
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+admission_rejections = metrics.counter(
+    "admission_rejections_total", "Turns and model calls turned away, by reason", ["tenant", "reason"])
+admission_wait_seconds = metrics.histogram(
+    "admission_wait_seconds", "Time a model call waited for a slot in the LLM pool", ["tenant"])
+admission_queue_depth = metrics.gauge(
+    "admission_queue_depth", "Model calls waiting for a slot in the LLM pool", ["tenant"])
+admission_in_flight = metrics.gauge(
+    "admission_llm_in_flight", "Model calls holding a slot in the LLM pool")
+
+
+class AdmissionRejected(Exception):
+    """The request cannot be served now; `status` is the HTTP status to answer with."""
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(f"{reason}, retry after {retry_after:.0f}s")
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, else the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self):
+        """Return a token taken for a request that was not served after all."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class FairLimiter:
+    """
+    At most `limit` holders at a time. Waiters are queued per tenant and a freed
+    slot goes to the next tenant in turn, so one busy tenant cannot starve the rest.
+    """
+
+    def __init__(self, limit: int, max_queue: int, max_queue_per_tenant: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.in_flight = 0
+        # tenant -> waiters, in the order the tenants are served
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+        # moving average of how long a slot is held, to estimate Retry-After
+        self._hold_seconds = 1.0
+
+    def queued(self, tenant: Optional[str] = None) -> int:
+        if tenant is None:
+            return self._queued
+        return len(self._waiters.get(tenant, ()))
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {tenant: len(waiters) for tenant, waiters in self._waiters.items()}
+
+    def estimated_wait(self) -> float:
+        return (self._queued + 1) / self.limit * self._hold_seconds
+
+    def check_capacity(self, tenant: str):
+        """Raise straight away if a new waiter could not be queued."""
+        if self.in_flight < self.limit:
+            return
+        if self._queued >= self.max_queue:
+            raise AdmissionRejected(503, "llm_queue_full", self.estimated_wait())
+        if self.queued(tenant) >= self.max_queue_per_tenant:
+            raise AdmissionRejected(429, "tenant_queue_full", self.estimated_wait())
+
+    async def acquire(self, tenant: str, timeout: float):
+        if self.in_flight < self.limit and not self._queued:
+            self.in_flight += 1
+            return
+        self.check_capacity(tenant)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(tenant, deque()).append(waiter)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._give_back(tenant, waiter)
+            raise AdmissionRejected(503, "llm_queue_timeout", self.estimated_wait())
+        except asyncio.CancelledError:
+            self._give_back(tenant, waiter)
+            raise
+
+    def release(self, held_for: Optional[float] = None):
+        if held_for is not None:
+            self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held_for
+        while self._waiters:
+            tenant, waiters = next(iter(self._waiters.items()))
+            waiter = waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                # the tenant goes to the back of the line
+                self._waiters.move_to_end(tenant)
+            else:
+                del self._waiters[tenant]
+            if not waiter.done():
+                # the slot passes straight to the waiter, in_flight is unchanged
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _give_back(self, tenant: str, waiter: asyncio.Future):
+        """A waiter that gave up: pass its slot on if it was handed one, else leave the queue."""
+        if waiter.done() and not waiter.cancelled():
+            # the slot was handed over just as the wait ended
+            self.release()
+        else:
+            self._discard(tenant, waiter)
+
+    def _discard(self, tenant: str, waiter: asyncio.Future):
+        waiters = self._waiters.get(tenant)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued -= 1
+            if not waiters:
+                del self._waiters[tenant]
+
+
+class AdmissionController:
+    """
+    Turns are admitted against their tenant's token bucket (429 when empty) and
+    only while the LLM queue has room (503 when full). Model calls then hold a
+    slot of the shared pool for their duration.
+    """
+
+    def __init__(self, llm_concurrency: int, max_queue: int, max_queue_per_tenant: int,
+                 max_wait: float, turns_per_minute: float, burst: float,
+                 tenant_turns_per_minute: Optional[Dict[str, float]] = None):
+        self.pool = FairLimiter(llm_concurrency, max_queue, max_queue_per_tenant)
+        self.max_wait = max_wait
+        self.turns_per_minute = turns_per_minute
+        self.burst = burst
+        self.tenant_turns_per_minute = tenant_turns_per_minute or {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        metrics.add_collector(self._collect)
+
+    def _bucket(self, tenant: str) -> Optional[TokenBucket]:
+        bucket = self._buckets.get(tenant)
+        if bucket is None:
+            per_minute = self.tenant_turns_per_minute.get(tenant, self.turns_per_minute)
+            if per_minute <= 0:
+                # not rate limited
+                return None
+            bucket = self._buckets[tenant] = TokenBucket(per_minute / 60, max(1.0, self.burst))
+        return bucket
+
+    def admit(self, tenant: str):
+        """Admit a chat turn, or raise AdmissionRejected."""
+        try:
+            self.pool.check_capacity(tenant)
+            bucket = self._bucket(tenant)
+            wait = bucket.take() if bucket else 0.0
+            if wait:
+                raise AdmissionRejected(429, "rate_limited", wait)
+        except AdmissionRejected as e:
+            admission_rejections.inc(tenant=tenant, reason=e.reason)
+            logger.warning("Turn for %s rejected: %s", tenant, e)
+            raise
+
+    def refund(self, tenant: str):
+        """Give back the token of an admitted turn that did not run, e.g. because its session was busy."""
+        bucket = self._buckets.get(tenant)
+        if bucket:
+            bucket.give_back()
+
+    @asynccontextmanager
+    async def llm_slot(self, tenant: Optional[str]):
+        """Hold a slot of the LLM pool, waiting at most `max_wait` for one."""
+        tenant = tenant or ""
+        started = time.perf_counter()
+        try:
+            await self.pool.acquire(tenant, self.max_wait)
+        except AdmissionRejected as e:
+            admission_rejections.inc(tenant=tenant, reason=e.reason)
+            raise
+        acquired = time.perf_counter()
+        admission_wait_seconds.observe(acquired - started, tenant=tenant)
+        try:
+            yield
+        finally:
+            self.pool.release(time.perf_counter() - acquired)
+
+    def _collect(self):
+        depths = self.pool.queue_depths()
+        # tenants whose queue drained are reported as 0 rather than dropped
+        for tenant in self._buckets:
+            depths.setdefault(tenant, 0)
+        for tenant, depth in depths.items():
+            admission_queue_depth.set(depth, tenant=tenant)
+        admission_in_flight.set(self.pool.in_flight)
+
+
+admission = AdmissionController(
+    llm_concurrency=config.LLM_MAX_CONCURRENCY,
+    max_queue=config.LLM_QUEUE_MAX_SIZE,
+    max_queue_per_tenant=config.LLM_QUEUE_MAX_PER_TENANT,
+    max_wait=config.LLM_QUEUE_MAX_WAIT_SECONDS,
+    turns_per_minute=config.TENANT_TURNS_PER_MINUTE,
+    burst=config.TENANT_TURN_BURST,
+    tenant_turns_per_minute=config.TENANT_TURN_LIMITS,
+)
@@ -0,0 +1,106 @@
+# ----
+# This file contains the cart summary: totals with tax from the running sums the
+# cart keeps, the compact text the model reads (so it never does the arithmetic)
+# and the structured form sent to the UI
+# ----
+
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Optional
+
+from configs.config import config
+
+if TYPE_CHECKING:
+    # agents.state pulls in LangGraph, only needed once the agent is built
+    from agents.state import Cart, CartLine
+
+
+@dataclass(frozen=True)
+class CartTotals:
+    lines: int
+    quantity: int
+    subtotal: float
+    tax: float
+    total: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def tax_rate(subdomain: Optional[str]) -> float:
+    return config.TENANT_TAX_RATES.get(subdomain or "", config.TAX_RATE)
+
+
+def money(amount: float) -> str:
+    """₹640 or ₹39.5, never 6.4e+02."""
+    return f"{config.CURRENCY_SYMBOL}{amount:.2f}".rstrip("0").rstrip(".")
+
+
+def cart_totals(cart: Optional["Cart"], subdomain: Optional[str] = None) -> CartTotals:
+    if cart is None:
+        return CartTotals(lines=0, quantity=0, subtotal=0.0, tax=0.0, total=0.0)
+    subtotal_cents = cart.subtotal_cents
+    tax_cents = round(subtotal_cents * tax_rate(subdomain))
+    return CartTotals(
+        lines=len(cart.lines),
+        quantity=cart.total_quantity,
+        subtotal=subtotal_cents / 100,
+        tax=tax_cents / 100,
+        total=(subtotal_cents + tax_cents) / 100,
+    )
+
+
+def line_title(line: "CartLine") -> str:
+    return f"{line.title} ({line.variation.name})" if line.variation else line.title
+
+
+def render_totals(totals: CartTotals) -> str:
+    if not totals.tax:
+        return f"Total: {money(totals.total)}"
+    return f"Subtotal: {money(totals.subtotal)}, tax: {money(totals.tax)}, total: {money(totals.total)}"
+
+
+def render_cart(cart: Optional["Cart"], subdomain: Optional[str] = None, heading: str = "Cart",
+                empty: Optional[str] = None, item_ids: bool = True) -> str:
+    """
+    One line per cart line with its amount, then the totals:
+
+        Cart (3 items):
+        - 2 x Paneer Butter Masala @ ₹320 = ₹640 [item_id=...]
+        - 1 x Veg Biryani (Half) @ ₹150 = ₹150 [item_id=...]
+        Total: ₹790
+
+    The item ids are for the model, replies shown to the customer leave them out.
+    """
+    if cart is None or not cart.lines:
+        return empty or f"{heading}: empty"
+    totals = cart_totals(cart, subdomain)
+    lines = [f"{heading} ({totals.quantity} item{'s' if totals.quantity != 1 else ''}):"]
+    for line in cart.lines.values():
+        lines.append(f"- {line.quantity} x {line_title(line)} @ {money(line.base_price)}"
+                     f" = {money(line.amount_cents / 100)}" + (f" [item_id={line.item_id}]" if item_ids else ""))
+    lines.append(render_totals(totals))
+    return "\n".join(lines)
+
+
+def cart_hash(cart: Optional["Cart"]) -> str:
+    """Digest of the lines, quantities and prices: equal hashes mean the same order."""
+    lines = sorted((line.key, line.quantity, line.base_price) for line in (cart.lines.values() if cart else []))
+    return hashlib.blake2b(json.dumps(lines).encode(), digest_size=16).hexdigest()
+
+
+def cart_payload(cart: Optional["Cart"], subdomain: Optional[str] = None) -> dict:
+    """The cart as the UI renders it: flat lines with their amounts, and the totals."""
+    lines = []
+    for line in (cart.lines.values() if cart else []):
+        lines.append({
+            "key": line.key,
+            "item_id": line.item_id,
+            "title": line.title,
+            "variation": line.variation.name if line.variation else None,
+            "quantity": line.quantity,
+            "unit_price": line.base_price,
+            "amount": line.amount_cents / 100,
+        })
+    return {"lines": lines, "totals": cart_totals(cart, subdomain).to_dict()}
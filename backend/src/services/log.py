@@ -0,0 +1,133 @@
+# ----
+# This file contains the logging pipeline: records are queued by the request
+# path and written (console + rotating file) by a background thread
+# ----
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import zlib
+from contextvars import ContextVar
+from typing import Optional
+
+# correlation ids of the chat turn being processed, added to every record
+_session_id: ContextVar[Optional[str]] = ContextVar("log_session_id", default=None)
+_tenant: ContextVar[Optional[str]] = ContextVar("log_tenant", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(session_id)s] %(message)s"
+
+# uvicorn installs its own (synchronous) handlers on these
+SERVER_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def bind_session(session_id: Optional[str], tenant: Optional[str] = None):
+    """Tag every record logged from the current context with the session and tenant."""
+    _session_id.set(session_id)
+    _tenant.set(tenant)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the correlation ids; runs on the emitting side, where the context is known."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.session_id = _session_id.get() or "-"
+        record.tenant = _tenant.get() or "-"
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """
+    Keeps a share of the DEBUG records. Sampling is per session, so a sampled
+    session keeps all of its debug records and can be followed end to end.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        session_id = getattr(record, "session_id", "-")
+        if session_id == "-":
+            return random.random() < self.rate
+        return zlib.crc32(session_id.encode()) % 10_000 < self.rate * 10_000
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "session_id": getattr(record, "session_id", "-"),
+            "tenant": getattr(record, "tenant", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # already rendered by the queue handler
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the message is rendered here so its arguments are not shared with the writer
+        # thread, the (slow) formatting and I/O happen in the listener
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = "INFO", path: Optional[str] = "app.log", max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5, debug_sample_rate: float = 1.0, fmt: str = "text"):
+    """Route all logging through a queue drained by a background writer thread."""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if path:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(DebugSampler(debug_sample_rate))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    for name in SERVER_LOGGERS:
+        server_logger = logging.getLogger(name)
+        server_logger.handlers = []
+        server_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # records still queued at exit are written before the process ends
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush the queue and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
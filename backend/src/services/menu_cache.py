@@ -0,0 +1,252 @@
+# ----
+# This file contains the per-tenant menu cache used by the menu tools
+# ----
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+import httpx
+
+from configs.config import config
+from services.http import get_http_client
+from services.menu_index import MenuIndex
+from services.metrics import menu_cache_requests
+
+logger = logging.getLogger(__name__)
+
+
+class MenuFetchError(Exception):
+    """Raised when the menu backend cannot provide a menu and nothing is cached."""
+
+
+def _build_menu(content: bytes, version: str):
+    menu = json.loads(content)
+    return menu, MenuIndex(menu, version=version)
+
+
+@dataclass
+class MenuEntry:
+    menu: dict
+    # compact projection and search index, built once per menu version
+    index: MenuIndex
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # monotonic timestamps of the last successful (re)validation and the last read
+    validated_at: float = field(default_factory=time.monotonic)
+    last_access: float = field(default_factory=time.monotonic)
+
+
+class MenuCache:
+    """
+    Menu cache keyed by subdomain.
+
+    - entries younger than `ttl` are served directly
+    - entries older than `ttl` but younger than `ttl + stale_ttl` are served stale
+      while a revalidation runs in the background
+    - older entries (or misses) block on a fetch; concurrent misses for the same
+      tenant share one in-flight request
+    - revalidation is conditional (ETag / Last-Modified), so an unchanged menu costs a 304
+    - a background refresher keeps recently used tenants warm
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float, fetch_timeout: float,
+                 refresh_interval: float, hot_window: float):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.fetch_timeout = fetch_timeout
+        self.refresh_interval = refresh_interval
+        self.hot_window = hot_window
+
+        self._entries: Dict[str, MenuEntry] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._refresher: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    async def get(self, subdomain: str) -> dict:
+        """Return the raw menu for the tenant, fetching it only when needed."""
+        return (await self._get_entry(subdomain)).menu
+
+    async def get_index(self, subdomain: str) -> MenuIndex:
+        """Return the compact projection and search index of the tenant's menu."""
+        return (await self._get_entry(subdomain)).index
+
+    async def _get_entry(self, subdomain: str) -> MenuEntry:
+        now = time.monotonic()
+        entry = self._entries.get(subdomain)
+
+        if entry is not None:
+            entry.last_access = now
+            age = now - entry.validated_at
+            if age < self.ttl:
+                self.hits += 1
+                menu_cache_requests.inc(tenant=subdomain, result="hit")
+                return entry
+            if age < self.ttl + self.stale_ttl:
+                # serve stale and revalidate off the critical path
+                self.stale_hits += 1
+                menu_cache_requests.inc(tenant=subdomain, result="stale")
+                self._run_in_background(self._fetch(subdomain))
+                return entry
+
+        self.misses += 1
+        menu_cache_requests.inc(tenant=subdomain, result="miss")
+        try:
+            return await self._fetch(subdomain)
+        except MenuFetchError:
+            if entry is not None:
+                logger.warning(
+                    "Serving expired menu for %s, backend unavailable", subdomain)
+                return entry
+            raise
+
+    def peek(self, subdomain: str) -> Optional[MenuEntry]:
+        """The cached entry, without counting a lookup or marking the tenant as used."""
+        return self._entries.get(subdomain)
+
+    def touch(self, subdomain: str):
+        """Mark the tenant as in use, so the refresher keeps its menu warm."""
+        entry = self._entries.get(subdomain)
+        if entry is not None:
+            entry.last_access = time.monotonic()
+
+    def prefetch(self, subdomain: str):
+        """Start loading the tenant's menu when a lookup would block on it, without waiting for it."""
+        entry = self._entries.get(subdomain)
+        if entry is None or time.monotonic() - entry.validated_at >= self.ttl + self.stale_ttl:
+            # the lookup that follows joins the in-flight fetch
+            self._run_in_background(self._fetch(subdomain))
+
+    def invalidate(self, subdomain: str):
+        self._entries.pop(subdomain, None)
+
+    def _run_in_background(self, coro):
+        task = asyncio.create_task(coro)
+        # keep a reference until done, and swallow errors nobody is waiting for
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _fetch(self, subdomain: str) -> MenuEntry:
+        """Single-flight fetch: concurrent callers for a tenant share the same request."""
+        future = self._inflight.get(subdomain)
+        if future is None:
+            future = asyncio.ensure_future(self._revalidate(subdomain))
+            self._inflight[subdomain] = future
+            future.add_done_callback(
+                lambda _: self._inflight.pop(subdomain, None))
+
+        # shielded so a cancelled caller does not cancel the fetch for everyone else
+        return await asyncio.shield(future)
+
+    async def _revalidate(self, subdomain: str) -> MenuEntry:
+        entry = self._entries.get(subdomain)
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        try:
+            response = await get_http_client().get(
+                config.MENU_BACKEND_URL, params={"subdomain": subdomain},
+                headers=headers, timeout=self.fetch_timeout)
+        except httpx.HTTPError as e:
+            raise MenuFetchError(
+                f"Error fetching the menu for {subdomain}: {e}") from e
+
+        if response.status_code == 304 and entry is not None:
+            entry.validated_at = time.monotonic()
+            return entry
+
+        if response.status_code != 200:
+            raise MenuFetchError(
+                f"Error fetching the menu for {subdomain}: HTTP {response.status_code}")
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        version = etag or last_modified or hashlib.sha1(
+            response.content).hexdigest()
+        try:
+            # parsing and indexing a large menu is CPU work, keep it off the event loop
+            menu, index = await asyncio.to_thread(_build_menu, response.content, version)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # a malformed payload is a failed fetch, the cached menu (if any) is still served
+            raise MenuFetchError(f"Malformed menu for {subdomain}: {e!r}") from e
+
+        new_entry = MenuEntry(
+            menu=menu,
+            index=index,
+            etag=etag,
+            last_modified=last_modified,
+            last_access=entry.last_access if entry else time.monotonic(),
+        )
+        self._entries[subdomain] = new_entry
+        return new_entry
+
+    # background refresher
+
+    def start(self):
+        """Start the background refresher, must be called from the running event loop."""
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        tasks = list(self._background)
+        if self._refresher is not None:
+            tasks.append(self._refresher)
+            self._refresher = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh_hot_tenants()
+
+    async def refresh_hot_tenants(self):
+        """Revalidate tenants used recently before their entry expires; drop idle ones."""
+        now = time.monotonic()
+        due = []
+        for subdomain, entry in list(self._entries.items()):
+            if now - entry.last_access > self.hot_window:
+                if now - entry.validated_at > self.ttl + self.stale_ttl:
+                    self.invalidate(subdomain)
+                continue
+            # refresh when the entry would expire before the next pass
+            if now - entry.validated_at + self.refresh_interval >= self.ttl:
+                due.append(subdomain)
+
+        results = await asyncio.gather(
+            *(self._fetch(subdomain) for subdomain in due), return_exceptions=True)
+        for result in results:
+            if isinstance(result, MenuFetchError):
+                logger.warning("Menu refresh failed: %s", result)
+
+    def stats(self) -> dict:
+        return {
+            "tenants": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+
+menu_cache = MenuCache(
+    ttl=config.MENU_CACHE_TTL_SECONDS,
+    stale_ttl=config.MENU_CACHE_STALE_SECONDS,
+    fetch_timeout=config.MENU_FETCH_TIMEOUT_SECONDS,
+    refresh_interval=config.MENU_REFRESH_INTERVAL_SECONDS,
+    hot_window=config.MENU_HOT_TENANT_SECONDS,
+)
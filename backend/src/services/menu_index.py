@@ -0,0 +1,202 @@
+# ----
+# This file contains the compact, searchable projection of a tenant's menu
+# ----
+
+import difflib
+import json
+import re
+import unicodedata
+from typing import Dict, List, Optional, Set
+
+# the menu backend lists these collections as categories, but every item in
+# them also belongs to a regular category, so they become tags instead
+PSEUDO_CATEGORIES = {
+    "todaysSpecial": "todays_special",
+    "bestSeller": "bestseller",
+    "recommended": "recommended",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lowercase, strip accents and punctuation so titles and queries compare equal."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+
+def compact_item(item: dict) -> dict:
+    """Only the fields the LLM needs to talk about and order an item."""
+    compact = {"id": item["id"], "title": item["title"]}
+    variations = item.get("variations") or []
+    if variations:
+        compact["variations"] = [
+            {"id": v["id"], "name": v["name"], "price": v["price"]} for v in variations]
+    else:
+        compact["price"] = item.get("basePrice")
+    if not (item.get("availability") or {}).get("isAvailable", True):
+        compact["available"] = False
+    return compact
+
+
+class MenuIndex:
+    """
+    Built once per menu version: holds the compact LLM-facing projection of the
+    menu and an in-memory index (normalized titles, tokens, categories) for search.
+    """
+
+    def __init__(self, menu: dict, version: Optional[str] = None):
+        self.version = version
+        # item id -> raw item, compact item and the item's category title
+        self.raw_items: Dict[str, dict] = {}
+        self.items: Dict[str, dict] = {}
+        self.item_category: Dict[str, str] = {}
+        # normalized category title -> item ids (pseudo categories included)
+        self.categories: Dict[str, List[str]] = {}
+        self.category_titles: Dict[str, str] = {}
+
+        self._titles: Dict[str, str] = {}
+        self._tokens: Dict[str, Set[str]] = {}
+
+        tags: Dict[str, List[str]] = {}
+        for group in menu.get("items", []):
+            category = group["category"]
+            category_key = normalize(category["title"])
+            self.category_titles[category_key] = category["title"]
+            ids = self.categories.setdefault(category_key, [])
+            tag = PSEUDO_CATEGORIES.get(category["id"])
+
+            for item in group.get("items", []):
+                item_id = item["id"]
+                ids.append(item_id)
+                if tag:
+                    tags.setdefault(item_id, []).append(tag)
+                else:
+                    self.item_category[item_id] = category["title"]
+                if item_id not in self.raw_items:
+                    self.raw_items[item_id] = item
+                    self.items[item_id] = compact_item(item)
+                    self._index_title(item_id, item["title"])
+
+        for item_id in self.items:
+            # items that only show up in a pseudo category keep it as their category
+            self.item_category.setdefault(item_id, next(
+                title for key, title in self.category_titles.items() if item_id in self.categories[key]))
+            if item_id in tags:
+                self.items[item_id]["tags"] = tags[item_id]
+
+        self.compact = self._project()
+        self.compact_json = json.dumps(
+            self.compact, separators=(",", ":"), ensure_ascii=False)
+
+    def _index_title(self, item_id: str, title: str):
+        normalized = normalize(title)
+        self._titles[normalized] = item_id
+        for token in normalized.split():
+            self._tokens.setdefault(token, set()).add(item_id)
+
+    def _project(self) -> Dict[str, List[dict]]:
+        """Items grouped by their (regular) category, each item listed once."""
+        projection: Dict[str, List[dict]] = {}
+        for item_id, item in self.items.items():
+            projection.setdefault(
+                self.item_category[item_id], []).append(item)
+        return projection
+
+    def resolve_category(self, category: Optional[str]) -> Optional[str]:
+        """Match a free-form category name to an indexed category key."""
+        key = normalize(category)
+        if not key:
+            return None
+        if key in self.categories:
+            return key
+        for candidate in self.categories:
+            if key in candidate or candidate in key:
+                return candidate
+        close = difflib.get_close_matches(
+            key, list(self.categories), n=1, cutoff=0.6)
+        return close[0] if close else None
+
+    def _expand_token(self, token: str) -> Set[str]:
+        """Ids of items whose title has this token, a token it prefixes, or a close spelling."""
+        if token in self._tokens:
+            return set(self._tokens[token])
+        ids: Set[str] = set()
+        if len(token) >= 3:
+            for candidate, candidate_ids in self._tokens.items():
+                if candidate.startswith(token):
+                    ids |= candidate_ids
+        for candidate in difflib.get_close_matches(token, list(self._tokens), n=3, cutoff=0.75):
+            ids |= self._tokens[candidate]
+        return ids
+
+    def search(self, query: Optional[str] = None, category: Optional[str] = None,
+               limit: int = 10) -> List[dict]:
+        """Items matching the query (exact, token, prefix or fuzzy), optionally within a category."""
+        candidates = list(self.items)
+        if category:
+            category_key = self.resolve_category(category)
+            if category_key is None:
+                return []
+            candidates = self.categories[category_key]
+
+        normalized = normalize(query)
+        if not normalized:
+            return [self.describe(item_id) for item_id in dict.fromkeys(candidates)][:limit]
+
+        allowed = set(candidates)
+        tokens = normalized.split()
+        scores: Dict[str, float] = {}
+
+        exact = self._titles.get(normalized)
+        if exact in allowed:
+            scores[exact] = 2.0
+
+        for token in tokens:
+            for item_id in self._expand_token(token) & allowed:
+                scores[item_id] = scores.get(item_id, 0) + 1 / len(tokens)
+
+        for item_id in scores:
+            title = normalize(self.items[item_id]["title"])
+            scores[item_id] += difflib.SequenceMatcher(
+                None, normalized, title).ratio() / 2
+
+        if not scores and not category:
+            # "tea" or "desserts" name a category rather than an item
+            category_key = self.resolve_category(query)
+            if category_key is not None:
+                return self.search(None, category_key, limit)
+
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [self.describe(item_id) for item_id in ranked[:limit]]
+
+    def match_title(self, query: Optional[str], cutoff: float = 0.85) -> Optional[str]:
+        """Id of the one item the query unambiguously names, or None."""
+        normalized = normalize(query)
+        if not normalized:
+            return None
+        if normalized in self._titles:
+            return self._titles[normalized]
+        close = difflib.get_close_matches(
+            normalized, list(self._titles), n=2, cutoff=cutoff)
+        if len(close) != 1:
+            return None
+        return self._titles[close[0]]
+
+    def tagged(self, tag: str) -> List[dict]:
+        """Compact items carrying a pseudo category tag, e.g. "todays_special"."""
+        return [item for item in self.items.values() if tag in item.get("tags", [])]
+
+    def describe(self, item_id: str) -> dict:
+        """Compact item plus the details only worth sending for a handful of matches."""
+        raw = self.raw_items[item_id]
+        detail = dict(self.items[item_id])
+        detail["category"] = self.item_category[item_id]
+        if raw.get("diet"):
+            detail["diet"] = raw["diet"]
+        if raw.get("description"):
+            detail["description"] = raw["description"]
+        return detail
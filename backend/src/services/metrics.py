@@ -0,0 +1,312 @@
+# ----
+# This file contains the in-process metrics (Prometheus text format) and the
+# per-turn timings collected while a chat turn runs
+# ----
+
+import asyncio
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from services.traces import trace_llm_call
+
+# seconds, from a cached tool call to a slow LLM turn
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    type_ = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_}"]
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type_ = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts incl. +Inf, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    labels = _format_labels(self.labels, key, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total[0])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        # called before every scrape, to refresh gauges read from other components
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# chat turns
+turn_seconds = metrics.histogram(
+    "chat_turn_seconds", "Wall time of a chat turn", ["tenant"])
+turn_tool_calls = metrics.histogram(
+    "chat_turn_tool_calls", "Tool calls made in a chat turn", ["tenant"], COUNT_BUCKETS)
+turn_llm_calls = metrics.histogram(
+    "chat_turn_llm_calls", "LLM calls made in a chat turn", ["tenant"], COUNT_BUCKETS)
+
+# graph nodes and tools
+node_seconds = metrics.histogram(
+    "chat_node_seconds", "Wall time of a graph node", ["node", "tenant"])
+tool_seconds = metrics.histogram(
+    "chat_tool_seconds", "Wall time of a tool call", ["tool", "tenant", "status"])
+
+# model calls
+llm_seconds = metrics.histogram(
+    "chat_llm_seconds", "Wall time of a model call", ["model", "tenant", "kind"])
+llm_prompt_tokens = metrics.histogram(
+    "chat_llm_prompt_tokens", "Prompt tokens of a model call", ["model", "tenant", "kind"], TOKEN_BUCKETS)
+llm_completion_tokens = metrics.counter(
+    "chat_llm_completion_tokens_total", "Completion tokens generated", ["model", "tenant", "kind"])
+llm_errors = metrics.counter(
+    "chat_llm_errors_total", "Failed model calls", ["model", "tenant", "kind"])
+
+# intent router
+router_turns = metrics.counter(
+    "chat_router_turns_total", "Turns seen by the intent router, by intent (llm when not answered)",
+    ["tenant", "intent"])
+
+# menu cache
+menu_cache_requests = metrics.counter(
+    "menu_cache_requests_total", "Menu cache lookups by result (hit, stale, miss)", ["tenant", "result"])
+menu_cache_tenants = metrics.gauge(
+    "menu_cache_tenants", "Tenants with a cached menu")
+
+# conversation state store, refreshed on every scrape
+checkpoint_store = metrics.gauge(
+    "checkpoint_store", "Checkpointer size by field (threads, checkpoints, bytes...)", ["backend", "field"])
+
+
+@dataclass
+class TurnTimings:
+    """What one chat turn spent its time on, filled in by the nodes as they run."""
+    tenant: str
+    started: float = field(default_factory=time.perf_counter)
+    nodes: Dict[str, float] = field(default_factory=dict)
+    llm_seconds: float = 0.0
+    llm_calls: int = 0
+    tool_seconds: float = 0.0
+    tool_calls: int = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing style summary, durations in milliseconds."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.nodes.items()]
+        parts.append(f"llm;dur={self.llm_seconds * 1000:.1f}")
+        parts.append(f"total;dur={self.elapsed * 1000:.1f}")
+        return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware adding a Server-Timing header with the time to the response
+    start. It only wraps `send`, so streamed responses pass through unbuffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                # for streamed responses this is the time to the first byte, the stream reports the rest
+                timing = f"app;dur={(time.perf_counter() - started) * 1000:.1f}"
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+# the turn being processed; graph nodes run in tasks that inherit it from the request
+_current_turn: ContextVar[Optional[TurnTimings]] = ContextVar("current_turn", default=None)
+
+
+def start_turn(tenant: str) -> TurnTimings:
+    turn = TurnTimings(tenant=tenant)
+    _current_turn.set(turn)
+    return turn
+
+
+def current_turn() -> Optional[TurnTimings]:
+    return _current_turn.get()
+
+
+def finish_turn(turn: TurnTimings):
+    turn_seconds.observe(turn.elapsed, tenant=turn.tenant)
+    turn_tool_calls.observe(turn.tool_calls, tenant=turn.tenant)
+    turn_llm_calls.observe(turn.llm_calls, tenant=turn.tenant)
+
+
+def record_llm_call(model: str, tenant: Optional[str], kind: str, seconds: float,
+                    usage: Optional[dict], failed: bool = False):
+    labels = {"model": model, "tenant": tenant or "", "kind": kind}
+    llm_seconds.observe(seconds, **labels)
+    if failed:
+        llm_errors.inc(**labels)
+    if usage:
+        llm_prompt_tokens.observe(usage.get("input_tokens", 0), **labels)
+        llm_completion_tokens.inc(usage.get("output_tokens", 0), **labels)
+    turn = current_turn()
+    if turn is not None:
+        turn.llm_calls += 1
+        turn.llm_seconds += seconds
+
+
+async def observe_llm_call(call: Awaitable, model: str, tenant: Optional[str], kind: str,
+                           prompt: Optional[Sequence] = None):
+    """Await a model call, recording its wall time and token usage (and the response, when the turn is traced)."""
+    started = time.perf_counter()
+    try:
+        message = await call
+    except asyncio.CancelledError:
+        # a lost hedge or a client that went away, not a failure of the model
+        record_llm_call(model, tenant, kind, time.perf_counter() - started, None)
+        raise
+    except BaseException:
+        record_llm_call(model, tenant, kind, time.perf_counter() - started, None, failed=True)
+        raise
+    seconds = time.perf_counter() - started
+    record_llm_call(model, tenant, kind, seconds, getattr(message, "usage_metadata", None))
+    trace_llm_call(kind, model, seconds, prompt, message)
+    return message
+
+
+def record_tool_call(tool: str, tenant: Optional[str], status: str, seconds: float):
+    tool_seconds.observe(seconds, tool=tool, tenant=tenant or "", status=status)
+    turn = current_turn()
+    if turn is not None:
+        turn.tool_calls += 1
+        turn.tool_seconds += seconds
+
+
+def instrument_node(name: str, node):
+    """Wrap an async graph node so its wall time is recorded per tenant."""
+
+    async def timed(state):
+        started = time.perf_counter()
+        try:
+            return await node(state)
+        finally:
+            elapsed = time.perf_counter() - started
+            node_seconds.observe(elapsed, node=name, tenant=state.get("subdomain") or "")
+            turn = current_turn()
+            if turn is not None:
+                turn.nodes[name] = turn.nodes.get(name, 0.0) + elapsed
+
+    timed.__name__ = getattr(node, "__name__", name)
+    return timed
@@ -0,0 +1,272 @@
+# ----
+# This file contains the resilient model-call layer: every call is bounded by a
+# per-call timeout and by the deadline of its turn, may be hedged with a second
+# request once it is slower than the model's usual tail latency, and fails over
+# along a chain of models, skipping those whose circuit breaker is open
+# ----
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import ensure_config, merge_configs
+
+from configs.config import config
+from services.metrics import metrics, observe_llm_call
+
+logger = logging.getLogger(__name__)
+
+model_call_outcomes = metrics.counter(
+    "model_call_attempts_total", "Model call attempts by outcome (ok, error, timeout, circuit_open)",
+    ["model", "kind", "outcome"])
+model_hedges = metrics.counter(
+    "model_hedges_total", "Hedged model calls by the request that answered (primary, hedge)", ["model", "winner"])
+model_failovers = metrics.counter(
+    "model_failovers_total", "Model calls handed to the next model of the chain", ["model", "kind"])
+model_circuit_open = metrics.gauge(
+    "model_circuit_open", "Whether the model's circuit breaker is open (1) or closed (0)", ["model"])
+
+# monotonic time by which the current turn's model calls must have answered
+_deadline: ContextVar[Optional[float]] = ContextVar("model_deadline", default=None)
+
+
+def start_deadline(seconds: Optional[float] = None) -> float:
+    """Bound the model calls of the turn run from this context on."""
+    deadline = time.monotonic() + (config.MODEL_TURN_DEADLINE_SECONDS if seconds is None else seconds)
+    _deadline.set(deadline)
+    return deadline
+
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class ModelCallFailed(Exception):
+    """No model of the chain answered; `code` is model_timeout or model_unavailable."""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def to_dict(self) -> dict:
+        return {"code": self.code, "message": self.message, "retryable": True}
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls; while open the model is
+    skipped, after `reset_seconds` one trial call is let through (half-open)
+    and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._trial or time.monotonic() - self.opened_at < self.reset_seconds:
+            return False
+        self._trial = True
+        return True
+
+    def record_success(self):
+        self.consecutive = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.consecutive += 1
+        if self._trial or self.consecutive >= self.failures:
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+    def abandon(self):
+        """The call was cancelled before it had an outcome, a later one may be the trial."""
+        self._trial = False
+
+
+class LatencyWindow:
+    """The latest `size` latencies of successful calls."""
+
+    def __init__(self, size: int = 200):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _FirstToken(BaseCallbackHandler):
+    """Notes when a streamed call has sent its first token to the client."""
+    run_inline = True
+
+    def __init__(self):
+        self.started = False
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.started = True
+
+
+class ModelCaller:
+    """
+    Calls the first model of the chain whose circuit is closed. A call that
+    errors or outlives its timeout moves on to the next model, unless part of
+    its reply was already streamed to the client. With hedging on, a call that
+    has not answered (nor started streaming) after the model's p95 latency gets
+    a second, unstreamed request and the first answer wins.
+    """
+
+    def __init__(self, call_timeout: float, hedge: bool, hedge_quantile: float, hedge_min_delay: float,
+                 hedge_min_samples: int, hedge_max_ratio: float, circuit_failures: int,
+                 circuit_reset_seconds: float):
+        self.call_timeout = call_timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.circuit_failures = circuit_failures
+        self.circuit_reset_seconds = circuit_reset_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # (model, kind) -> latencies, a tool call reply and a summary take different times
+        self._latencies: Dict[Tuple[str, str], LatencyWindow] = {}
+        self._calls = 0
+        self._hedges = 0
+        metrics.add_collector(self._collect)
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = CircuitBreaker(self.circuit_failures, self.circuit_reset_seconds)
+        return breaker
+
+    def hedge_delay(self, model: str, kind: str) -> Optional[float]:
+        """Seconds after which the call is hedged, None when it is not."""
+        window = self._latencies.get((model, kind))
+        if not self.hedge or window is None or len(window.samples) < self.hedge_min_samples:
+            return None
+        # hedges are extra load on a model that is already slow, keep them a small share of the calls
+        if self._hedges + 1 > self.hedge_max_ratio * self._calls:
+            return None
+        return max(self.hedge_min_delay, window.quantile(self.hedge_quantile))
+
+    async def ainvoke(self, chain: Sequence[Tuple[str, Runnable]], prompt: List, tenant: Optional[str],
+                      kind: str = "chat", hedge: bool = True) -> BaseMessage:
+        """Answer `prompt` with the first model of `chain` ((model name, runnable) pairs) that can."""
+        first_token = _FirstToken()
+        code = "model_unavailable"
+        for position, (model_name, model) in enumerate(chain):
+            left = remaining()
+            timeout = self.call_timeout if left is None else min(self.call_timeout, left)
+            if timeout <= 0:
+                code = "model_timeout"
+                break
+            breaker = self.breaker(model_name)
+            if not breaker.allow():
+                model_call_outcomes.inc(model=model_name, kind=kind, outcome="circuit_open")
+                continue
+            if position:
+                model_failovers.inc(model=model_name, kind=kind)
+
+            started = time.perf_counter()
+            try:
+                message = await asyncio.wait_for(
+                    self._attempt(model_name, model, prompt, tenant, kind, hedge, first_token), timeout)
+            except asyncio.CancelledError:
+                breaker.abandon()
+                raise
+            except asyncio.TimeoutError:
+                code = "model_timeout"
+                model_call_outcomes.inc(model=model_name, kind=kind, outcome="timeout")
+                logger.warning("%s call to %s timed out after %.1fs", kind, model_name, timeout)
+                breaker.record_failure()
+            except Exception:
+                code = "model_unavailable"
+                model_call_outcomes.inc(model=model_name, kind=kind, outcome="error")
+                logger.exception("%s call to %s failed", kind, model_name)
+                breaker.record_failure()
+            else:
+                model_call_outcomes.inc(model=model_name, kind=kind, outcome="ok")
+                breaker.record_success()
+                self._latencies.setdefault((model_name, kind), LatencyWindow()).add(time.perf_counter() - started)
+                return message
+            if first_token.started:
+                # the client already has part of this reply, another model would start over
+                break
+
+        if code == "model_timeout":
+            raise ModelCallFailed(code, "The model did not answer in time.")
+        raise ModelCallFailed(code, "No model is available to answer right now.")
+
+    async def _attempt(self, model_name: str, model: Runnable, prompt: List, tenant: Optional[str], kind: str,
+                       hedge: bool, first_token: _FirstToken) -> BaseMessage:
+        self._calls += 1
+        # the graph's callbacks stream the reply token by token, the hedge goes without them
+        run_config = ensure_config()
+        primary = asyncio.ensure_future(observe_llm_call(
+            model.ainvoke(prompt, merge_configs(run_config, {"callbacks": [first_token]})),
+            model=model_name, tenant=tenant, kind=kind, prompt=prompt))
+        delay = self.hedge_delay(model_name, kind) if hedge else None
+        if delay is None:
+            return await primary
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or first_token.started:
+                return await primary
+            self._hedges += 1
+            secondary = asyncio.ensure_future(observe_llm_call(
+                model.ainvoke(prompt, {**run_config, "callbacks": []}),
+                model=model_name, tenant=tenant, kind=kind, prompt=prompt))
+            pending.add(secondary)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif task is primary or not first_token.started:
+                        # once the primary streams, its reply is the one the client sees
+                        model_hedges.inc(model=model_name, winner="primary" if task is primary else "hedge")
+                        return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _collect(self):
+        for model, breaker in self._breakers.items():
+            model_circuit_open.set(1 if breaker.is_open else 0, model=model)
+
+
+model_caller = ModelCaller(
+    call_timeout=config.MODEL_CALL_TIMEOUT_SECONDS,
+    hedge=config.MODEL_HEDGE_ENABLED,
+    hedge_quantile=config.MODEL_HEDGE_QUANTILE,
+    hedge_min_delay=config.MODEL_HEDGE_MIN_DELAY_SECONDS,
+    hedge_min_samples=config.MODEL_HEDGE_MIN_SAMPLES,
+    hedge_max_ratio=config.MODEL_HEDGE_MAX_RATIO,
+    circuit_failures=config.MODEL_CIRCUIT_FAILURES,
+    circuit_reset_seconds=config.MODEL_CIRCUIT_RESET_SECONDS,
+)
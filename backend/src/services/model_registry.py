@@ -0,0 +1,102 @@
+# ----
+# This file contains the registry of chat models shared across all sessions
+# ----
+
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain.chat_models import init_chat_model
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
+from langchain_core.tools import BaseTool
+
+from configs.config import config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_model_spec(spec: str) -> Tuple[str, str]:
+    """Split a `provider:model` spec, falling back to the default provider."""
+    if ":" in spec:
+        provider, model_name = spec.split(":", 1)
+        return model_name, provider
+    return spec, config.DEFAULT_MODEL_PROVIDER
+
+
+class ModelRegistry:
+    """
+    Builds chat models and their tool bindings once per process and reuses them
+    across sessions, keyed by model name, provider and tool set.
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple[str, str], BaseChatModel] = {}
+        self._bound: Dict[Tuple[str, str, Tuple[str, ...]], Runnable] = {}
+        self._lock = threading.Lock()
+
+    def get_model(self, model_name: str, model_provider: str) -> BaseChatModel:
+        key = (model_name, model_provider)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    logger.info("Building chat model %s (%s)",
+                                model_name, model_provider)
+                    model = init_chat_model(
+                        model_name, model_provider=model_provider)
+                    self._models[key] = model
+        return model
+
+    def get_bound_model(self, tools: Sequence[BaseTool], model_name: Optional[str] = None,
+                        model_provider: Optional[str] = None) -> Runnable:
+        model_name = model_name or config.DEFAULT_MODEL
+        model_provider = model_provider or config.DEFAULT_MODEL_PROVIDER
+        key = (model_name, model_provider, tuple(t.name for t in tools))
+
+        bound = self._bound.get(key)
+        if bound is None:
+            model = self.get_model(model_name, model_provider)
+            with self._lock:
+                bound = self._bound.get(key)
+                if bound is None:
+                    # bind these tools to the LLM (serializes the tool schemas once)
+                    bound = model.bind_tools(list(tools))
+                    self._bound[key] = bound
+        return bound
+
+    def model_spec_for_tenant(self, subdomain: Optional[str]) -> Tuple[str, str]:
+        spec = config.TENANT_MODELS.get(subdomain or "")
+        if spec:
+            return parse_model_spec(spec)
+        return config.DEFAULT_MODEL, config.DEFAULT_MODEL_PROVIDER
+
+    def for_tenant(self, subdomain: Optional[str], tools: Sequence[BaseTool]) -> Runnable:
+        """Tool-bound model configured for the tenant (or the default one)."""
+        model_name, model_provider = self.model_spec_for_tenant(subdomain)
+        return self.get_bound_model(tools, model_name, model_provider)
+
+    def chain_for_tenant(self, subdomain: Optional[str], tools: Sequence[BaseTool]) -> List[Tuple[str, Runnable]]:
+        """The tenant's tool-bound model followed by the failover models, as (model name, model) pairs."""
+        specs = [self.model_spec_for_tenant(subdomain)]
+        specs.extend(parse_model_spec(spec) for spec in config.MODEL_FAILOVER)
+        # each model once, in order: a failing model is failed over from, not tried again
+        return [(model_name, self.get_bound_model(tools, model_name, model_provider))
+                for model_name, model_provider in dict.fromkeys(specs)]
+
+    def warm_up(self, tools: Sequence[BaseTool]):
+        """Build the default, tenant-configured and failover models ahead of the first turn."""
+        specs = {(config.DEFAULT_MODEL, config.DEFAULT_MODEL_PROVIDER)}
+        specs.update(parse_model_spec(spec)
+                     for spec in [*config.TENANT_MODELS.values(), *config.MODEL_FAILOVER])
+        for model_name, model_provider in specs:
+            self.get_bound_model(tools, model_name, model_provider)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._bound.clear()
+
+
+model_registry = ModelRegistry()
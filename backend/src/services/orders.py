@@ -0,0 +1,365 @@
+# ----
+# This file contains the order submission pipeline: place_order writes the order
+# to a local SQLite queue and answers with a provisional order id right away, a
+# background dispatcher sends queued orders to the order backend in batches,
+# with retries, and the order_status tool reads the outcome back
+# ----
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from configs.config import config
+from services.http import get_http_client
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+SUBMITTED = "submitted"
+FAILED = "failed"
+
+orders_enqueued = metrics.counter(
+    "orders_enqueued_total", "Orders written to the local submission queue", ["tenant"])
+orders_finished = metrics.counter(
+    "orders_finished_total", "Orders that left the queue, by outcome (submitted, failed)", ["tenant", "status"])
+order_submit_seconds = metrics.histogram(
+    "order_submit_seconds", "Wall time of a batch request to the order backend", ["status"])
+order_retries = metrics.counter(
+    "order_retries_total", "Order submissions scheduled for another attempt")
+order_queue_depth = metrics.gauge(
+    "order_queue_depth", "Orders waiting in the local submission queue")
+
+
+@dataclass
+class QueuedOrder:
+    order_id: str
+    idempotency_key: str
+    subdomain: str
+    session_id: Optional[str]
+    payload: dict
+    status: str
+    attempts: int
+    backend_order_id: Optional[str]
+    error: Optional[str]
+    created_at: float
+
+    def request(self) -> dict:
+        """One order of a batch request to the order backend."""
+        return {"idempotency_key": self.idempotency_key, "order_id": self.order_id,
+                "subdomain": self.subdomain, "session_id": self.session_id, **self.payload}
+
+
+def order_idempotency_key(session_id: Optional[str], request_id: str) -> str:
+    """
+    One key per place_order request (its tool call id, or the customer message
+    the router answered): a replayed call does not order twice, while the same
+    cart ordered again later is a new order.
+    """
+    return hashlib.sha256(f"{session_id}\x1f{request_id}".encode()).hexdigest()[:32]
+
+
+def new_order_id() -> str:
+    return "ZKS" + uuid.uuid4().hex[:8].upper()
+
+
+class OrderQueue:
+    """
+    Durable queue of orders in a SQLite file (WAL), shared by the workers of the
+    host. Orders survive a restart and are picked up by the next dispatcher.
+    """
+
+    _COLUMNS = ("order_id, idempotency_key, subdomain, session_id, payload, status, attempts, "
+                "backend_order_id, error, created_at")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # opened lazily so each worker process gets its own connection
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS orders (
+                    order_id TEXT PRIMARY KEY,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    subdomain TEXT NOT NULL,
+                    session_id TEXT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    backend_order_id TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS orders_due ON orders (status, next_attempt_at);
+            """)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _row(self, row) -> QueuedOrder:
+        (order_id, key, subdomain, session_id, payload, status, attempts,
+         backend_order_id, error, created_at) = row
+        return QueuedOrder(order_id, key, subdomain, session_id, json.loads(payload), status,
+                           attempts, backend_order_id, error, created_at)
+
+    def enqueue(self, subdomain: str, session_id: Optional[str], payload: dict,
+                idempotency_key: str) -> Tuple[QueuedOrder, bool]:
+        """
+        Queue the order and say whether it is new. An order already queued or sent
+        under the same key is returned as it is, a failed one is queued again.
+        """
+        now = time.time()
+        with self._lock:
+            changed = self.conn.execute(
+                "INSERT INTO orders (order_id, idempotency_key, subdomain, session_id, payload, "
+                "status, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (idempotency_key) DO UPDATE SET status = excluded.status, attempts = 0, "
+                "error = NULL, next_attempt_at = excluded.next_attempt_at, updated_at = excluded.updated_at "
+                "WHERE orders.status = ?",
+                (new_order_id(), idempotency_key, subdomain, session_id, json.dumps(payload),
+                 QUEUED, now, now, now, FAILED)).rowcount
+            row = self.conn.execute(
+                f"SELECT {self._COLUMNS} FROM orders WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+        return self._row(row), changed > 0
+
+    def get(self, order_id: str, subdomain: str, session_id: Optional[str]) -> Optional[QueuedOrder]:
+        """The order, only if it was placed by this session of this tenant."""
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {self._COLUMNS} FROM orders WHERE order_id = ? AND subdomain = ? AND session_id IS ?",
+                (order_id, subdomain, session_id)).fetchone()
+        return self._row(row) if row else None
+
+    def claim(self, limit: int, lease: float) -> List[QueuedOrder]:
+        """
+        Up to `limit` due orders, oldest first. They are leased for `lease` seconds
+        so the dispatcher of another worker does not send them at the same time.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT {self._COLUMNS} FROM orders WHERE status = ? AND next_attempt_at <= ? "
+                    "ORDER BY next_attempt_at LIMIT ?", (QUEUED, now, limit)).fetchall()
+                conn.executemany(
+                    "UPDATE orders SET next_attempt_at = ? WHERE order_id = ?",
+                    [(now + lease, row[0]) for row in rows])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [self._row(row) for row in rows]
+
+    def mark_submitted(self, order_id: str, backend_order_id: Optional[str]):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE orders SET status = ?, backend_order_id = ?, attempts = attempts + 1, error = NULL, "
+                "updated_at = ? WHERE order_id = ?", (SUBMITTED, backend_order_id, time.time(), order_id))
+
+    def mark_failed(self, order_id: str, error: str):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE orders SET status = ?, error = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE order_id = ?", (FAILED, error, time.time(), order_id))
+
+    def mark_retry(self, order_id: str, error: str, delay: float):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "UPDATE orders SET error = ?, attempts = attempts + 1, next_attempt_at = ?, updated_at = ? "
+                "WHERE order_id = ?", (error, now + delay, now, order_id))
+
+    def depth(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM orders WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def next_due(self) -> Optional[float]:
+        """Wall clock time at which the next queued order is due, None if the queue is empty."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT MIN(next_attempt_at) FROM orders WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+
+class OrderDispatcher:
+    """
+    Sends queued orders to the order backend, `batch_size` at a time. New orders
+    wake it up and it lingers `batch_wait` seconds so orders placed together share
+    a request. Failed requests are retried with exponential backoff and jitter,
+    an order the backend rejects (or that ran out of attempts) is marked failed.
+    Without a backend URL orders are accepted locally under their provisional id.
+    """
+
+    def __init__(self, queue: OrderQueue, url: Optional[str], batch_size: int, batch_wait: float,
+                 max_attempts: int, backoff: float, max_backoff: float, timeout: float, lease: float):
+        self.queue = queue
+        self.url = url
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.lease = lease
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[QueuedOrder], None]] = []
+
+    def add_listener(self, listener: Callable[[QueuedOrder], None]):
+        """Call `listener` with the updated order whenever an order is submitted, fails or is retried."""
+        self._listeners.append(listener)
+
+    def _notify(self, order: QueuedOrder):
+        for listener in self._listeners:
+            try:
+                listener(order)
+            except Exception:
+                logger.exception("Order status listener failed")
+
+    async def enqueue(self, subdomain: str, session_id: Optional[str], payload: dict,
+                      request_id: str) -> QueuedOrder:
+        """Queue an order and wake the dispatcher, returns without waiting for the backend."""
+        key = order_idempotency_key(session_id, request_id)
+        order, queued = await asyncio.to_thread(self.queue.enqueue, subdomain, session_id, payload, key)
+        if queued:
+            orders_enqueued.inc(tenant=subdomain)
+            if self._wake is not None:
+                self._wake.set()
+        return order
+
+    async def status(self, order_id: str, subdomain: str, session_id: Optional[str]) -> Optional[QueuedOrder]:
+        """An order of the asking session, None for anyone else's."""
+        return await asyncio.to_thread(self.queue.get, order_id, subdomain, session_id)
+
+    def start(self):
+        if self._task is None:
+            if not self.url:
+                logger.warning("ORDER_BACKEND_URL is not set, orders are accepted locally")
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # whatever is still queued is sent by the next dispatcher that starts
+        self.queue.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.flush()
+                next_due = await asyncio.to_thread(self.queue.next_due)
+            except Exception:
+                logger.exception("Order dispatch failed")
+                next_due = None
+            timeout = None if next_due is None else max(0.0, next_due - time.time())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self.batch_wait:
+                await asyncio.sleep(self.batch_wait)
+
+    async def flush(self):
+        """Send every due order, in batches."""
+        while True:
+            batch = await asyncio.to_thread(self.queue.claim, self.batch_size, self.lease)
+            if not batch:
+                return
+            await self._submit(batch)
+            order_queue_depth.set(await asyncio.to_thread(self.queue.depth))
+
+    async def _submit(self, batch: List[QueuedOrder]):
+        if not self.url:
+            for order in batch:
+                await self._finish(order, SUBMITTED, backend_order_id=order.order_id)
+            return
+
+        started = time.perf_counter()
+        try:
+            response = await get_http_client().post(
+                self.url, json={"orders": [order.request() for order in batch]}, timeout=self.timeout)
+            response.raise_for_status()
+            results: Dict[str, dict] = {
+                result["idempotency_key"]: result for result in response.json().get("results", [])}
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            order_submit_seconds.observe(time.perf_counter() - started, status="error")
+            logger.warning("Order backend request for %d orders failed: %r", len(batch), e)
+            for order in batch:
+                await self._retry(order, repr(e))
+            return
+        order_submit_seconds.observe(time.perf_counter() - started, status="ok")
+
+        for order in batch:
+            result = results.get(order.idempotency_key)
+            if result is None:
+                await self._retry(order, "missing from the backend response")
+            elif result.get("status") == "accepted":
+                await self._finish(order, SUBMITTED, backend_order_id=result.get("order_id"))
+            else:
+                await self._finish(order, FAILED, error=result.get("error") or "rejected by the order backend")
+
+    async def _finish(self, order: QueuedOrder, status: str, backend_order_id: Optional[str] = None,
+                      error: Optional[str] = None):
+        if status == SUBMITTED:
+            await asyncio.to_thread(self.queue.mark_submitted, order.order_id, backend_order_id)
+        else:
+            logger.warning("Order %s failed: %s", order.order_id, error)
+            await asyncio.to_thread(self.queue.mark_failed, order.order_id, error)
+        orders_finished.inc(tenant=order.subdomain, status=status)
+        self._notify(replace(order, status=status, backend_order_id=backend_order_id, error=error))
+
+    async def _retry(self, order: QueuedOrder, error: str):
+        attempts = order.attempts + 1
+        if attempts >= self.max_attempts:
+            await self._finish(order, FAILED, error=f"gave up after {attempts} attempts: {error}")
+            return
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+        order_retries.inc()
+        await asyncio.to_thread(self.queue.mark_retry, order.order_id, error, delay)
+        self._notify(replace(order, status=QUEUED, attempts=attempts, error=error))
+
+
+order_dispatcher = OrderDispatcher(
+    OrderQueue(config.ORDER_QUEUE_DB_PATH),
+    url=config.ORDER_BACKEND_URL,
+    batch_size=config.ORDER_BATCH_SIZE,
+    batch_wait=config.ORDER_BATCH_WAIT_SECONDS,
+    max_attempts=config.ORDER_MAX_ATTEMPTS,
+    backoff=config.ORDER_RETRY_BACKOFF_SECONDS,
+    max_backoff=config.ORDER_RETRY_MAX_BACKOFF_SECONDS,
+    timeout=config.ORDER_SUBMIT_TIMEOUT_SECONDS,
+    lease=config.ORDER_LEASE_SECONDS,
+)
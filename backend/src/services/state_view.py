@@ -0,0 +1,73 @@
+# ----
+# This file contains the lightweight projection of a session's state served to
+# polling clients: only the requested fields, versioned by the checkpoint id
+# ----
+
+import zlib
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, ToolMessage
+
+from services.cart_summary import cart_totals
+
+if TYPE_CHECKING:
+    # agents.state pulls in LangGraph, only needed once the agent is built
+    from agents.state import Cart
+
+# field -> state channels it is computed from
+FIELD_CHANNELS: Dict[str, Tuple[str, ...]] = {
+    "cart": ("cart",),
+    "totals": ("cart", "subdomain"),
+    "orderId": ("orderId",),
+    "finished": ("finished",),
+    "messages": ("messages",),
+}
+DEFAULT_FIELDS = ("cart", "totals", "orderId", "finished")
+
+
+def parse_fields(fields: Optional[Iterable[str]]) -> List[str]:
+    """Requested fields in a canonical order, raising ValueError on unknown ones."""
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    requested = {field.strip() for field in fields if field.strip()}
+    unknown = requested - FIELD_CHANNELS.keys()
+    if unknown:
+        raise ValueError(
+            f"Unknown fields {sorted(unknown)}, expected some of {list(FIELD_CHANNELS)}")
+    return [field for field in FIELD_CHANNELS if field in requested]
+
+
+def channels_for(fields: Sequence[str]) -> List[str]:
+    return sorted({channel for field in fields for channel in FIELD_CHANNELS[field]})
+
+
+def view_etag(checkpoint_id: str, fields: Sequence[str], last_messages: int) -> str:
+    """Changes with the state (the checkpoint id) and with the shape of the view."""
+    shape = zlib.crc32(f"{','.join(fields)}|{last_messages}".encode())
+    return f'"{checkpoint_id}.{shape:08x}"'
+
+
+def message_view(message: BaseMessage) -> dict:
+    view = {"type": message.type, "id": message.id}
+    if isinstance(message, ToolMessage):
+        # tool results carry raw menu payloads, the UI only needs to know what ran
+        view.update(name=message.name, status=message.status)
+    else:
+        view["content"] = message.content
+    return view
+
+
+def project_state(checkpoint_id: str, values: dict, fields: Sequence[str]) -> dict:
+    """The requested fields computed from the channel values of one checkpoint."""
+    cart = values.get("cart")
+    view = {"version": checkpoint_id}
+    for field in fields:
+        if field == "cart":
+            view["cart"] = cart.model_dump() if cart else None
+        elif field == "totals":
+            view["totals"] = cart_totals(cart, values.get("subdomain")).to_dict()
+        elif field == "messages":
+            view["messages"] = [message_view(message) for message in values.get("messages", [])]
+        else:
+            view[field] = values.get(field)
+    return view
@@ -0,0 +1,153 @@
+# ----
+# This file contains the conversation trace recorder: each completed turn of a
+# sampled session (its input, the model responses, the tool calls, the timings
+# and the menu version it saw) is appended as one JSON line to TRACE_FILE, and
+# each menu version once, for the replay harness in benchmarks/replay.py
+# ----
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import zlib
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.messages import BaseMessage, convert_to_messages, message_to_dict
+
+from configs.config import config
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_prompt_tokens(prompt: Sequence) -> int:
+    """~4 characters per token over contents and tool calls, the same count when recording and replaying."""
+    chars = 0
+    for message in convert_to_messages(prompt):
+        chars += len(str(message.content))
+        for call in getattr(message, "tool_calls", None) or []:
+            chars += len(call["name"]) + len(json.dumps(call["args"]))
+    return chars // 4
+
+
+@dataclass
+class TurnTrace:
+    session_id: str
+    subdomain: str
+    restaurant_name: str
+    input: str
+    at: float = field(default_factory=time.time)
+    started: float = field(default_factory=time.perf_counter)
+    llm: List[dict] = field(default_factory=list)
+    tools: List[dict] = field(default_factory=list)
+    # subdomain -> version of the menu the turn was served with
+    menus: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(call["prompt_tokens"] for call in self.llm)
+
+    def record(self, wall_s: float, nodes: Dict[str, float]) -> dict:
+        record = asdict(self)
+        del record["started"]
+        return {"type": "turn", **record, "wall_s": round(wall_s, 4),
+                "nodes": {name: round(seconds, 4) for name, seconds in nodes.items()}}
+
+
+# the turn being traced; graph nodes run in tasks that inherit it from the request
+_current_trace: ContextVar[Optional[TurnTrace]] = ContextVar("current_trace", default=None)
+
+
+def _tool_result(output: Any) -> str:
+    update = getattr(output, "update", None)
+    if isinstance(update, dict):
+        # a Command, its result is the ToolMessage it adds
+        messages = update.get("messages") or []
+        return str(messages[0].content) if messages else ""
+    return str(getattr(output, "content", output))
+
+
+class TraceRecorder:
+    """
+    Appends one line per traced turn. Sessions are sampled by id, so a sampled
+    session is recorded completely; turns that fail or are cut short are not.
+    """
+
+    def __init__(self, path: Optional[str], sample_rate: float):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        # menu versions already in the file, each is written once per process
+        self._menus_written: Set[Tuple[str, str]] = set()
+
+    def sampled(self, session_id: str) -> bool:
+        if not self.path:
+            return False
+        return zlib.crc32(session_id.encode()) / 2 ** 32 < self.sample_rate
+
+    def begin(self, session_id: str, graph_input: dict) -> TurnTrace:
+        """Trace the turn run from this context on, whether or not the session is sampled."""
+        trace = TurnTrace(session_id=session_id, subdomain=graph_input["subdomain"],
+                          restaurant_name=graph_input["restaurant_name"],
+                          input=graph_input["messages"][-1]["content"])
+        _current_trace.set(trace)
+        return trace
+
+    def start(self, session_id: str, graph_input: dict) -> Optional[TurnTrace]:
+        return self.begin(session_id, graph_input) if self.sampled(session_id) else None
+
+    async def finish(self, trace: Optional[TurnTrace], nodes: Dict[str, float]):
+        if trace is None:
+            return
+        _current_trace.set(None)
+        # the menu cache reports to the metrics, which import this module
+        from services.menu_cache import menu_cache
+
+        lines = []
+        entry = menu_cache.peek(trace.subdomain)
+        if entry is not None:
+            version = entry.index.version
+            trace.menus[trace.subdomain] = version
+            if (trace.subdomain, version) not in self._menus_written:
+                self._menus_written.add((trace.subdomain, version))
+                lines.append({"type": "menu", "subdomain": trace.subdomain, "version": version, "menu": entry.menu})
+        lines.append(trace.record(time.perf_counter() - trace.started, nodes))
+        try:
+            await asyncio.to_thread(self._append, lines)
+        except OSError:
+            logger.exception("Could not write the trace of %s", trace.session_id)
+
+    def _append(self, records: List[dict]):
+        data = "".join(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n" for record in records)
+        with self._lock, open(self.path, "a", encoding="utf-8") as trace_file:
+            trace_file.write(data)
+
+
+def trace_llm_call(kind: str, model: str, seconds: float, prompt: Optional[Sequence],
+                   response: BaseMessage):
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.llm.append({
+        "kind": kind,
+        "model": model,
+        "seconds": round(seconds, 4),
+        "prompt_tokens": estimate_prompt_tokens(prompt) if prompt else 0,
+        "usage": getattr(response, "usage_metadata", None),
+        "response": message_to_dict(response),
+    })
+
+
+def trace_tool_call(name: str, args: dict, status: str, seconds: float, output: Any):
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    result = _tool_result(output)
+    # the replay runs the tools again, the result is only kept as a fingerprint
+    trace.tools.append({"name": name, "args": args, "status": status, "seconds": round(seconds, 4),
+                        "result_chars": len(result), "result_crc": zlib.crc32(result.encode())})
+
+
+trace_recorder = TraceRecorder(config.TRACE_FILE, config.TRACE_SAMPLE_RATE)
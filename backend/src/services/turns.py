@@ -0,0 +1,398 @@
+# ----
+# This file contains the per-session serialization of chat turns and the
+# replay cache that answers retried requests (same idempotency key) from the
+# recording of the first attempt. With the sqlite checkpointer both go through
+# the shared database, so they hold across the workers of the host
+# ----
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from configs.config import config
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+session_conflicts = metrics.counter(
+    "chat_session_conflicts_total", "Turns refused because another turn of the session was running")
+session_lock_wait_seconds = metrics.histogram(
+    "chat_session_lock_wait_seconds", "Time a turn waited for the previous turn of its session")
+turn_replays = metrics.counter(
+    "chat_turn_replays_total", "Retried turns answered from the replay cache")
+
+
+# how often a turn checks whether another worker released the session
+LEASE_POLL_SECONDS = 0.05
+
+
+class SessionBusy(Exception):
+    """Another turn of the session is still running."""
+
+
+class IdempotencyMismatch(Exception):
+    """The idempotency key was already used for a different request."""
+
+
+@dataclass
+class RecordedTurn:
+    fingerprint: str
+    chunks: List[str]
+    # wall time, compared across worker processes
+    recorded_at: float = field(default_factory=time.time)
+
+
+class MemoryTurnStore:
+    """Recorded turns of this process only, least recently used first out; sessions need no lease."""
+
+    # leases are only needed between worker processes
+    shared = False
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._turns: "OrderedDict[Tuple[str, str], RecordedTurn]" = OrderedDict()
+
+    async def try_lease(self, session_id: str, owner: str, seconds: float) -> bool:
+        return True
+
+    async def renew_lease(self, session_id: str, owner: str, seconds: float) -> bool:
+        return True
+
+    def release_lease(self, session_id: str, owner: str):
+        pass
+
+    async def get_turn(self, session_id: str, key: str) -> Optional[RecordedTurn]:
+        turn = self._turns.get((session_id, key))
+        if turn is not None:
+            self._turns.move_to_end((session_id, key))
+        return turn
+
+    async def put_turn(self, session_id: str, key: str, turn: RecordedTurn, ttl: float):
+        self._turns[(session_id, key)] = turn
+        self._turns.move_to_end((session_id, key))
+        while len(self._turns) > self.max_entries:
+            self._turns.popitem(last=False)
+
+    def close(self):
+        pass
+
+
+class SqliteTurnStore:
+    """
+    Session leases and recorded turns in a SQLite file (WAL) shared by the
+    workers of the host. A running turn keeps renewing its lease; one left by
+    a worker that died mid-turn expires on its own after `seconds`.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # opened lazily so each worker process gets its own connection
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS session_leases (
+                    session_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS turn_replays (
+                    session_id TEXT NOT NULL,
+                    idempotency_key TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    chunks TEXT NOT NULL,
+                    recorded_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, idempotency_key)
+                );
+                CREATE INDEX IF NOT EXISTS turn_replays_age ON turn_replays (recorded_at);
+            """)
+            self._conn = conn
+        return self._conn
+
+    async def try_lease(self, session_id: str, owner: str, seconds: float) -> bool:
+        return await asyncio.to_thread(self._try_lease, session_id, owner, seconds)
+
+    def _try_lease(self, session_id: str, owner: str, seconds: float) -> bool:
+        now = time.time()
+        with self._lock:
+            return self.conn.execute(
+                "INSERT INTO session_leases (session_id, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE session_leases.expires_at < ?",
+                (session_id, owner, now + seconds, now)).rowcount > 0
+
+    async def renew_lease(self, session_id: str, owner: str, seconds: float) -> bool:
+        return await asyncio.to_thread(self._renew_lease, session_id, owner, seconds)
+
+    def _renew_lease(self, session_id: str, owner: str, seconds: float) -> bool:
+        with self._lock:
+            return self.conn.execute(
+                "UPDATE session_leases SET expires_at = ? WHERE session_id = ? AND owner = ?",
+                (time.time() + seconds, session_id, owner)).rowcount > 0
+
+    def release_lease(self, session_id: str, owner: str):
+        # synchronous, the release also runs from a garbage collected stream; a one-row delete by key
+        with self._lock:
+            self.conn.execute("DELETE FROM session_leases WHERE session_id = ? AND owner = ?", (session_id, owner))
+
+    async def get_turn(self, session_id: str, key: str) -> Optional[RecordedTurn]:
+        return await asyncio.to_thread(self._get_turn, session_id, key)
+
+    def _get_turn(self, session_id: str, key: str) -> Optional[RecordedTurn]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT fingerprint, chunks, recorded_at FROM turn_replays "
+                "WHERE session_id = ? AND idempotency_key = ?", (session_id, key)).fetchone()
+        return RecordedTurn(row[0], json.loads(row[1]), row[2]) if row else None
+
+    async def put_turn(self, session_id: str, key: str, turn: RecordedTurn, ttl: float):
+        await asyncio.to_thread(self._put_turn, session_id, key, turn, ttl)
+
+    def _put_turn(self, session_id: str, key: str, turn: RecordedTurn, ttl: float):
+        with self._lock:
+            conn = self.conn
+            conn.execute(
+                "INSERT OR REPLACE INTO turn_replays (session_id, idempotency_key, fingerprint, chunks, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, key, turn.fingerprint, json.dumps(turn.chunks), turn.recorded_at))
+            # expired turns, then the oldest beyond max_entries
+            conn.execute("DELETE FROM turn_replays WHERE recorded_at < ?", (time.time() - ttl,))
+            conn.execute(
+                "DELETE FROM turn_replays WHERE rowid IN "
+                "(SELECT rowid FROM turn_replays ORDER BY recorded_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def build_turn_store():
+    """The database of the sqlite checkpointer, whose turns it serializes; in process with the memory one."""
+    if config.CHECKPOINTER_BACKEND == "sqlite":
+        return SqliteTurnStore(config.CHECKPOINT_DB_PATH, config.IDEMPOTENCY_CACHE_SIZE)
+    return MemoryTurnStore(config.IDEMPOTENCY_CACHE_SIZE)
+
+
+@dataclass
+class _SessionLock:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # turns holding or waiting for the lock; the entry is dropped when it reaches 0
+    users: int = 0
+
+
+class SessionLocks:
+    """
+    One turn per session at a time, later turns wait for the running one. Turns
+    of this process queue on a lock, the store's lease keeps out the other workers.
+    """
+
+    def __init__(self, store, lease_seconds: float):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self._locks: Dict[str, _SessionLock] = {}
+
+    def busy(self, session_id: str) -> bool:
+        entry = self._locks.get(session_id)
+        return entry is not None and entry.lock.locked()
+
+    async def acquire(self, session_id: str, timeout: float) -> Callable[[], None]:
+        """
+        Wait up to `timeout` seconds for the session, raising SessionBusy after
+        that. Returns the release function, which is safe to call more than once.
+        """
+        if timeout <= 0 and self.busy(session_id):
+            session_conflicts.inc()
+            raise SessionBusy(f"a turn of session {session_id} is already running")
+
+        entry = self._locks.setdefault(session_id, _SessionLock())
+        entry.users += 1
+        started = time.perf_counter()
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        try:
+            await asyncio.wait_for(entry.lock.acquire(), timeout if timeout > 0 else None)
+        except asyncio.TimeoutError:
+            self._leave(session_id, entry)
+            session_conflicts.inc()
+            raise SessionBusy(f"a turn of session {session_id} is still running")
+        except BaseException:
+            self._leave(session_id, entry)
+            raise
+        try:
+            # a turn of the session may be running on another worker
+            leased = await self._lease(session_id, owner, started + timeout)
+        except BaseException:
+            entry.lock.release()
+            self._leave(session_id, entry)
+            raise
+        if not leased:
+            entry.lock.release()
+            self._leave(session_id, entry)
+            session_conflicts.inc()
+            raise SessionBusy(f"a turn of session {session_id} is running on another worker")
+        session_lock_wait_seconds.observe(time.perf_counter() - started)
+        # held for as long as the turn runs, however long its model calls take
+        renewal = asyncio.create_task(self._renew(session_id, owner)) if self.store.shared else None
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                # a stream garbage collected after shutdown outlives the loop of its renewal
+                if renewal is not None and not renewal.get_loop().is_closed():
+                    renewal.cancel()
+                self._release_lease(session_id, owner)
+                entry.lock.release()
+                self._leave(session_id, entry)
+
+        return release
+
+    async def _lease(self, session_id: str, owner: str, deadline: float) -> bool:
+        """Take the store's lease on the session, polling until `deadline`."""
+        while True:
+            attempt = asyncio.ensure_future(self.store.try_lease(session_id, owner, self.lease_seconds))
+            try:
+                if await asyncio.shield(attempt):
+                    return True
+            except asyncio.CancelledError:
+                # the attempt goes on in its thread, give the lease back should it get it
+                attempt.add_done_callback(
+                    lambda done: done.cancelled() or done.exception() is not None or not done.result()
+                    or self._release_lease(session_id, owner))
+                raise
+            if time.perf_counter() >= deadline:
+                return False
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+
+    async def _renew(self, session_id: str, owner: str):
+        """Extend the lease every third of its lifetime until the turn releases it."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await self.store.renew_lease(session_id, owner, self.lease_seconds)
+            except sqlite3.Error:
+                # the next renewal may get through before the lease runs out
+                logger.exception("Could not renew the lease of session %s", session_id)
+                continue
+            if not renewed:
+                # stalled past the expiry and another worker took the session over
+                logger.warning("Lease of session %s was lost while its turn was running", session_id)
+                return
+
+    def _release_lease(self, session_id: str, owner: str):
+        try:
+            self.store.release_lease(session_id, owner)
+        except sqlite3.Error:
+            # it expires on its own
+            logger.exception("Could not release the lease of session %s", session_id)
+
+    def _leave(self, session_id: str, entry: _SessionLock):
+        entry.users -= 1
+        if entry.users == 0 and self._locks.get(session_id) is entry:
+            del self._locks[session_id]
+
+    @staticmethod
+    def hold(stream: AsyncIterator[str], release: Callable[[], None]) -> AsyncIterator[str]:
+        """Keep the session locked until `stream` is exhausted, fails or is dropped."""
+
+        async def held():
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                release()
+
+        guarded = held()
+        # a stream that is never iterated (client gone before the first byte) never
+        # runs its finally block, release it when it is garbage collected instead
+        weakref.finalize(guarded, release)
+        return guarded
+
+
+def request_fingerprint(*parts: object) -> str:
+    """Identifies the request an idempotency key was first used with."""
+    return hashlib.sha256("\x1f".join(map(str, parts)).encode()).hexdigest()
+
+
+class ReplayCache:
+    """
+    Completed turns keyed by (session id, idempotency key), kept in the store.
+    Turns whose stream did not finish are not recorded, so a retry after a
+    failure runs the turn again.
+    """
+
+    def __init__(self, store, ttl: float, max_turn_bytes: int):
+        self.store = store
+        self.ttl = ttl
+        self.max_turn_bytes = max_turn_bytes
+
+    async def get(self, session_id: str, key: str, fingerprint: str) -> Optional[RecordedTurn]:
+        turn = await self.store.get_turn(session_id, key)
+        if turn is None or time.time() - turn.recorded_at > self.ttl:
+            return None
+        if turn.fingerprint != fingerprint:
+            raise IdempotencyMismatch(f"Idempotency key {key!r} was used for a different request")
+        return turn
+
+    async def record(self, session_id: str, key: str, fingerprint: str,
+                     stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        Pass `stream` through, storing its events once it has been sent
+        completely. A turn with an error event is not stored, its retry runs again.
+        """
+        chunks, size = [], 0
+        async for chunk in stream:
+            if chunk.startswith("event: error\n"):
+                chunks = None
+            if chunks is not None:
+                size += len(chunk)
+                if size > self.max_turn_bytes:
+                    logger.debug("Turn of %s too large to record for replay", session_id)
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            try:
+                await self.store.put_turn(session_id, key, RecordedTurn(fingerprint, chunks), self.ttl)
+            except sqlite3.Error:
+                # the turn was answered, only its replay is lost
+                logger.exception("Could not record the turn of %s for replay", session_id)
+
+    @staticmethod
+    async def replay(turn: RecordedTurn) -> AsyncIterator[str]:
+        turn_replays.inc()
+        for chunk in turn.chunks:
+            yield chunk
+
+
+turn_store = build_turn_store()
+session_locks = SessionLocks(turn_store, lease_seconds=config.SESSION_LEASE_SECONDS)
+replay_cache = ReplayCache(
+    store=turn_store,
+    ttl=config.IDEMPOTENCY_TTL_SECONDS,
+    max_turn_bytes=config.IDEMPOTENCY_MAX_TURN_BYTES,
+)
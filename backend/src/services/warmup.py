@@ -0,0 +1,58 @@
+# ----
+# This file contains the start-up warm-up: the agent graph, the model clients
+# and the menus of configured tenants are prepared in the background while the
+# server already accepts connections, /ready reports when it is done
+# ----
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WarmUp:
+    def __init__(self):
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        # step -> seconds it took
+        self.steps: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self._ready = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    async def wait(self):
+        await self._ready.wait()
+
+    async def step(self, name: str, run: Callable[[], Awaitable]):
+        started = time.perf_counter()
+        try:
+            await run()
+        except Exception as e:
+            # a failed step is retried lazily by the first turn that needs it, never fatal
+            logger.exception("Warm-up step %s failed", name)
+            self.errors[name] = str(e)
+        self.steps[name] = round(time.perf_counter() - started, 3)
+
+    async def run(self, *steps: Awaitable):
+        """Run the steps concurrently and mark the process ready once all are done."""
+        self.started = time.perf_counter()
+        await asyncio.gather(*steps)
+        self.finished = time.perf_counter()
+        self._ready.set()
+        logger.info("Warm-up done in %.2fs %s", self.finished - self.started, self.steps)
+
+    def status(self) -> dict:
+        status = {"status": "ready" if self.ready else "warming_up", "steps": self.steps}
+        if self.errors:
+            status["errors"] = self.errors
+        if self.finished is not None:
+            status["seconds"] = round(self.finished - self.started, 3)
+        return status
+
+
+warm_up = WarmUp()
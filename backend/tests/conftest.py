@@ -0,0 +1,12 @@
+# ----
+# Settings the app reads at import time; the tests run offline and keep their
+# databases in pytest's temporary directories
+# ----
+
+import os
+
+os.environ.setdefault("MENU_BACKEND_URL", "http://127.0.0.1:9/menu")
+os.environ.setdefault("PORT", "7000")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+# module-level stores are built on import, in memory rather than in the working directory
+os.environ.setdefault("CHECKPOINTER_BACKEND", "memory")
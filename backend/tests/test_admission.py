@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected, FairLimiter
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_slots_are_held_up_to_the_limit_and_freed_on_release():
+    async def scenario():
+        limiter = FairLimiter(limit=2, max_queue=10, max_queue_per_tenant=10)
+        await limiter.acquire("a", timeout=1)
+        await limiter.acquire("a", timeout=1)
+        assert limiter.in_flight == 2
+
+        waiter = asyncio.create_task(limiter.acquire("b", timeout=1))
+        await asyncio.sleep(0)
+        assert limiter.queued() == 1
+
+        # the slot passes straight to the waiter
+        limiter.release()
+        await waiter
+        assert (limiter.in_flight, limiter.queued()) == (2, 0)
+
+        limiter.release()
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    run(scenario())
+
+
+def test_freed_slots_go_round_robin_across_tenants():
+    async def scenario():
+        limiter = FairLimiter(limit=1, max_queue=10, max_queue_per_tenant=10)
+        await limiter.acquire("busy", timeout=1)
+        served = []
+
+        async def wait(tenant):
+            await limiter.acquire(tenant, timeout=1)
+            served.append(tenant)
+
+        tasks = [asyncio.create_task(wait(tenant)) for tenant in ("busy", "busy", "quiet")]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert served == ["busy", "quiet", "busy"]
+
+    run(scenario())
+
+
+def test_timed_out_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = FairLimiter(limit=1, max_queue=10, max_queue_per_tenant=10)
+        await limiter.acquire("a", timeout=1)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await limiter.acquire("b", timeout=0.01)
+        assert rejected.value.reason == "llm_queue_timeout"
+        assert (limiter.in_flight, limiter.queued()) == (1, 0)
+
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    run(scenario())
+
+
+def test_slot_handed_over_as_the_wait_ends_is_given_back():
+    async def scenario():
+        limiter = FairLimiter(limit=1, max_queue=10, max_queue_per_tenant=10)
+        limiter.in_flight = 1
+        # release() set the waiter's result, then its timeout or cancellation fired
+        handed_over = asyncio.get_running_loop().create_future()
+        handed_over.set_result(None)
+        limiter._give_back("b", handed_over)
+        assert limiter.in_flight == 0
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = FairLimiter(limit=1, max_queue=10, max_queue_per_tenant=10)
+        await limiter.acquire("a", timeout=1)
+        waiter = asyncio.create_task(limiter.acquire("b", timeout=1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert (limiter.in_flight, limiter.queued()) == (1, 0)
+
+    run(scenario())
+
+
+def test_full_queues_are_rejected_straight_away():
+    async def scenario():
+        limiter = FairLimiter(limit=1, max_queue=2, max_queue_per_tenant=1)
+        await limiter.acquire("a", timeout=1)
+        waiter = asyncio.create_task(limiter.acquire("a", timeout=1))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await limiter.acquire("a", timeout=1)
+        assert (rejected.value.status, rejected.value.reason) == (429, "tenant_queue_full")
+        waiter.cancel()
+
+    run(scenario())
+
+
+def test_refunded_turn_does_not_use_up_the_rate():
+    controller = AdmissionController(
+        llm_concurrency=1, max_queue=10, max_queue_per_tenant=10, max_wait=1,
+        turns_per_minute=60, burst=1)
+    controller.admit("t")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("t")
+    assert (rejected.value.status, rejected.value.reason) == (429, "rate_limited")
+
+    controller.refund("t")
+    controller.admit("t")
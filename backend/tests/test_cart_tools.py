@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+
+from agents.state import Cart
+from agents.tools import cart as cart_tools
+from agents.tools.cart import CartOperation, apply_operation, update_cart
+from services.menu_index import MenuIndex
+
+MENU = {"items": [{
+    "category": {"id": "main", "title": "Main Course"},
+    "items": [
+        {"id": "paneer", "title": "Paneer Butter Masala", "basePrice": 320},
+        {"id": "biryani", "title": "Veg Biryani", "variations": [
+            {"id": "half", "name": "Half", "price": 150},
+            {"id": "full", "name": "Full", "price": 250},
+        ]},
+        {"id": "kulfi", "title": "Kulfi", "basePrice": 60, "availability": {"isAvailable": False}},
+    ],
+}]}
+
+
+@pytest.fixture
+def menu(monkeypatch):
+    index = MenuIndex(MENU)
+
+    async def menu_index_for(subdomain):
+        return index
+
+    monkeypatch.setattr(cart_tools, "menu_index_for", menu_index_for)
+    return index
+
+
+def cart_with(*operations: CartOperation) -> Cart:
+    cart = Cart()
+    for operation in operations:
+        apply_operation(cart, operation)
+    return cart
+
+
+def run_update(cart: Cart, operations: list):
+    state = {"messages": [], "cart": cart, "orderId": None, "finished": False,
+             "restaurant_name": "Test Kitchen", "subdomain": "r1"}
+    return asyncio.run(update_cart.ainvoke({
+        "type": "tool_call", "id": "call_1", "name": "update_cart",
+        "args": {"operations": operations, "state": state},
+    }))
+
+
+def test_batch_is_applied_with_menu_prices(menu):
+    command = run_update(Cart(), [
+        {"op": "add", "item_id": "paneer", "title": "Paneer Butter Masala", "quantity": 2},
+        {"op": "add", "item_id": "biryani", "title": "Veg Biryani", "quantity": 1,
+         "variation": {"id": "full", "name": "Full", "price": "0"}},
+    ])
+    cart = command.update["cart"]
+    assert {key: (line.quantity, line.base_price) for key, line in cart.lines.items()} == {
+        "paneer|no_variant": (2, 320.0), "biryani|full": (1, 250.0)}
+    assert cart.subtotal_cents == 89000
+    assert command.update["messages"][0].status == "success"
+
+
+def test_one_failed_operation_leaves_the_cart_unchanged(menu):
+    cart = cart_with(CartOperation(op="add", item_id="paneer", title="Paneer Butter Masala",
+                                   quantity=1, base_price=320))
+    command = run_update(cart, [
+        {"op": "add", "item_id": "paneer", "title": "Paneer Butter Masala", "quantity": 1},
+        {"op": "add", "item_id": "kulfi", "title": "Kulfi", "quantity": 1},
+        {"op": "remove", "item_id": "paneer", "title": "Paneer Butter Masala", "quantity": 1},
+    ])
+
+    assert "cart" not in command.update
+    message = command.update["messages"][0]
+    assert message.status == "error"
+    results = json.loads(message.content)["results"]
+    assert [result["status"] for result in results] == ["ok", "failed", "ok"]
+    assert results[1]["code"] == "unavailable"
+    # the state's cart was copied, never edited
+    assert cart.lines["paneer|no_variant"].quantity == 1
+
+
+def test_adds_are_refused_without_a_menu(monkeypatch):
+    async def menu_index_for(subdomain):
+        return None
+
+    monkeypatch.setattr(cart_tools, "menu_index_for", menu_index_for)
+    command = run_update(Cart(), [
+        {"op": "add", "item_id": "paneer", "title": "Paneer Butter Masala", "quantity": 1, "base_price": 1},
+    ])
+    assert "cart" not in command.update
+    assert json.loads(command.update["messages"][0].content)["results"][0]["code"] == "menu_unavailable"
+
+
+def test_removal_never_touches_another_variant(menu):
+    cart = cart_with(CartOperation(op="add", item_id="biryani", title="Veg Biryani", quantity=1, base_price=150,
+                                   variation={"id": "half", "name": "Half", "price": "150"}))
+    command = run_update(cart, [
+        {"op": "remove", "item_id": "biryani", "title": "Veg Biryani", "quantity": 1,
+         "variation": {"id": "", "name": "Full", "price": "0"}},
+    ])
+    assert "cart" not in command.update
+    assert json.loads(command.update["messages"][0].content)["results"][0]["code"] == "not_in_cart"
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.base import create_checkpoint, empty_checkpoint
+
+from agents.checkpointer import SHARED_STRING_MIN_SIZE, SqliteCheckpointer
+from agents.state import Cart
+
+MENU = "m" * (SHARED_STRING_MIN_SIZE * 4)
+
+
+@pytest.fixture
+def checkpointer(tmp_path):
+    checkpointer = SqliteCheckpointer(str(tmp_path / "checkpoints.sqlite"), keep_latest=2)
+    yield checkpointer
+    checkpointer.close()
+
+
+def conversation(*extra):
+    return [
+        HumanMessage("hi", id="h1"),
+        AIMessage("", id="a1", tool_calls=[{"name": "get_menu", "args": {}, "id": "call_1"}]),
+        ToolMessage(MENU, name="get_menu", tool_call_id="call_1", id="t1", artifact={"version": "v1"}),
+        *extra,
+    ]
+
+
+def put(checkpointer, thread_id, messages, parent=None, step=0):
+    checkpoint = create_checkpoint(parent, None, step) if parent else empty_checkpoint()
+    version = str(step + 1)
+    checkpoint["channel_values"] = {"messages": messages, "cart": Cart(), "finished": False}
+    checkpoint["channel_versions"] = {"messages": version, "cart": version, "finished": version}
+    config = checkpointer.put(
+        {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}, checkpoint, {"step": step},
+        checkpoint["channel_versions"])
+    return checkpoint, config
+
+
+def latest_messages(checkpointer, thread_id):
+    checkpoint_tuple = checkpointer.get_tuple({"configurable": {"thread_id": thread_id}})
+    return checkpoint_tuple.checkpoint["channel_values"]["messages"]
+
+
+def count(checkpointer, table):
+    return checkpointer._execute(f"SELECT COUNT(*) FROM {table}")[0][0]
+
+
+def test_messages_round_trip(checkpointer):
+    messages = conversation(AIMessage("Namaste!", id="a2"))
+    put(checkpointer, "s1", messages)
+    # read back by another process, without the reference cache
+    checkpointer._message_refs.clear()
+    loaded = latest_messages(checkpointer, "s1")
+    assert loaded == messages
+    assert loaded[2].artifact == {"version": "v1"}
+
+
+def test_large_contents_are_stored_once(checkpointer):
+    first, _ = put(checkpointer, "s1", conversation())
+    put(checkpointer, "s2", conversation())
+    stored = count(checkpointer, "items")
+    # same menu in another message of a later checkpoint
+    put(checkpointer, "s1", conversation(ToolMessage(MENU, name="get_menu", tool_call_id="call_2", id="t2")),
+        parent=first, step=1)
+    assert count(checkpointer, "items") == stored + 1
+    assert count(checkpointer, "items") < 2 * len(conversation())
+
+
+def test_unchanged_messages_are_written_again_after_a_sweep(checkpointer):
+    first, _ = put(checkpointer, "s1", conversation())
+    # the sweeper dropped the thread's rows while the process still caches the messages
+    checkpointer.delete_thread("s1")
+    checkpointer._execute("DELETE FROM items WHERE NOT EXISTS (SELECT 1 FROM refs WHERE refs.hash = items.hash)")
+    assert count(checkpointer, "items") == 0
+
+    messages = conversation(AIMessage("Namaste!", id="a2"))
+    put(checkpointer, "s1", [*first["channel_values"]["messages"], messages[-1]], parent=first, step=1)
+    checkpointer._message_refs.clear()
+    assert latest_messages(checkpointer, "s1") == messages
+
+
+def test_pinned_thread_is_read_from_memory_until_another_worker_writes(checkpointer):
+    first, _ = put(checkpointer, "s1", conversation())
+    checkpointer.pin("s1")
+    resident = checkpointer.get_tuple({"configurable": {"thread_id": "s1"}})
+    assert checkpointer._resident["s1"][0] == resident.checkpoint["id"]
+
+    other_worker = SqliteCheckpointer(checkpointer.path, keep_latest=2)
+    newer = conversation(AIMessage("from the other worker", id="a2"))
+    put(other_worker, "s1", newer, parent=first, step=1)
+    other_worker.close()
+    assert latest_messages(checkpointer, "s1") == newer
+
+    checkpointer.unpin("s1")
+    assert "s1" not in checkpointer._resident
+
+
+def test_only_the_latest_checkpoints_are_kept(checkpointer):
+    parent = None
+    for step in range(5):
+        parent, _ = put(checkpointer, "s1", conversation(AIMessage(f"turn {step}", id=f"a{step + 2}")),
+                        parent=parent, step=step)
+    assert count(checkpointer, "checkpoints") == 2
+    assert latest_messages(checkpointer, "s1")[-1].content == "turn 4"
+
+
+def test_async_reads_match_sync_reads(checkpointer):
+    put(checkpointer, "s1", conversation())
+    checkpoint_tuple = asyncio.run(checkpointer.aget_tuple({"configurable": {"thread_id": "s1"}}))
+    assert checkpoint_tuple.checkpoint["channel_values"]["messages"] == conversation()
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from services.turns import (IdempotencyMismatch, MemoryTurnStore, ReplayCache, SessionBusy, SessionLocks,
+                            SqliteTurnStore)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryTurnStore(max_entries=16)
+    else:
+        store = SqliteTurnStore(str(tmp_path / "turns.sqlite"), max_entries=16)
+        yield store
+        store.close()
+
+
+async def stream(*chunks: str):
+    for chunk in chunks:
+        yield chunk
+
+
+async def drain(chunks) -> list:
+    return [chunk async for chunk in chunks]
+
+
+def test_finished_turn_is_replayed_for_its_key(store):
+    async def scenario():
+        cache = ReplayCache(store, ttl=60, max_turn_bytes=1 << 16)
+        sent = await drain(cache.record("s1", "k1", "fp", stream("data: a\n\n", "data: [DONE]\n\n")))
+        recorded = await cache.get("s1", "k1", "fp")
+        assert recorded is not None
+        assert await drain(cache.replay(recorded)) == sent
+        # keys are per session
+        assert await cache.get("s2", "k1", "fp") is None
+
+    asyncio.run(scenario())
+
+
+def test_key_reused_for_another_request_is_refused(store):
+    async def scenario():
+        cache = ReplayCache(store, ttl=60, max_turn_bytes=1 << 16)
+        await drain(cache.record("s1", "k1", "fp", stream("data: a\n\n")))
+        with pytest.raises(IdempotencyMismatch):
+            await cache.get("s1", "k1", "another fp")
+
+    asyncio.run(scenario())
+
+
+def test_failed_or_unfinished_turns_run_again(store):
+    async def scenario():
+        cache = ReplayCache(store, ttl=60, max_turn_bytes=1 << 16)
+        await drain(cache.record("s1", "failed", "fp", stream("event: error\ndata: {}\n\n", "data: [DONE]\n\n")))
+        assert await cache.get("s1", "failed", "fp") is None
+
+        unfinished = cache.record("s1", "dropped", "fp", stream("data: a\n\n", "data: b\n\n"))
+        await unfinished.__anext__()
+        await unfinished.aclose()
+        assert await cache.get("s1", "dropped", "fp") is None
+
+        small = ReplayCache(store, ttl=60, max_turn_bytes=10)
+        await drain(small.record("s1", "too large", "fp", stream("x" * 100)))
+        assert await small.get("s1", "too large", "fp") is None
+
+    asyncio.run(scenario())
+
+
+def test_recordings_expire(store):
+    async def scenario():
+        await drain(ReplayCache(store, ttl=60, max_turn_bytes=1 << 16).record("s1", "k1", "fp", stream("data: a\n\n")))
+        assert await ReplayCache(store, ttl=0, max_turn_bytes=1 << 16).get("s1", "k1", "fp") is None
+
+    asyncio.run(scenario())
+
+
+def test_one_turn_per_session_at_a_time(store):
+    async def scenario():
+        locks = SessionLocks(store, lease_seconds=30)
+        release = await locks.acquire("s1", timeout=1)
+        with pytest.raises(SessionBusy):
+            await locks.acquire("s1", timeout=0.05)
+        other = await locks.acquire("s2", timeout=1)
+        release()
+        # safe to call twice
+        release()
+        again = await locks.acquire("s1", timeout=1)
+        again()
+        other()
+        assert not locks._locks
+
+    asyncio.run(scenario())
+
+
+def test_lease_keeps_other_workers_out_while_the_turn_runs(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "turns.sqlite")
+        worker, other_worker = SqliteTurnStore(path, 16), SqliteTurnStore(path, 16)
+        release = await SessionLocks(worker, lease_seconds=0.3).acquire("s1", timeout=1)
+        # longer than the lease, which the running turn renews
+        await asyncio.sleep(0.8)
+        with pytest.raises(SessionBusy):
+            await SessionLocks(other_worker, lease_seconds=0.3).acquire("s1", timeout=0.1)
+
+        release()
+        taken = await SessionLocks(other_worker, lease_seconds=0.3).acquire("s1", timeout=0.5)
+        taken()
+        worker.close()
+        other_worker.close()
+
+    asyncio.run(scenario())